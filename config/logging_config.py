@@ -0,0 +1,137 @@
+"""
+Настройка логирования: записи кладутся в очередь, форматирование и вывод —
+в фоновом потоке, чтобы логирование не блокировало event loop.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from config.settings import settings
+from services import metrics, tracing
+
+LOG_DROPPED = metrics.counter(
+    "log_records_dropped_total", "Записи лога, отброшенные из-за переполнения очереди"
+)
+
+# Атрибуты LogRecord; все остальное пришло через extra и выводится как поля
+# (color_message добавляет uvicorn — дубль message с ANSI-цветами)
+_RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "color_message"}
+
+_listener: Optional[QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> dict[str, Any]:
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS}
+
+
+def _truncate(value: Any) -> str:
+    """Компактный JSON, обрезанный до LOG_PAYLOAD_MAX_CHARS."""
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    limit = settings.LOG_PAYLOAD_MAX_CHARS
+    if len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit})"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in _extra_fields(record).items():
+            data[key] = _truncate(value) if key == "payload" else value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат, поля из extra дописываются как key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(
+                f"{key}={_truncate(value) if key == 'payload' else value}" for key, value in fields.items()
+            )
+        return line
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() форматирует сообщение и traceback сразу; здесь
+    в записи только фиксируется trace_id (contextvar доступен лишь в потоке
+    вызова), а при переполнении очереди запись отбрасывается.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not hasattr(record, "trace_id"):
+            trace_id = tracing.current_trace_id()
+            if trace_id:
+                record.trace_id = trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+def setup_logging():
+    """Настроить корневой логгер (повторный вызов ничего не делает)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.handlers = [_NonBlockingQueueHandler(log_queue)]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописать оставшиеся записи и остановить фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, **fields):
+    """
+    Записать тело запроса/ответа с вероятностью LOG_PAYLOAD_SAMPLE_RATE.
+
+    Сериализация и обрезка до LOG_PAYLOAD_MAX_CHARS выполняются в потоке
+    логирования; на DEBUG тело пишется всегда.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={**fields, "payload": payload})
+    elif logger.isEnabledFor(logging.INFO) and random.random() < settings.LOG_PAYLOAD_SAMPLE_RATE:
+        logger.info(message, extra={**fields, "payload": payload})
@@ -1,6 +1,7 @@
 """Конфигурация приложения."""
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, cast
 
 from pydantic_settings import BaseSettings
 
@@ -13,22 +14,169 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str
+    # Пул соединений сессий; LISTEN и блокировки лидеров держат отдельные
+    # соединения вне пула
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
 
     # Gen API
     GEN_API_URL: str
     GEN_API_KEY: str
     CALLBACK_URL: str
+    GEN_API_TIMEOUT: float = 30.0
+    GEN_API_CONNECT_TIMEOUT: float = 10.0
+    GEN_API_POOL_LIMIT: int = 100
+    GEN_API_POOL_LIMIT_PER_HOST: int = 20
+    GEN_API_KEEPALIVE_TIMEOUT: float = 60.0
+    GEN_API_DNS_CACHE_TTL: int = 300
+    GEN_API_STATUS_URL: str = "https://api.gen-api.ru/api/v1/request/get/{request_id}"
+
+    # Сверка задач, для которых не пришел callback
+    RECONCILE_ENABLED: bool = True
+    RECONCILE_INTERVAL: float = 60.0
+    RECONCILE_STALE_AFTER: float = 300.0
+    RECONCILE_DEADLINE: float = 3600.0
+    RECONCILE_BATCH_SIZE: int = 100
+    RECONCILE_CONCURRENCY: int = 5
 
     # YooKassa
     YOOKASSA_SHOP_ID: str
     YOOKASSA_SECRET_KEY: str
     YOOKASSA_WEBHOOK_URL: str
+    YOOKASSA_API_URL: str = "https://api.yookassa.ru/v3"
+    YOOKASSA_TIMEOUT: float = 15.0
+    YOOKASSA_POOL_LIMIT: int = 20
+    YOOKASSA_MAX_RETRIES: int = 3
+    YOOKASSA_RETRY_DELAY: float = 1.0
+
+    # Сверка платежей, по которым не пришел webhook YooKassa
+    PAYMENT_RECONCILE_ENABLED: bool = True
+    PAYMENT_RECONCILE_INTERVAL: float = 300.0
+    PAYMENT_RECONCILE_STALE_AFTER: float = 600.0
+    PAYMENT_RECONCILE_BATCH_SIZE: int = 100
+    PAYMENT_RECONCILE_CONCURRENCY: int = 5
+    # Неоплаченный платеж старше этого срока помечается expired
+    PAYMENT_EXPIRE_AFTER: float = 86400.0
 
     # Bot settings
     BOT_USERNAME: str
     START_CREDITS: int = 10
     GENERATION_COST: int = 2
 
+    # Помесячные партиции generation_tasks и их хранение. Поиск по request_id
+    # идет в партициях последних GEN_TASK_HOT_DAYS дней (должно быть больше
+    # RECONCILE_DEADLINE). Партиции создаются при старте и раз в
+    # GEN_TASK_PARTITIONS_INTERVAL; при GEN_TASK_RETENTION_ENABLED партиции
+    # старше GEN_TASK_RETENTION_DAYS выгружаются в GEN_TASK_ARCHIVE_DIR
+    # (JSONL.gz) и удаляются
+    GEN_TASK_HOT_DAYS: int = 7
+    GEN_TASK_PARTITIONS_AHEAD: int = 2
+    GEN_TASK_PARTITIONS_INTERVAL: float = 3600.0
+    GEN_TASK_RETENTION_ENABLED: bool = True
+    GEN_TASK_RETENTION_DAYS: int = 180
+    GEN_TASK_RETENTION_INTERVAL: float = 3600.0
+    GEN_TASK_ARCHIVE_DIR: str = "archive"
+
+    # Администраторы: /stats в боте и /admin/stats (заголовок X-Admin-Token)
+    ADMIN_IDS: list[int] = []
+    ADMIN_API_TOKEN: Optional[str] = None
+
+    # Пакетная генерация по альбому
+    ALBUM_COLLECT_DELAY: float = 0.6
+    GEN_BATCH_MAX_ITEMS: int = 10
+
+    # Очередь запуска генераций: подтверждение ставит задачи в БД, воркеры
+    # диспетчера отправляют их провайдеру
+    GEN_SUBMIT_CONCURRENCY: int = 16
+    GEN_SUBMIT_BATCH_SIZE: int = 16
+    GEN_SUBMIT_POLL_INTERVAL: float = 1.0
+    GEN_SUBMIT_MAX_ATTEMPTS: int = 5
+    # Повторы с экспоненциальной задержкой: 5, 10, 20, ... секунд, не больше максимума
+    GEN_SUBMIT_RETRY_DELAY: float = 5.0
+    GEN_SUBMIT_RETRY_MAX_DELAY: float = 300.0
+    # Аренда задачи воркером: после нее задачу упавшего процесса заберет другой
+    GEN_SUBMIT_LEASE: float = 120.0
+
+    # Кэш пользователей
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: float = 60.0
+
+    # Роль процесса: "all" — все в одном процессе; "ingress" — HTTP-маршруты и
+    # обновления бота; "dispatcher" — доставка результатов и фоновые задачи
+    APP_ROLE: str = "all"
+    # Результаты генерации, ожидающие доставки, забираются из БД по NOTIFY
+    # и раз в OUTBOX_POLL_INTERVAL секунд
+    OUTBOX_POLL_INTERVAL: float = 1.0
+    OUTBOX_BATCH_SIZE: int = 100
+    # Забранный результат, не доставленный за OUTBOX_DELIVERY_LEASE секунд
+    # (процесс упал или остановился), возвращается в очередь доставки;
+    # проверка — раз в OUTBOX_SWEEP_INTERVAL
+    OUTBOX_DELIVERY_LEASE: float = 600.0
+    OUTBOX_SWEEP_INTERVAL: float = 60.0
+    # Фоновые задачи в одном экземпляре: лидер выбирается через advisory lock
+    LEADER_CHECK_INTERVAL: float = 5.0
+
+    # Telegram updates: "polling" (для разработки) или "webhook"
+    BOT_MODE: str = "polling"
+    # Свой Bot API сервер (локальный telegram-bot-api или заглушка fakes.telegram)
+    TELEGRAM_API_SERVER: Optional[str] = None
+    TELEGRAM_WEBHOOK_URL: Optional[str] = None
+    REDIS_URL: Optional[str] = None
+
+    # Подготовка входных изображений (уменьшение и перекодирование)
+    PREPROCESS_ENABLED: bool = True
+    PREPROCESS_WORKERS: int = 2
+    PREPROCESS_JPEG_QUALITY: int = 90
+
+    # Кэш результатов генерации
+    RESULT_CACHE_ENABLED: bool = False
+    RESULT_CACHE_TTL: float = 86400.0
+    RESULT_CACHE_SIZE: int = 10000
+
+    # Anti-flood: общий лимит на пользователя и лимиты команд (rate в секунду, burst)
+    THROTTLE_ENABLED: bool = True
+    THROTTLE_RATE: float = 2.0
+    THROTTLE_BURST: float = 5.0
+    THROTTLE_COMMAND_LIMITS: dict[str, tuple[float, float]] = {
+        "start": (0.2, 2),
+        "photo": (0.2, 2),
+        "status": (0.5, 3),
+        "history": (0.5, 3),
+        "buy_subscription": (0.2, 2),
+        "confirm": (0.2, 2),
+        "plan": (0.1, 2),
+    }
+    THROTTLE_NOTICE_INTERVAL: float = 5.0
+
+    # Доставка сообщений в Telegram
+    DELIVERY_WORKERS: int = 4
+    DELIVERY_QUEUE_SIZE: int = 10000
+    DELIVERY_GLOBAL_RATE: float = 25.0
+    DELIVERY_CHAT_RATE: float = 1.0
+    DELIVERY_CHAT_BURST: float = 3.0
+    DELIVERY_MAX_RETRIES: int = 5
+
+    # Трассировка: спаны в памяти (/debug/traces) и в JSONL-файле. Файл пишет
+    # фоновый поток; при переполнении очереди TRACE_QUEUE_SIZE спаны в файл
+    # не попадают (trace_spans_dropped_total)
+    TRACING_ENABLED: bool = True
+    TRACE_BUFFER_SIZE: int = 5000
+    TRACE_FILE: Optional[str] = None
+    TRACE_QUEUE_SIZE: int = 10000
+    # Токен для /debug/*: без него отладочные эндпоинты выключены
+    DEBUG_TOKEN: Optional[str] = None
+
+    # Логирование: JSON-строки ("json") или прежний текстовый формат ("text");
+    # форматирование и вывод выполняются в фоновом потоке
+    LOG_FORMAT: str = "json"
+    LOG_LEVEL: str = "INFO"
+    # Уровни отдельных логгеров, например {"aiogram.event": "INFO"}
+    LOG_LEVELS: dict[str, str] = {"aiogram.event": "WARNING"}
+    LOG_QUEUE_SIZE: int = 10000
+    # Тела запросов/ответов внешних сервисов: доля записываемых и максимальная длина
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.01
+    LOG_PAYLOAD_MAX_CHARS: int = 2000
+
     # FastAPI
     WEBHOOK_SECRET: Optional[str] = None
     PORT: int = 8000
@@ -39,6 +187,27 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """Прочитать настройки (один раз за процесс)."""
+    return Settings()
+
+
+class _LazySettings:
+    """
+    Прокси настроек: Settings() создается при первом обращении к атрибуту.
+
+    Импорт модулей не читает окружение и .env, поэтому ошибки конфигурации
+    и затраты на валидацию переносятся на старт приложения.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(get_settings(), name, value)
+
+
+settings = cast(Settings, _LazySettings())
 
 
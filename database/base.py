@@ -1,15 +1,68 @@
 """Базовые настройки базы данных."""
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import NullPool
 
 from config.settings import settings
+from services import metrics, tracing
+
+# Engine и фабрика сессий создаются при первом обращении, а не при импорте
+_engine: Optional[AsyncEngine] = None
+_session_maker: Optional[async_sessionmaker[AsyncSession]] = None
+_dedicated_engine: Optional[AsyncEngine] = None
+
+
+def get_engine() -> AsyncEngine:
+    """Получить (или создать) async engine."""
+    global _engine, _session_maker
+    if _engine is None:
+        _engine = create_async_engine(
+            settings.DATABASE_URL,
+            echo=False,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+        tracing.instrument_engine(_engine.sync_engine)
+        _session_maker = async_sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False)
+    return _engine
+
+
+def get_dedicated_engine() -> AsyncEngine:
+    """
+    Engine без пула для долгоживущих соединений (LISTEN, блокировки лидеров).
 
-# Создаем async engine
-engine = create_async_engine(settings.DATABASE_URL, echo=False)
+    Такие соединения не занимают пул сессий, а при закрытии закрываются
+    физически — вместе с ними снимаются и session-level блокировки.
+    """
+    global _dedicated_engine
+    if _dedicated_engine is None:
+        _dedicated_engine = create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+    return _dedicated_engine
 
-# Создаем async session factory
-async_session_maker = async_sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
+
+def async_session_maker() -> AsyncSession:
+    """Создать сессию базы данных."""
+    get_engine()
+    return _session_maker()
+
+
+# Состояние пула соединений читается при каждом запросе /metrics
+metrics.gauge(
+    "db_pool_checked_out",
+    "Соединения пула, выданные сессиям",
+    function=lambda: get_engine().sync_engine.pool.checkedout(),
+)
+metrics.gauge(
+    "db_pool_overflow",
+    "Соединения сверх pool_size",
+    function=lambda: max(get_engine().sync_engine.pool.overflow(), 0),
+)
+metrics.gauge(
+    "db_pool_size",
+    "Размер пула соединений",
+    function=lambda: get_engine().sync_engine.pool.size(),
 )
 
 # Базовый класс для моделей
@@ -23,8 +76,13 @@ async def get_session() -> AsyncSession:
 
 
 async def init_db():
-    """Инициализация базы данных."""
+    """Инициализация базы данных: применить недостающие миграции и создать партиции."""
+    from database import partitions
+    from database.migrations import migrate
+
+    engine = get_engine()
+    await migrate(engine)
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await partitions.maintain(conn, settings.GEN_TASK_PARTITIONS_AHEAD)
 
 
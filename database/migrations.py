@@ -0,0 +1,269 @@
+"""Версионированные миграции схемы базы данных."""
+import logging
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from database import partitions
+from database.base import Base
+import database.models  # noqa: F401  регистрирует таблицы в Base.metadata
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_xact_lock: миграции выполняет только один процесс
+MIGRATION_LOCK_ID = 7_100_001
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Шаг миграции схемы."""
+
+    version: int
+    description: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+def sql(*statements: str) -> Callable[[AsyncConnection], Awaitable[None]]:
+    """Миграция из SQL-выражений, выполняемых по порядку."""
+
+    async def apply(conn: AsyncConnection):
+        for statement in statements:
+            await conn.execute(text(statement))
+
+    return apply
+
+
+async def _create_tables(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def _payment_rollups(conn: AsyncConnection):
+    await sql(
+        "ALTER TABLE payments ALTER COLUMN amount TYPE NUMERIC(12, 2) USING amount::numeric",
+        "CREATE INDEX IF NOT EXISTS ix_payments_status_created ON payments (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_payments_user_status_created "
+        "ON payments (user_id, status, created_at)",
+    )(conn)
+    await conn.run_sync(
+        Base.metadata.create_all, tables=[database.models.PaymentDailyStats.__table__]
+    )
+    # Сводка за прошлые дни: время зачисления не хранилось, берем updated_at
+    await conn.execute(text(
+        "INSERT INTO payment_daily_stats (day, plan, payments, revenue, credits) "
+        "SELECT (updated_at AT TIME ZONE 'UTC')::date, amount::integer, count(*), sum(amount), sum(credits) "
+        "FROM payments WHERE status = 'succeeded' GROUP BY 1, 2 "
+        "ON CONFLICT (day, plan) DO NOTHING"
+    ))
+
+
+async def _usage_stats(conn: AsyncConnection):
+    # Историю заполняет scripts/backfill_stats.py
+    await conn.run_sync(
+        Base.metadata.create_all,
+        tables=[
+            database.models.GenerationDailyStats.__table__,
+            database.models.UserDailyActivity.__table__,
+        ],
+    )
+
+
+# Столбцы generation_tasks на момент миграции 13. Столбцы, добавленные позже,
+# в старой таблице отсутствуют, поэтому список не берется из модели
+_GENERATION_TASK_COLUMNS_V13 = (
+    "id", "user_id", "request_id", "chat_id", "status", "prompt", "model", "size",
+    "result_url", "result_file_id", "input_file_id", "attempts", "next_attempt_at",
+    "input_key", "batch_id", "trace_id", "delivery_status", "delivered_at",
+    "created_at", "updated_at",
+)
+
+
+async def _partition_generation_tasks(conn: AsyncConnection):
+    if await partitions.is_partitioned(conn):
+        # Новая база: таблица создана секционированной в миграции 1
+        await partitions.ensure_partitions(conn)
+        return
+
+    # Старая таблица переименовывается вместе с ключом и последовательностью,
+    # ее индексы удаляются: имена нужны новой таблице
+    await sql(
+        "ALTER TABLE generation_tasks RENAME TO generation_tasks_old",
+        "ALTER TABLE generation_tasks_old RENAME CONSTRAINT generation_tasks_pkey TO generation_tasks_old_pkey",
+        "ALTER SEQUENCE generation_tasks_id_seq RENAME TO generation_tasks_old_id_seq",
+    )(conn)
+    result = await conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'generation_tasks_old' AND indexname <> 'generation_tasks_old_pkey'"
+    ))
+    for (name,) in result.all():
+        await conn.execute(text(f'DROP INDEX "{name}"'))
+
+    await conn.run_sync(Base.metadata.create_all, tables=[database.models.GenerationTask.__table__])
+    first = await conn.scalar(text("SELECT min(created_at) FROM generation_tasks_old"))
+    await partitions.ensure_partitions(conn, since=first.astimezone(timezone.utc).date() if first else None)
+
+    # Копирование идет под блокировкой миграций: на большой таблице это
+    # заметный простой, его стоит планировать. Новая таблица создается по
+    # текущей модели: ее столбцы из следующих миграций остаются пустыми, а сами
+    # миграции идемпотентны (IF NOT EXISTS)
+    columns = _GENERATION_TASK_COLUMNS_V13
+    values = ["coalesce(created_at, updated_at, now())" if name == "created_at" else name for name in columns]
+    await sql(
+        f"INSERT INTO generation_tasks ({', '.join(columns)}) "
+        f"SELECT {', '.join(values)} FROM generation_tasks_old",
+        "SELECT setval('generation_tasks_id_seq', coalesce((SELECT max(id) FROM generation_tasks), 0) + 1, false)",
+        "DROP TABLE generation_tasks_old",
+    )(conn)
+
+
+# На новой базе первая миграция создает таблицы сразу в актуальном виде,
+# поэтому следующие шаги должны быть идемпотентными (IF NOT EXISTS и т. п.).
+# Прежние миграции не должны читать списки столбцов из моделей: новый столбец
+# появляется в модели раньше, чем его миграция применена к старой базе.
+MIGRATIONS: list[Migration] = [
+    Migration(1, "Начальная схема", _create_tables),
+    Migration(
+        2,
+        "Ключ идемпотентности платежей",
+        sql(
+            "ALTER TABLE payments ADD COLUMN IF NOT EXISTS idempotence_key VARCHAR(64)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_payments_idempotence_key ON payments (idempotence_key)",
+            "ALTER TABLE payments ALTER COLUMN payment_id DROP NOT NULL",
+        ),
+    ),
+    Migration(
+        3,
+        "Индекс незавершенных задач генерации",
+        sql(
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_active ON generation_tasks (created_at) "
+            "WHERE status NOT IN ('success', 'failed')",
+        ),
+    ),
+    Migration(
+        4,
+        "Статус доставки и кэш результатов",
+        sql(
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS delivery_status VARCHAR(20)",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP WITH TIME ZONE",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS input_key VARCHAR(64)",
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_input_key ON generation_tasks (input_key)",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS result_file_id VARCHAR(255)",
+        ),
+    ),
+    Migration(
+        5,
+        "Индекс истории генераций",
+        sql(
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_user_created "
+            "ON generation_tasks (user_id, created_at DESC, id DESC)",
+        ),
+    ),
+    Migration(
+        6,
+        "Пакетная генерация",
+        sql(
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS batch_id VARCHAR(32)",
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_batch_id ON generation_tasks (batch_id)",
+        ),
+    ),
+    Migration(
+        7,
+        "trace_id задач генерации",
+        sql("ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS trace_id VARCHAR(32)"),
+    ),
+    Migration(
+        8,
+        "Индекс результатов, ожидающих доставки",
+        sql(
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_delivery_queued ON generation_tasks (id) "
+            "WHERE delivery_status = 'queued'",
+        ),
+    ),
+    Migration(
+        9,
+        "Очередь запуска генераций",
+        sql(
+            "ALTER TABLE generation_tasks ALTER COLUMN request_id DROP NOT NULL",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS input_file_id VARCHAR(255)",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE",
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_submit_queue ON generation_tasks (next_attempt_at) "
+            "WHERE status IN ('queued', 'submitting')",
+        ),
+    ),
+    Migration(
+        10,
+        "Индекс ожидающих платежей",
+        sql("CREATE INDEX IF NOT EXISTS ix_payments_pending ON payments (created_at) WHERE status = 'pending'"),
+    ),
+    Migration(11, "Числовые суммы платежей и дневная сводка выручки", _payment_rollups),
+    Migration(12, "Дневные счетчики генераций", _usage_stats),
+    Migration(13, "Помесячные партиции generation_tasks", _partition_generation_tasks),
+    Migration(
+        14,
+        "Аренда доставки результатов",
+        sql(
+            "ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS delivery_claimed_at TIMESTAMP WITH TIME ZONE",
+            "CREATE INDEX IF NOT EXISTS ix_generation_tasks_delivery_sending "
+            "ON generation_tasks (delivery_claimed_at) WHERE delivery_status = 'sending'",
+        ),
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def get_version(conn: AsyncConnection) -> int:
+    """Текущая версия схемы (0, если миграции еще не применялись)."""
+    exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """
+    Применить недостающие миграции.
+
+    Если схема уже актуальна, выполняется один короткий запрос версии —
+    без create_all и рефлексии таблиц. Иначе миграции применяются в одной
+    транзакции под advisory lock, поэтому параллельный старт нескольких
+    воркеров безопасен.
+
+    Returns:
+        Версия схемы после миграции
+    """
+    async with engine.connect() as conn:
+        version = await get_version(conn)
+    if version >= LATEST_VERSION:
+        logger.info(f"Схема БД актуальна (версия {version})")
+        return version
+
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        await conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, "
+                "description VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+            )
+        )
+        # Пока ждали блокировку, миграции мог применить другой процесс
+        version = await get_version(conn)
+
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            logger.info(f"Миграция {migration.version}: {migration.description}")
+            await migration.apply(conn)
+            await conn.execute(
+                text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                {"version": migration.version, "description": migration.description},
+            )
+            version = migration.version
+
+    logger.info(f"Схема БД обновлена до версии {version}")
+    return version
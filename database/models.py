@@ -1,13 +1,22 @@
 """Модели базы данных."""
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
 from typing import Optional
 
-from sqlalchemy import BigInteger, Integer, String, Text, DateTime, JSON, Boolean
+from sqlalchemy import (
+    BigInteger, Integer, Numeric, String, Text, Date, DateTime, JSON, Boolean, Index, column
+)
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
 
 from database.base import Base
 
+# Статусы, после которых задача генерации больше не меняется
+TERMINAL_STATUSES = ("success", "failed")
+
+# Задача ждет отправки провайдеру или отправляется (очередь запуска генераций)
+SUBMIT_STATUSES = ("queued", "submitting")
+
 
 class User(Base):
     """Модель пользователя."""
@@ -33,9 +42,15 @@ class Payment(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
-    payment_id: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
-    amount: Mapped[float] = mapped_column(String(50), nullable=False)
+    # Заполняется после ответа YooKassa
+    payment_id: Mapped[Optional[str]] = mapped_column(String(255), unique=True, nullable=True)
+    idempotence_key: Mapped[Optional[str]] = mapped_column(
+        String(64), unique=True, index=True, nullable=True
+    )
+    # Сумма в рублях (ключ тарифа из SUBSCRIPTION_PLANS)
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
     credits: Mapped[int] = mapped_column(Integer, nullable=False)
+    # pending / succeeded / canceled / expired / failed (не создан в YooKassa)
     status: Mapped[str] = mapped_column(String(50), nullable=False, default="pending")
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
@@ -44,6 +59,38 @@ class Payment(Base):
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
 
+    __table_args__ = (
+        # Ожидающие оплаты платежи для сверки: индекс остается маленьким
+        Index(
+            "ix_payments_pending",
+            "created_at",
+            postgresql_where=column("status") == "pending",
+        ),
+        # Выборки по статусу за период
+        Index("ix_payments_status_created", "status", "created_at"),
+        # Платежи пользователя по статусу (история, поддержка)
+        Index("ix_payments_user_status_created", "user_id", "status", "created_at"),
+    )
+
+
+class PaymentDailyStats(Base):
+    """
+    Дневная сводка успешных платежей по тарифам.
+
+    Обновляется в транзакции зачисления платежа (credit_payment), поэтому
+    отчеты читают несколько строк сводки вместо сканирования payments.
+    """
+
+    __tablename__ = "payment_daily_stats"
+
+    # Дата зачисления (UTC)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    # Тариф — сумма в рублях, ключ SUBSCRIPTION_PLANS
+    plan: Mapped[int] = mapped_column(Integer, primary_key=True)
+    payments: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    credits: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
 
 class GenerationTask(Base):
     """Модель задачи генерации изображения."""
@@ -52,18 +99,106 @@ class GenerationTask(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
-    request_id: Mapped[str] = mapped_column(String(255), unique=True, nullable=False, index=True)
+    # id запроса у провайдера; пусто, пока задача в очереди запуска. Уникальный
+    # индекс секционированной таблицы обязан включать created_at, поэтому
+    # дубликаты отсекает finish_submission, а поиск по request_id их допускает
+    request_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)
     chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     status: Mapped[str] = mapped_column(String(50), nullable=False, default="pending")
     prompt: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     model: Mapped[str] = mapped_column(String(100), nullable=False, default="gpt-image-1")
     size: Mapped[str] = mapped_column(String(20), nullable=False, default="1024x1024")
     result_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # file_id фото после первой отправки: повторные отправки идут через CDN Telegram
+    result_file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # file_id входного фото в Telegram: его скачивает воркер очереди запуска
+    input_file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Попытки отправки провайдеру и время следующей (для submitting — срок аренды)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Хэш входного файла, prompt, модели и размера (для кэша результатов)
+    input_key: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    # Общий id задач из одного альбома: результаты отправляются одной media group
+    batch_id: Mapped[Optional[str]] = mapped_column(String(32), nullable=True, index=True)
+    # Трасса запуска генерации: по ней callback и доставка связываются с confirm_generation
+    trace_id: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    # Статус доставки результата в Telegram: queued / sending / sent / failed
+    delivery_status: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    delivered_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Когда результат забран на доставку (sending): по истечении аренды он возвращается в очередь
+    delivery_claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Ключ помесячных партиций (database/partitions.py), поэтому входит в первичный ключ
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
     )
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
 
+    __table_args__ = (
+        # Частичный индекс только по незавершенным задачам: остается маленьким
+        Index(
+            "ix_generation_tasks_active",
+            "created_at",
+            postgresql_where=column("status").notin_(TERMINAL_STATUSES),
+        ),
+        # Очередь запуска генераций: воркеры забирают задачи по next_attempt_at
+        Index(
+            "ix_generation_tasks_submit_queue",
+            "next_attempt_at",
+            postgresql_where=column("status").in_(SUBMIT_STATUSES),
+        ),
+        # Результаты, ожидающие доставки (их забирает outbox)
+        Index(
+            "ix_generation_tasks_delivery_queued",
+            "id",
+            postgresql_where=column("delivery_status") == "queued",
+        ),
+        # Результаты в доставке: по нему находятся просроченные аренды
+        Index(
+            "ix_generation_tasks_delivery_sending",
+            "delivery_claimed_at",
+            postgresql_where=column("delivery_status") == "sending",
+        ),
+        # Keyset-пагинация истории пользователя
+        Index(
+            "ix_generation_tasks_user_created",
+            "user_id",
+            column("created_at").desc(),
+            column("id").desc(),
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class GenerationDailyStats(Base):
+    """
+    Дневные счетчики генераций.
+
+    Обновляются в тех же транзакциях, что и задачи (постановка в очередь,
+    завершение, возврат кредитов). Счетчики дня разбиты на STATS_SHARDS строк
+    по user_id, чтобы параллельные транзакции не ждали одну строку; отчет
+    суммирует строки дня.
+    """
+
+    __tablename__ = "generation_daily_stats"
+
+    # Дата события (UTC)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    created: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    succeeded: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    credits_spent: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    credits_refunded: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    # Пользователи, впервые за день запустившие генерацию
+    active_users: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class UserDailyActivity(Base):
+    """Пользователи, запускавшие генерации, по дням (для счетчика active_users)."""
+
+    __tablename__ = "user_daily_activity"
 
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
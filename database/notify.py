@@ -0,0 +1,50 @@
+"""LISTEN/NOTIFY Postgres: пробуждение фоновых воркеров в других процессах."""
+import logging
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.base import async_session_maker, get_dedicated_engine
+
+logger = logging.getLogger(__name__)
+
+
+async def notify(channel: str):
+    """Отправить NOTIFY в канал."""
+    async with async_session_maker() as session:
+        await session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": channel})
+        await session.commit()
+
+
+async def listen(channel: str, callback: Callable) -> Optional[AsyncConnection]:
+    """
+    Подписаться на канал на отдельном соединении вне пула (только asyncpg).
+
+    Returns:
+        Соединение подписки (закрывается через unlisten) или None, если
+        подписаться не удалось — тогда воркеру остается опрос
+    """
+    conn = None
+    try:
+        conn = await get_dedicated_engine().connect()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.add_listener(channel, callback)
+        return conn
+    except Exception as e:
+        logger.warning(f"LISTEN {channel} недоступен, остается опрос: {e}")
+        if conn is not None:
+            await conn.close()
+        return None
+
+
+async def unlisten(conn: Optional[AsyncConnection], channel: str, callback: Callable):
+    """Отписаться и закрыть соединение."""
+    if conn is None:
+        return
+    try:
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.remove_listener(channel, callback)
+    except Exception:
+        pass
+    await conn.close()
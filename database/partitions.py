@@ -0,0 +1,167 @@
+"""Помесячные партиции generation_tasks."""
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+TABLE = "generation_tasks"
+# Ключ pg_advisory_xact_lock создания партиций (MIGRATION_LOCK_ID = 7_100_001)
+PARTITIONS_LOCK_ID = 7_100_005
+# Партиция для строк вне созданных диапазонов; в норме пустая
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+_NAME = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+class Partition(NamedTuple):
+    """Партиция за месяц [start, end)."""
+
+    name: str
+    start: date
+    end: date
+
+
+def month_start(value: date) -> date:
+    """Первый день месяца."""
+    return value.replace(day=1)
+
+
+def add_months(value: date, months: int) -> date:
+    """Первый день месяца через months месяцев."""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_for(month: date) -> Partition:
+    """Партиция месяца, в который попадает month."""
+    start = month_start(month)
+    return Partition(f"{TABLE}_y{start.year:04d}m{start.month:02d}", start, add_months(start, 1))
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    """Создана ли generation_tasks как секционированная таблица."""
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+    ), {"table": TABLE}))
+
+
+async def list_partitions(conn: AsyncConnection) -> list[Partition]:
+    """Помесячные партиции по возрастанию (без партиции по умолчанию)."""
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:table)"
+    ), {"table": TABLE})
+    partitions = []
+    for (name,) in result.all():
+        match = _NAME.match(name)
+        if match:
+            partitions.append(partition_for(date(int(match[1]), int(match[2]), 1)))
+    return sorted(partitions, key=lambda partition: partition.start)
+
+
+def _bounds(partition: Partition) -> str:
+    # Границы в UTC, независимо от TimeZone сессии
+    return (
+        f"FOR VALUES FROM ('{partition.start.isoformat()} 00:00+00') "
+        f"TO ('{partition.end.isoformat()} 00:00+00')"
+    )
+
+
+async def _default_rows(conn: AsyncConnection, partition: Partition) -> bool:
+    """Есть ли в партиции по умолчанию строки за месяц partition."""
+    exists = await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION})
+    if not exists:
+        return False
+    return bool(await conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        f"WHERE created_at >= '{partition.start.isoformat()} 00:00+00' "
+        f"AND created_at < '{partition.end.isoformat()} 00:00+00')"
+    )))
+
+
+async def _create_from_default(conn: AsyncConnection, partition: Partition) -> int:
+    """
+    Создать партицию, перенеся в нее строки месяца из партиции по умолчанию.
+
+    CREATE ... PARTITION OF не выполнится, пока в партиции по умолчанию
+    есть строки нового диапазона, поэтому таблица создается отдельно,
+    заполняется и присоединяется.
+
+    Returns:
+        Количество перенесенных строк
+    """
+    await conn.execute(text(
+        f"CREATE TABLE {partition.name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    result = await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE created_at >= '{partition.start.isoformat()} 00:00+00' "
+        f"AND created_at < '{partition.end.isoformat()} 00:00+00' RETURNING *) "
+        f"INSERT INTO {partition.name} SELECT * FROM moved"
+    ))
+    await conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {partition.name} {_bounds(partition)}"))
+    return result.rowcount
+
+
+async def ensure_partitions(
+    conn: AsyncConnection, since: Optional[date] = None, months_ahead: int = 2
+) -> list[Partition]:
+    """
+    Создать недостающие партиции с месяца since (по умолчанию — текущего)
+    по текущий месяц + months_ahead и партицию по умолчанию.
+
+    Строки, попавшие в партицию по умолчанию за эти месяцы, переносятся в
+    созданные партиции.
+
+    Returns:
+        Созданные партиции
+    """
+    today = datetime.now(timezone.utc).date()
+    month = month_start(since or today)
+    last = add_months(month_start(today), months_ahead)
+    existing = {partition.name for partition in await list_partitions(conn)}
+
+    created = []
+    while month <= last:
+        partition = partition_for(month)
+        if partition.name not in existing:
+            if await _default_rows(conn, partition):
+                moved = await _create_from_default(conn, partition)
+                logger.warning(
+                    f"Партиция {partition.name} создана с переносом строк из {DEFAULT_PARTITION}",
+                    extra={"partition": partition.name, "rows": moved},
+                )
+            else:
+                await conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {partition.name} PARTITION OF {TABLE} {_bounds(partition)}"
+                ))
+            created.append(partition)
+        month = add_months(month, 1)
+
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+    return created
+
+
+async def maintain(conn: AsyncConnection, months_ahead: int) -> list[Partition]:
+    """
+    ensure_partitions под advisory lock транзакции: безопасно при
+    одновременном старте нескольких процессов.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITIONS_LOCK_ID})
+    return await ensure_partitions(conn, months_ahead=months_ahead)
+
+
+async def default_rows_count(conn: AsyncConnection) -> int:
+    """Строк в партиции по умолчанию (в норме 0)."""
+    return await conn.scalar(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}"))
+
+
+async def drop_partition(conn: AsyncConnection, partition: Partition):
+    """Удалить партицию вместе с данными."""
+    await conn.execute(text(f"DROP TABLE IF EXISTS {partition.name}"))
@@ -0,0 +1 @@
+"""Локальные заглушки внешних сервисов для тестов и бенчмарков."""
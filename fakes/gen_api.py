@@ -0,0 +1,115 @@
+"""
+Заглушка API генерации изображений.
+
+Принимает запрос генерации, через FAKE_GEN_CALLBACK_DELAY секунд
+помечает его выполненным и отправляет callback на callback_url.
+Callback можно «терять» с вероятностью FAKE_GEN_DROP_RATE, чтобы
+проверять сверку зависших задач, а запрос генерации — отклонять с 503
+с вероятностью FAKE_GEN_SUBMIT_ERROR_RATE, чтобы проверять повторы
+очереди запуска. Callback, на который бот ответил 5xx, повторяется до
+FAKE_GEN_CALLBACK_RETRIES раз, как у настоящего провайдера.
+
+Запуск:
+    uvicorn fakes.gen_api:app --port 8002
+
+Для бота:
+    GEN_API_URL=http://localhost:8002/gen
+    GEN_API_STATUS_URL=http://localhost:8002/request/get/{request_id}
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+
+import aiohttp
+from fastapi import FastAPI, HTTPException, Request
+
+app = FastAPI(title="Fake generation API")
+
+CALLBACK_DELAY = float(os.environ.get("FAKE_GEN_CALLBACK_DELAY", "1.0"))
+DROP_RATE = float(os.environ.get("FAKE_GEN_DROP_RATE", "0"))
+FAIL_RATE = float(os.environ.get("FAKE_GEN_FAIL_RATE", "0"))
+SUBMIT_ERROR_RATE = float(os.environ.get("FAKE_GEN_SUBMIT_ERROR_RATE", "0"))
+RESULT_URL = os.environ.get("FAKE_GEN_RESULT_URL", "https://picsum.photos/1024")
+CALLBACK_RETRIES = int(os.environ.get("FAKE_GEN_CALLBACK_RETRIES", "5"))
+
+# id не повторяются между перезапусками: задачи прошлых прогонов остаются в БД бота
+_ids = itertools.count(int(time.time() * 1000))
+# request_id -> запрос
+requests: dict[int, dict] = {}
+_background: set[asyncio.Task] = set()
+
+
+async def _complete(request_id: int):
+    """Завершить генерацию и отправить callback."""
+    await asyncio.sleep(CALLBACK_DELAY)
+    item = requests[request_id]
+    if random.random() < FAIL_RATE:
+        item.update(status="failed", result=[])
+    else:
+        item.update(status="success", result=[RESULT_URL])
+
+    if not item["callback_url"] or random.random() < DROP_RATE:
+        item["callback_dropped"] = True
+        return
+
+    payload = {"request_id": request_id, "status": item["status"], "result": item["result"]}
+    for attempt in range(CALLBACK_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(attempt)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(item["callback_url"], json=payload) as response:
+                    item["callback_status"] = response.status
+                    if response.status < 500:
+                        return
+        except aiohttp.ClientError as e:
+            item["callback_status"] = str(e)
+
+
+@app.post("/gen")
+async def generate(request: Request):
+    """Принять запрос генерации."""
+    if not request.headers.get("Authorization", "").startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if random.random() < SUBMIT_ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Temporarily unavailable")
+
+    form = await request.form()
+    image = form.get("image[]")
+    if image is None or not form.get("prompt"):
+        raise HTTPException(status_code=422, detail="image[] and prompt are required")
+
+    request_id = next(_ids)
+    requests[request_id] = {
+        "id": request_id,
+        "status": "processing",
+        "result": [],
+        "prompt": form["prompt"],
+        "size": form.get("size"),
+        "image_bytes": len(await image.read()),
+        "image_content_type": image.content_type,
+        "callback_url": form.get("callback_url"),
+    }
+
+    task = asyncio.create_task(_complete(request_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+    return {"request_id": request_id, "status": "processing"}
+
+
+@app.get("/request/get/{request_id}")
+async def get_request(request_id: int):
+    """Статус генерации."""
+    if request_id not in requests:
+        raise HTTPException(status_code=404, detail="Request not found")
+    item = requests[request_id]
+    return {"request_id": request_id, "status": item["status"], "result": item["result"]}
+
+
+@app.get("/fake/requests")
+async def list_requests():
+    """Список принятых запросов."""
+    return list(requests.values())
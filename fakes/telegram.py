@@ -0,0 +1,296 @@
+"""
+Заглушка Telegram Bot API.
+
+Отвечает на методы, которые использует бот, отдает обновления через
+getUpdates или пушит их на webhook (если бот вызвал setWebhook), отдает
+файлы фото для getFile и запоминает отправленные ботом сообщения с временем
+получения — по ним бенчмарки считают задержки.
+
+Запуск:
+    uvicorn fakes.telegram:app --port 8003
+
+Для бота:
+    TELEGRAM_API_SERVER=http://localhost:8003
+"""
+import asyncio
+import itertools
+import json
+import time
+from io import BytesIO
+from typing import Optional
+
+import aiohttp
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI(title="Fake Telegram Bot API")
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+
+# Методы, которые отправляют пользователю сообщение
+SEND_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendMediaGroup"}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+_file_ids = itertools.count(1)
+_updates: asyncio.Queue = asyncio.Queue()
+
+# Вызовы Bot API: {"method", "params", "time"}
+calls: list[dict] = []
+# Время первого вызова каждого метода
+first_call: dict[str, float] = {}
+# Webhook, зарегистрированный ботом: {"url", "secret_token"}
+webhook: dict = {}
+
+# Ожидания бенчмарков: chat_id -> [(методы, future)]
+_waiters: dict[int, list[tuple[set[str], asyncio.Future]]] = {}
+_background: set[asyncio.Task] = set()
+_photo_bytes: Optional[bytes] = None
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private"}
+
+
+def make_message_update(user_id: int, text: str) -> dict:
+    """Обновление с текстовым сообщением пользователя."""
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+            "entities": (
+                [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                if text.startswith("/")
+                else []
+            ),
+        },
+    }
+
+
+def make_photo_update(user_id: int, media_group_id: Optional[str] = None) -> dict:
+    """Обновление с фото пользователя (файл отдается через getFile)."""
+    n = next(_file_ids)
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": _chat(user_id),
+        "from": _user(user_id),
+        "photo": [
+            {
+                "file_id": f"photo-{n}",
+                "file_unique_id": f"uniq-{n}",
+                "width": 1024,
+                "height": 1024,
+                "file_size": len(_photo()),
+            }
+        ],
+    }
+    if media_group_id:
+        message["media_group_id"] = media_group_id
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def make_callback_update(user_id: int, data: str, message: dict) -> dict:
+    """Нажатие inline-кнопки под сообщением бота message."""
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+def expect(chat_id: int, methods: set[str]) -> asyncio.Future:
+    """
+    Future, которое завершится первым из methods, вызванным ботом для chat_id.
+
+    Регистрировать до отправки обновления, чтобы не пропустить быстрый ответ.
+    Результат — {"method", "params", "time", "message"}.
+    """
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(chat_id, []).append((methods, future))
+    return future
+
+
+def _notify(chat_id: int, call: dict):
+    waiters = _waiters.get(chat_id)
+    if not waiters:
+        return
+    for item in list(waiters):
+        methods, future = item
+        if call["method"] in methods:
+            waiters.remove(item)
+            if not future.done():
+                future.set_result(call)
+    if not waiters:
+        _waiters.pop(chat_id, None)
+
+
+def _photo() -> bytes:
+    """Тестовое JPEG-изображение."""
+    global _photo_bytes
+    if _photo_bytes is None:
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new("RGB", (1024, 1024), (120, 160, 200)).save(buffer, "JPEG", quality=85)
+        _photo_bytes = buffer.getvalue()
+    return _photo_bytes
+
+
+def _sent_message(params: dict, photo: bool = False) -> dict:
+    """Сообщение, которое «отправил» бот."""
+    message = {
+        "message_id": int(params.get("message_id") or next(_message_ids)),
+        "date": int(time.time()),
+        "chat": _chat(int(params.get("chat_id", 0))),
+        "from": BOT_USER,
+    }
+    if photo:
+        n = next(_file_ids)
+        message["photo"] = [
+            {"file_id": f"sent-{n}", "file_unique_id": f"sent-uniq-{n}", "width": 1024, "height": 1024}
+        ]
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+    else:
+        message["text"] = params.get("text") or ""
+    if params.get("reply_markup"):
+        message["reply_markup"] = params["reply_markup"]
+    return message
+
+
+async def _get_updates(params: dict) -> list[dict]:
+    """Long polling: ждать обновления не дольше timeout секунд."""
+    timeout = float(params.get("timeout") or 0)
+    updates = []
+    try:
+        updates.append(await asyncio.wait_for(_updates.get(), timeout=max(timeout, 0.01)))
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # CancelledError: заглушку останавливают, пока бот ждет обновления
+        return []
+    while not _updates.empty():
+        updates.append(_updates.get_nowait())
+    return updates
+
+
+async def _push_webhook(update: dict):
+    """Отправить обновление на webhook бота."""
+    headers = {}
+    if webhook.get("secret_token"):
+        headers["X-Telegram-Bot-Api-Secret-Token"] = webhook["secret_token"]
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(webhook["url"], json=update, headers=headers) as response:
+                await response.read()
+    except aiohttp.ClientError:
+        pass
+
+
+def push(update: dict):
+    """Передать обновление боту: на webhook, если он задан, иначе в getUpdates."""
+    if webhook.get("url"):
+        task = asyncio.create_task(_push_webhook(update))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    else:
+        _updates.put_nowait(update)
+
+
+async def _read_params(request: Request) -> dict:
+    """Параметры запроса aiogram (form-data, сложные значения в JSON)."""
+    form = await request.form()
+    params = {}
+    for key, value in form.items():
+        if isinstance(value, str) and value[:1] in "[{":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    """Любой метод Bot API."""
+    params = await _read_params(request)
+    now = time.time()
+    first_call.setdefault(method, now)
+
+    result: object = True
+    if method == "getMe":
+        result = BOT_USER
+    elif method == "getWebhookInfo":
+        result = {
+            "url": webhook.get("url", ""),
+            "has_custom_certificate": False,
+            "pending_update_count": _updates.qsize(),
+        }
+    elif method == "setWebhook":
+        webhook.update(url=params.get("url"), secret_token=params.get("secret_token"))
+    elif method == "deleteWebhook":
+        webhook.clear()
+    elif method == "getUpdates":
+        return {"ok": True, "result": await _get_updates(params)}
+    elif method == "getFile":
+        file_id = params.get("file_id")
+        result = {
+            "file_id": file_id,
+            "file_unique_id": f"uniq-{file_id}",
+            "file_size": len(_photo()),
+            "file_path": f"photos/{file_id}.jpg",
+        }
+    elif method in ("sendMessage", "editMessageText"):
+        result = _sent_message(params)
+    elif method == "sendPhoto":
+        result = _sent_message(params, photo=True)
+    elif method == "sendMediaGroup":
+        media = params.get("media") or []
+        result = [
+            _sent_message({"chat_id": params.get("chat_id"), "caption": item.get("caption")}, photo=True)
+            for item in media
+        ]
+
+    call = {"method": method, "params": params, "time": now, "result": result}
+    calls.append(call)
+    if method in SEND_METHODS and params.get("chat_id") is not None:
+        _notify(int(params["chat_id"]), call)
+    return {"ok": True, "result": result}
+
+
+@app.get("/file/bot{token}/{path:path}")
+async def download_file(token: str, path: str):
+    """Содержимое файла из getFile."""
+    return Response(content=_photo(), media_type="image/jpeg")
+
+
+@app.post("/fake/updates")
+async def push_update(payload: dict):
+    """Передать обновление боту: полный Update или {"user_id", "text"}."""
+    if "update_id" not in payload:
+        payload = make_message_update(int(payload["user_id"]), payload["text"])
+    push(payload)
+    return {"ok": True, "update_id": payload["update_id"]}
+
+
+@app.get("/fake/calls")
+async def list_calls(method: Optional[str] = None, since: float = 0):
+    """Вызовы Bot API и время первого вызова методов."""
+    items = [
+        {k: v for k, v in c.items() if k != "result"}
+        for c in calls
+        if c["time"] >= since and (method is None or c["method"] == method)
+    ]
+    return {"calls": items, "first_call": first_call, "webhook": webhook}
@@ -0,0 +1,105 @@
+"""
+Заглушка API YooKassa.
+
+Запуск:
+    uvicorn fakes.yookassa:app --port 8001
+
+Для бота: YOOKASSA_API_URL=http://localhost:8001/v3
+"""
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+import aiohttp
+from fastapi import FastAPI, Header, HTTPException, Request
+
+app = FastAPI(title="Fake YooKassa")
+
+# Куда отправлять уведомления (URL /yookassa/webhook бота)
+WEBHOOK_URL = os.environ.get("FAKE_YOOKASSA_WEBHOOK_URL")
+# Доля уведомлений, которые "теряются" (для проверки сверки платежей)
+WEBHOOK_DROP_RATE = float(os.environ.get("FAKE_YOOKASSA_WEBHOOK_DROP_RATE", "0"))
+
+# payment_id -> платеж
+payments: dict[str, dict] = {}
+# Idempotence-Key -> payment_id
+idempotence_keys: dict[str, str] = {}
+
+
+def _check_auth(request: Request):
+    """Проверить, что передана Basic-авторизация."""
+    if not request.headers.get("Authorization", "").startswith("Basic "):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.post("/v3/payments")
+async def create_payment(request: Request, idempotence_key: Optional[str] = Header(None)):
+    """Создать платеж (повтор с тем же ключом возвращает тот же платеж)."""
+    _check_auth(request)
+    if not idempotence_key:
+        raise HTTPException(status_code=400, detail="Idempotence-Key is required")
+
+    if idempotence_key in idempotence_keys:
+        return payments[idempotence_keys[idempotence_key]]
+
+    body = await request.json()
+    payment_id = str(uuid.uuid4())
+    payment = {
+        "id": payment_id,
+        "status": "pending",
+        "paid": False,
+        "amount": body["amount"],
+        "description": body.get("description"),
+        "metadata": body.get("metadata", {}),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "confirmation": {
+            "type": "redirect",
+            "confirmation_url": f"https://yoomoney.example/checkout/{payment_id}",
+        },
+    }
+    payments[payment_id] = payment
+    idempotence_keys[idempotence_key] = payment_id
+    return payment
+
+
+@app.get("/v3/payments/{payment_id}")
+async def get_payment(payment_id: str, request: Request):
+    """Получить платеж."""
+    _check_auth(request)
+    if payment_id not in payments:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return payments[payment_id]
+
+
+@app.post("/fake/payments/{payment_id}/{status}")
+async def set_status(payment_id: str, status: str, notify: bool = True):
+    """
+    Перевести платеж в succeeded/canceled.
+
+    При notify=true отправляет уведомление на FAKE_YOOKASSA_WEBHOOK_URL
+    (кроме доли FAKE_YOOKASSA_WEBHOOK_DROP_RATE).
+    """
+    if payment_id not in payments:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    if status not in ("succeeded", "canceled"):
+        raise HTTPException(status_code=400, detail="Unsupported status")
+
+    payment = payments[payment_id]
+    payment["status"] = status
+    payment["paid"] = status == "succeeded"
+
+    if notify and WEBHOOK_URL and random.random() >= WEBHOOK_DROP_RATE:
+        async with aiohttp.ClientSession() as session:
+            await session.post(
+                WEBHOOK_URL,
+                json={"type": "notification", "event": f"payment.{status}", "object": payment},
+            )
+    return payment
+
+
+@app.get("/fake/payments")
+async def list_payments():
+    """Список созданных платежей."""
+    return list(payments.values())
@@ -0,0 +1,49 @@
+"""Команды администраторов."""
+import logging
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from config.settings import settings
+from database.base import async_session_maker
+from services.usage_stats import stats_report
+
+logger = logging.getLogger(__name__)
+
+router = Router(name="admin")
+
+
+def _format_day(day: dict, users_label: str = "Активных пользователей") -> str:
+    rate = f"{day['success_rate']:.0%}" if day["success_rate"] is not None else "—"
+    return (
+        f"🖼 Генераций: {day['created']} (✅ {day['succeeded']}, ❌ {day['failed']}, успешных {rate})\n"
+        f"💳 Кредитов списано: {day['credits_spent']}, возвращено: {day['credits_refunded']}\n"
+        f"👥 {users_label}: {day['active_users']}\n"
+        f"💰 Оплат: {day['payments']} на {day['revenue']:.0f} ₽"
+    )
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Сводка за сегодня и последние 7 дней (только для ADMIN_IDS)."""
+    if message.from_user.id not in settings.ADMIN_IDS:
+        return
+
+    async with async_session_maker() as session:
+        report = await stats_report(session, days=7)
+
+    today = report[0]
+    week = {
+        key: sum(day[key] for day in report)
+        for key in ("created", "succeeded", "failed", "credits_spent", "credits_refunded", "payments", "revenue")
+    }
+    finished = week["succeeded"] + week["failed"]
+    week["success_rate"] = week["succeeded"] / finished if finished else None
+    # Активные пользователи за неделю не суммируются по дням
+    week["active_users"] = max(day["active_users"] for day in report)
+
+    await message.answer(
+        f"📈 Сегодня ({today['day']}, UTC):\n{_format_day(today)}\n\n"
+        f"📅 За 7 дней:\n{_format_day(week, 'Активных пользователей (макс. за день)')}"
+    )
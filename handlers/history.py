@@ -0,0 +1,158 @@
+"""Обработчики команды /history."""
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select, tuple_, update
+
+from database.base import async_session_maker
+from database.models import GenerationTask
+
+logger = logging.getLogger(__name__)
+
+router = Router(name="history")
+
+PAGE_SIZE = 5
+
+STATUS_ICONS = {"success": "✅", "failed": "❌"}
+
+
+async def _load_page(user_id: int, cursor: Optional[tuple[datetime, int]]):
+    """
+    Загрузить страницу истории.
+
+    Keyset-пагинация по (created_at, id) идет по индексу
+    (user_id, created_at DESC, id DESC) и не зависит от номера страницы.
+    """
+    query = select(
+        GenerationTask.id,
+        GenerationTask.created_at,
+        GenerationTask.prompt,
+        GenerationTask.status,
+    ).where(GenerationTask.user_id == user_id)
+
+    if cursor:
+        query = query.where(
+            tuple_(GenerationTask.created_at, GenerationTask.id) < tuple_(*cursor)
+        )
+
+    query = query.order_by(GenerationTask.created_at.desc(), GenerationTask.id.desc()).limit(
+        PAGE_SIZE + 1
+    )
+
+    async with async_session_maker() as session:
+        result = await session.execute(query)
+        rows = result.all()
+
+    return rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+
+def _render_page(rows, has_more: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура страницы истории."""
+    lines = ["🗂 История генераций:\n"]
+    buttons = []
+
+    for row in rows:
+        prompt = row.prompt or ""
+        if len(prompt) > 40:
+            prompt = prompt[:40] + "…"
+        icon = STATUS_ICONS.get(row.status, "⏳")
+        lines.append(f"{icon} #{row.id} {row.created_at:%d.%m %H:%M} — {prompt}")
+        if row.status == "success":
+            buttons.append(
+                InlineKeyboardButton(text=f"🖼 #{row.id}", callback_data=f"history_get_{row.id}")
+            )
+
+    keyboard = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+    if has_more:
+        last = rows[-1]
+        cursor = int(last.created_at.timestamp() * 1_000_000)
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    text="Дальше ▶", callback_data=f"history_next_{cursor}_{last.id}"
+                )
+            ]
+        )
+
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@router.message(Command("history"))
+async def cmd_history(message: Message):
+    """Показать первую страницу истории."""
+    rows, has_more = await _load_page(message.from_user.id, None)
+
+    if not rows:
+        await message.answer("🗂 История пуста. Начните с команды /photo")
+        return
+
+    text, keyboard = _render_page(rows, has_more)
+    await message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("history_next_"))
+async def history_next_page(callback: CallbackQuery):
+    """Показать следующую страницу истории."""
+    try:
+        _, _, cursor_ts, cursor_id = callback.data.split("_")
+        cursor = (
+            datetime.fromtimestamp(int(cursor_ts) / 1_000_000, tz=timezone.utc),
+            int(cursor_id),
+        )
+    except ValueError:
+        await callback.answer("❌ Некорректная страница", show_alert=True)
+        return
+
+    rows, has_more = await _load_page(callback.from_user.id, cursor)
+
+    if not rows:
+        await callback.answer("Больше ничего нет")
+        return
+
+    text, keyboard = _render_page(rows, has_more)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("history_get_"))
+async def history_get(callback: CallbackQuery):
+    """Повторно отправить результат генерации."""
+    try:
+        task_id = int(callback.data.removeprefix("history_get_"))
+    except ValueError:
+        await callback.answer("❌ Некорректный запрос", show_alert=True)
+        return
+
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(GenerationTask.result_file_id, GenerationTask.result_url).where(
+                GenerationTask.id == task_id,
+                GenerationTask.user_id == callback.from_user.id,
+                GenerationTask.status == "success",
+            )
+        )
+        task = result.one_or_none()
+
+        if task is None or not (task.result_file_id or task.result_url):
+            await callback.answer("❌ Результат не найден", show_alert=True)
+            return
+
+        # file_id отдается с CDN Telegram, URL провайдера — только если file_id нет
+        sent = await callback.message.answer_photo(
+            photo=task.result_file_id or task.result_url,
+            caption=f"🖼 Генерация #{task_id}",
+        )
+
+        if not task.result_file_id:
+            await session.execute(
+                update(GenerationTask)
+                .where(GenerationTask.id == task_id)
+                .values(result_file_id=sent.photo[-1].file_id)
+            )
+            await session.commit()
+
+    await callback.answer()
@@ -1,48 +1,76 @@
 """Обработчики команды /photo."""
 import logging
-from io import BytesIO
+import uuid
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    Message,
+)
 
 from config.settings import settings
 from database.base import async_session_maker
-from database.models import User
-from services.image_generation.client import ImageGenerationClient
-from services.image_generation.tasks import create_generation_task
+from middlewares.album import AlbumMiddleware
+from services import user_cache
+from services.credits import debit_credits, get_balance
+from services.image_generation import result_cache, submitter
+from services.image_generation.tasks import create_generation_tasks
+from services.user_cache import get_cached_user
 from states.image_generation import ImageGenerationStates
 
 logger = logging.getLogger(__name__)
 
 router = Router(name="photo")
+router.message.middleware(AlbumMiddleware())
 
 # Хранение временных данных для FSM
 user_data_storage = {}
 
 
+async def _send_cached(message: Message, photos: list[str]):
+    """Отправить готовые результаты из кэша."""
+    if len(photos) == 1:
+        await message.answer_photo(photo=photos[0], caption="✅ Ваше изображение готово!")
+        return
+    await message.answer_media_group(
+        media=[
+            InputMediaPhoto(media=photo, caption="⚡ Готовые результаты" if i == 0 else None)
+            for i, photo in enumerate(photos)
+        ]
+    )
+
+
 @router.message(Command("photo"))
 async def cmd_photo(message: Message, state: FSMContext):
     """Начало процесса генерации изображения."""
     user_id = message.from_user.id
 
-    async with async_session_maker() as session:
-        from sqlalchemy import select
-
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
-
-        if user is None:
-            await message.answer("❌ Пользователь не найден. Используйте /start")
-            return
+    # Предварительная проверка по кэшу; списание при подтверждении атомарное,
+    # поэтому устаревший кэш не даст потратить лишнее. В БД идем, только если
+    # пользователя нет в кэше или кредитов не хватает: оплату мог зачислить
+    # другой процесс
+    cached = get_cached_user(user_id)
+    credits = cached.credits if cached is not None else None
+    if credits is None or credits < settings.GENERATION_COST:
+        async with async_session_maker() as session:
+            credits = await get_balance(session, user_id)
+
+    if credits is None:
+        await message.answer("❌ Пользователь не найден. Используйте /start")
+        return
 
-        if user.credits < settings.GENERATION_COST:
-            await message.answer(
-                f"❌ Недостаточно кредитов. Нужно {settings.GENERATION_COST}, у вас {user.credits}.\n"
-                f"Используйте /buy_subscription для покупки кредитов."
-            )
-            return
+    if credits < settings.GENERATION_COST:
+        await message.answer(
+            f"❌ Недостаточно кредитов. Нужно {settings.GENERATION_COST}, у вас {credits}.\n"
+            f"Используйте /buy_subscription для покупки кредитов."
+        )
+        return
 
     await state.set_state(ImageGenerationStates.waiting_image)
     await message.answer(
@@ -52,22 +80,27 @@ async def cmd_photo(message: Message, state: FSMContext):
 
 
 @router.message(ImageGenerationStates.waiting_image, F.photo)
-async def process_image(message: Message, state: FSMContext):
-    """Обработка полученного изображения."""
+async def process_image(
+    message: Message, state: FSMContext, album: Optional[list[Message]] = None
+):
+    """Обработка полученного изображения или альбома."""
     user_id = message.from_user.id
 
-    # Скачиваем изображение
-    photo = message.photo[-1]  # Берем самое большое разрешение
-    file = await message.bot.get_file(photo.file_id)
-    image_bytes = await message.bot.download_file(file.file_path)
-
-    # Сохраняем в состояние
-    await state.update_data(image_bytes=image_bytes.read())
+    # Сохраняем только file_id: сами изображения скачиваются при подтверждении
+    messages = [m for m in (album or [message]) if m.photo]
+    photos = [
+        [m.photo[-1].file_id, m.photo[-1].file_unique_id]  # Берем самое большое разрешение
+        for m in messages[: settings.GEN_BATCH_MAX_ITEMS]
+    ]
+    await state.update_data(photos=photos)
 
     # Переходим к следующему состоянию
     await state.set_state(ImageGenerationStates.waiting_prompt)
+    received = "✅ Изображение получено!" if len(photos) == 1 else f"✅ Получено изображений: {len(photos)}"
+    if len(messages) > len(photos):
+        received += f" (обработаны первые {len(photos)})"
     await message.answer(
-        "✅ Изображение получено!\n\n"
+        f"{received}\n\n"
         "📝 Теперь отправьте описание (prompt) для генерации изображения."
     )
 
@@ -86,9 +119,9 @@ async def process_prompt(message: Message, state: FSMContext):
 
     # Получаем данные из состояния
     data = await state.get_data()
-    image_bytes = data.get("image_bytes")
+    photos = data.get("photos")
 
-    if not image_bytes:
+    if not photos:
         await message.answer("❌ Ошибка: изображение не найдено. Начните заново с /photo")
         await state.clear()
         return
@@ -115,7 +148,8 @@ async def process_prompt(message: Message, state: FSMContext):
         f"📋 Проверьте параметры:\n\n"
         f"📝 Prompt: {prompt}\n"
         f"🎨 Модель: gpt-image-1\n"
-        f"💳 Стоимость: {settings.GENERATION_COST} кредита(ов)\n\n"
+        f"🖼 Изображений: {len(photos)}\n"
+        f"💳 Стоимость: {settings.GENERATION_COST * len(photos)} кредита(ов)\n\n"
         f"Выберите размер изображения:",
         reply_markup=keyboard,
     )
@@ -146,75 +180,91 @@ async def confirm_generation(callback: CallbackQuery, state: FSMContext):
 
     # Получаем данные из состояния
     data = await state.get_data()
-    image_bytes = data.get("image_bytes")
+    photos = data.get("photos")
     prompt = data.get("prompt")
 
-    if not image_bytes or not prompt:
+    if not photos or not prompt:
         await callback.answer("❌ Ошибка: данные не найдены")
         await state.clear()
         return
 
-    async with async_session_maker() as session:
-        from sqlalchemy import select
+    input_keys = [
+        result_cache.make_key(file_unique_id, prompt, "gpt-image-1", size)
+        if settings.RESULT_CACHE_ENABLED
+        else None
+        for _, file_unique_id in photos
+    ]
 
-        # Проверяем кредиты и списываем
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
-
-        if user is None or user.credits < settings.GENERATION_COST:
+    async with async_session_maker() as session:
+        # Такие же запросы уже выполнялись: отдаем готовые результаты без генерации
+        cached = {}
+        for i, input_key in enumerate(input_keys):
+            if input_key:
+                cached_photo = await result_cache.lookup(session, input_key)
+                if cached_photo:
+                    cached[i] = cached_photo
+        pending = [i for i in range(len(photos)) if i not in cached]
+
+        if cached:
+            await _send_cached(callback.message, list(cached.values()))
+            if not pending:
+                await callback.message.edit_text(
+                    "⚡ Такое изображение уже генерировалось — отправляю готовый результат.\n"
+                    "💳 Кредиты не списаны."
+                )
+                await callback.answer()
+                await state.clear()
+                return
+
+        # Проверяем и списываем кредиты за весь альбом одним запросом; списание
+        # фиксируется одним commit с постановкой задач в очередь
+        cost = settings.GENERATION_COST * len(pending)
+        balance = await debit_credits(session, user_id, cost, commit=False)
+
+        if balance is None:
+            await session.rollback()
             await callback.answer(
-                f"❌ Недостаточно кредитов. Нужно {settings.GENERATION_COST}",
+                f"❌ Недостаточно кредитов. Нужно {cost}",
                 show_alert=True,
             )
             await state.clear()
             return
 
-        # Списываем кредиты
-        user.credits -= settings.GENERATION_COST
-        await session.commit()
-
-        # Запускаем генерацию
-        client = ImageGenerationClient()
-        response = await client.generate_image(
-            image_bytes=BytesIO(image_bytes).read(),
-            prompt=prompt,
-            model="gpt-image-1",
-            size=size,
-        )
-
-        if response and response.get("request_id"):
-            request_id = str(response["request_id"])
-            
-            # Создаем задачу генерации
-            from database.models import GenerationTask
-
-            task = await create_generation_task(
+        # Ставим задачи в очередь запуска: провайдеру их отправят воркеры
+        # диспетчера, а пользователь получает ответ сразу
+        try:
+            await create_generation_tasks(
                 session=session,
                 user_id=user_id,
                 chat_id=callback.message.chat.id,
-                request_id=request_id,
+                inputs=[(photos[i][0], input_keys[i]) for i in pending],
                 prompt=prompt,
                 model="gpt-image-1",
                 size=size,
+                # Задачи альбома объединены batch_id
+                batch_id=uuid.uuid4().hex if len(pending) > 1 else None,
+                credits=cost,
             )
-
+        except Exception as e:
+            logger.error(f"Не удалось поставить генерацию в очередь: {e}", exc_info=True)
+            # Списание откатилось вместе с задачами
+            await session.rollback()
             await callback.message.edit_text(
-                f"⏳ Генерация запущена!\n\n"
-                f"💳 Списано: {settings.GENERATION_COST} кредита(ов)\n"
-                f"💰 Осталось кредитов: {user.credits}\n\n"
-                f"🔄 Ожидайте результат..."
-            )
-            await callback.answer("Генерация запущена!")
-        else:
-            # Возвращаем кредиты при ошибке
-            user.credits += settings.GENERATION_COST
-            await session.commit()
-
-            await callback.message.edit_text(
-                "❌ Ошибка при запуске генерации. Кредиты возвращены. Попробуйте позже."
+                "❌ Ошибка при запуске генерации. Кредиты не списаны. Попробуйте позже."
             )
             await callback.answer("Ошибка генерации", show_alert=True)
+            await state.clear()
+            return
 
-    await state.clear()
-
+    user_cache.set_balance(user_id, balance)
+    await submitter.notify()
 
+    await callback.message.edit_text(
+        f"⏳ Генерация запущена!\n\n"
+        + (f"🖼 Изображений: {len(pending)}\n" if len(pending) > 1 else "")
+        + f"💳 Списано: {cost} кредита(ов)\n"
+        f"💰 Осталось кредитов: {balance}\n"
+        "\n🔄 Ожидайте результат..."
+    )
+    await callback.answer("Генерация запущена!")
+    await state.clear()
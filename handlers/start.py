@@ -1,5 +1,6 @@
 """Обработчики команды /start."""
 import logging
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.filters import CommandStart
@@ -8,19 +9,17 @@ from aiogram.types import Message
 from config.settings import settings
 from database.base import async_session_maker
 from database.models import User
+from services.user_cache import CachedUser, get_cached_user, remember_user
 
 logger = logging.getLogger(__name__)
 
 router = Router(name="start")
 
 
-@router.message(CommandStart())
-async def cmd_start(message: Message):
-    """Обработчик команды /start."""
-    user_id = message.from_user.id
-    username = message.from_user.username
-    first_name = message.from_user.first_name
-
+async def _upsert_user(
+    user_id: int, username: Optional[str], first_name: Optional[str]
+) -> CachedUser:
+    """Создать пользователя или обновить его профиль."""
     async with async_session_maker() as session:
         # Проверяем, существует ли пользователь
         from sqlalchemy import select
@@ -45,6 +44,21 @@ async def cmd_start(message: Message):
             user.first_name = first_name
             await session.commit()
 
+    return remember_user(user)
+
+
+@router.message(CommandStart())
+async def cmd_start(message: Message):
+    """Обработчик команды /start."""
+    user_id = message.from_user.id
+    username = message.from_user.username
+    first_name = message.from_user.first_name
+
+    # Если профиль в кэше не изменился, обращение к БД не нужно
+    user = get_cached_user(user_id)
+    if user is None or (user.username, user.first_name) != (username, first_name):
+        user = await _upsert_user(user_id, username, first_name)
+
     welcome_text = f"""
 👋 Привет, {first_name or 'друг'}!
 
@@ -56,9 +70,8 @@ async def cmd_start(message: Message):
 /photo - Сгенерировать изображение (стоимость: {settings.GENERATION_COST} кредита)
 /buy_subscription - Купить кредиты
 /status - Проверить баланс и статус
+/history - История генераций
 
 🚀 Начни с команды /photo для генерации изображения!
 """
     await message.answer(welcome_text)
-
-
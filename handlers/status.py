@@ -5,8 +5,7 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from database.base import async_session_maker
-from database.models import User
+from services.user_cache import get_user
 
 logger = logging.getLogger(__name__)
 
@@ -18,23 +17,18 @@ async def cmd_status(message: Message):
     """Показать статус пользователя."""
     user_id = message.from_user.id
 
-    async with async_session_maker() as session:
-        from sqlalchemy import select
+    # Баланс берется из кэша, без обращения к БД
+    user = await get_user(user_id)
 
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
+    if user is None:
+        await message.answer("❌ Пользователь не найден. Используйте /start")
+        return
 
-        if user is None:
-            await message.answer("❌ Пользователь не найден. Используйте /start")
-            return
-
-        status_text = f"""
+    status_text = f"""
 📊 Твой статус:
 
 💳 Кредиты: {user.credits}
 
 {'✅ Активна' if user.credits > 0 else '⚠️ Нет кредитов'}
 """
-        await message.answer(status_text)
-
-
+    await message.answer(status_text)
@@ -1,5 +1,6 @@
 """Обработчики команды /buy_subscription."""
 import logging
+import uuid
 
 from aiogram import Router, F
 from aiogram.filters import Command
@@ -7,7 +8,7 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 
 from database.base import async_session_maker
 from database.models import Payment as PaymentModel
-from payments.yookassa_client import create_payment, SUBSCRIPTION_PLANS
+from payments.yookassa_client import get_client, SUBSCRIPTION_PLANS
 
 logger = logging.getLogger(__name__)
 
@@ -42,21 +43,31 @@ async def process_plan_selection(callback: CallbackQuery):
         return
 
     try:
-        # Создаем платеж
-        payment_id, payment_url = create_payment(user_id, amount)
-
-        # Сохраняем платеж в БД
         async with async_session_maker() as session:
+            # Сначала сохраняем платеж: его ключ идемпотентности защищает
+            # от повторного списания при повторных запросах к YooKassa
             payment = PaymentModel(
                 user_id=user_id,
-                payment_id=payment_id,
-                amount=str(amount),
+                idempotence_key=str(uuid.uuid4()),
+                amount=amount,
                 credits=SUBSCRIPTION_PLANS[amount],
                 status="pending",
             )
             session.add(payment)
             await session.commit()
 
+            try:
+                payment_id, payment_url = await get_client().create_payment(
+                    user_id, amount, idempotence_key=payment.idempotence_key
+                )
+            except Exception:
+                payment.status = "failed"
+                await session.commit()
+                raise
+
+            payment.payment_id = payment_id
+            await session.commit()
+
         # Отправляем ссылку на оплату
         await callback.message.edit_text(
             f"💳 Перейдите по ссылке для оплаты:\n\n"
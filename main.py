@@ -1,28 +1,49 @@
 """Главный файл приложения для запуска через python."""
+import argparse
 import asyncio
 import logging
-import sys
+import secrets
+import time
 from contextlib import asynccontextmanager
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
+from config.logging_config import setup_logging
 from config.settings import settings
-from database.base import init_db
-from handlers import start, photo, subscription, status
-from webhooks import gen_callback, yookassa
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
+from database.base import async_session_maker, init_db
+from handlers import start, photo, subscription, status, history, admin
+from middlewares.metrics import HandlerMetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.tracing import BotApiTracingMiddleware, TracingMiddleware
+from payments.reconciler import PaymentReconciler
+from payments.yookassa_client import YooKassaClient, set_client as set_yookassa_client
+from services import metrics, tracing
+from services.delivery import DeliveryQueue, set_queue
+from services.image_generation.client import ImageGenerationClient, set_client
+from services.image_generation.preprocess import ImagePreprocessor, set_preprocessor
+from services.image_generation.outbox import DeliveryOutbox, set_outbox
+from services.image_generation.reconciler import GenerationReconciler
+from services.image_generation.submitter import GenerationSubmitter, set_submitter
+from services.image_generation.retention import PartitionMaintenance, TaskRetention
+from services.leader import (
+    PAYMENT_RECONCILER_LOCK_ID, RECONCILER_LOCK_ID, RETENTION_LOCK_ID, LeaderElection
 )
+from services.usage_stats import stats_report
+from webhooks import gen_callback, telegram, yookassa
+
 logger = logging.getLogger(__name__)
 
+# Роли процесса (APP_ROLE / --role)
+ROLES = ("all", "ingress", "dispatcher")
+
 # Глобальные переменные для бота
 bot: Bot = None
 dp: Dispatcher = None
@@ -33,6 +54,7 @@ app = FastAPI()
 
 app.include_router(yookassa.router)
 app.include_router(gen_callback.router)
+app.include_router(telegram.router)
 
 # CORS (при необходимости)
 app.add_middleware(
@@ -44,40 +66,242 @@ app.add_middleware(
 )
 
 
-@asynccontextmanager
-async def lifespan_context(app: FastAPI):
-    """Lifespan события для FastAPI."""
-    global bot, dp, polling_task
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    """Длительность запросов по шаблону маршрута (/gen/callback, /yookassa/webhook, ...)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        # Запросы мимо маршрутов не учитываем, чтобы не раздувать число меток
+        if route is not None:
+            metrics.HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                route=route.path,
+                method=request.method,
+                status=status,
+            )
 
-    logger.info("Запуск приложения...")
-    await init_db()
-    logger.info("База данных инициализирована")
 
-    # Создаем бота и диспетчер
-    bot = Bot(token=settings.BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+@app.middleware("http")
+async def http_tracing(request: Request, call_next):
+    """Корневой спан HTTP-запроса (callback'и, webhooks)."""
+    with tracing.span(f"http {request.method} {request.url.path}") as item:
+        response = await call_next(request)
+        if item is not None:
+            route = request.scope.get("route")
+            if route is not None:
+                item.name = f"http {request.method} {route.path}"
+            item.attrs["status"] = response.status_code
+        return response
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/debug/traces")
+async def debug_traces(
+    trace_id: Optional[str] = None,
+    limit: int = 200,
+    x_debug_token: Optional[str] = Header(default=None),
+):
+    """Последние спаны процесса; с trace_id — одна трасса и связанные с ней."""
+    if not settings.DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_debug_token or not secrets.compare_digest(x_debug_token, settings.DEBUG_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"spans": tracing.get_spans(trace_id, limit)}
+
+
+@app.get("/admin/stats")
+async def admin_stats(days: int = 7, x_admin_token: Optional[str] = Header(default=None)):
+    """Сводка по генерациям и платежам за последние days дней (из агрегатных таблиц)."""
+    if not settings.ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    async with async_session_maker() as session:
+        return {"days": await stats_report(session, max(1, min(days, 90)))}
+
+
+def create_bot() -> Bot:
+    """Создать бота (с собственным Bot API сервером, если он задан)."""
+    session = None
+    if settings.TELEGRAM_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_SERVER))
+    return Bot(token=settings.BOT_TOKEN, session=session)
+
+
+def create_storage() -> BaseStorage:
+    """
+    Создать хранилище FSM.
+
+    В webhook-режиме обновления одного пользователя могут попасть в разные
+    воркеры, поэтому для нескольких процессов нужен общий Redis.
+    """
+    if settings.REDIS_URL:
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(settings.REDIS_URL)
+    return MemoryStorage()
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создать диспетчер с middleware и роутерами."""
+    dp = Dispatcher(storage=create_storage())
+
+    # Спаны обновления и выбранного хэндлера
+    tracing_middleware = TracingMiddleware()
+    dp.update.outer_middleware(tracing_middleware)
+    dp.message.middleware(tracing_middleware)
+    dp.callback_query.middleware(tracing_middleware)
+
+    # Anti-flood до роутеров: лишние обновления не доходят до БД
+    if settings.THROTTLE_ENABLED:
+        throttling = ThrottlingMiddleware()
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
+
+    # Длительность обработчиков (inner middleware видит выбранный хэндлер)
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
 
     # Регистрируем роутеры
     dp.include_router(start.router)
     dp.include_router(photo.router)
     dp.include_router(subscription.router)
     dp.include_router(status.router)
+    dp.include_router(history.router)
+    dp.include_router(admin.router)
+    return dp
+
 
-    # Передаем bot instance в webhooks
-    gen_callback.set_bot(bot)
-    yookassa.set_bot(bot)
+@asynccontextmanager
+async def lifespan_context(app: FastAPI):
+    """
+    Lifespan события для FastAPI.
 
+    Роль процесса (APP_ROLE или --role) определяет, что он запускает:
+    ingress — обновления бота и HTTP-маршруты, dispatcher — запуск генераций,
+    доставку результатов и фоновые задачи, all — все вместе.
+    """
+    global bot, dp, polling_task
 
-    logger.info("Запуск polling в фоновом режиме...")
+    # Логирование настраивается здесь, а не при импорте: forkserver пула
+    # предобработки импортирует __main__ и не должен запускать поток QueueListener
+    setup_logging()
 
-    async def run_polling():
-        try:
-            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
-        except Exception as e:
-            logger.error(f"Ошибка в polling: {e}", exc_info=True)
+    role = settings.APP_ROLE
+    if role not in ROLES:
+        raise RuntimeError(f"Неизвестная роль APP_ROLE={role}, допустимо: {', '.join(ROLES)}")
+    handles_updates = role in ("all", "ingress")
+    dispatches = role in ("all", "dispatcher")
+
+    logger.info(f"Запуск приложения (роль {role})...")
+    await init_db()
+    logger.info("База данных инициализирована")
+
+    # Общий HTTP-клиент API генерации
+    gen_client = ImageGenerationClient()
+    set_client(gen_client)
+
+    # Пул процессов для подготовки изображений (перед отправкой провайдеру)
+    preprocessor = ImagePreprocessor() if settings.PREPROCESS_ENABLED and dispatches else None
+    if preprocessor:
+        await preprocessor.warm_up()
+    set_preprocessor(preprocessor)
+
+    # Общий HTTP-клиент YooKassa
+    yookassa_client = YooKassaClient()
+    set_yookassa_client(yookassa_client)
 
-    polling_task = asyncio.create_task(run_polling())
+    # Бот нужен всем ролям: ingress отвечает на обновления, dispatcher скачивает
+    # входные фото и доставляет результаты
+    bot = create_bot()
+    bot.session.middleware(BotApiTracingMiddleware())
+
+    # Очередь исходящих сообщений для webhooks
+    delivery_queue = DeliveryQueue(bot)
+    set_queue(delivery_queue)
+    delivery_queue.start()
+
+    # Генерации запускает и результаты доставляет процесс с ролью dispatcher (или all)
+    delivery_outbox = None
+    generation_submitter = None
+    if dispatches:
+        delivery_outbox = DeliveryOutbox(delivery_queue)
+        set_outbox(delivery_outbox)
+        delivery_outbox.start()
+
+        generation_submitter = GenerationSubmitter(bot)
+        set_submitter(generation_submitter)
+        generation_submitter.start()
+
+    # Сверка задач, для которых не пришел callback: один экземпляр на все диспетчеры
+    reconciler_leader = None
+    reconciler = None
+    if dispatches and settings.RECONCILE_ENABLED:
+        reconciler_leader = LeaderElection("reconciler", RECONCILER_LOCK_ID)
+        reconciler_leader.start()
+        reconciler = GenerationReconciler(reconciler_leader)
+        reconciler.start()
+
+    # Сверка платежей, по которым не пришел webhook YooKassa
+    payment_leader = None
+    payment_reconciler = None
+    if dispatches and settings.PAYMENT_RECONCILE_ENABLED:
+        payment_leader = LeaderElection("payment_reconciler", PAYMENT_RECONCILER_LOCK_ID)
+        payment_leader.start()
+        payment_reconciler = PaymentReconciler(payment_leader)
+        payment_reconciler.start()
+
+    # Партиции generation_tasks: создание заранее всегда, архивирование старых — по флагу
+    retention_leader = None
+    partition_maintenance = None
+    retention = None
+    if dispatches:
+        retention_leader = LeaderElection("generation_retention", RETENTION_LOCK_ID)
+        retention_leader.start()
+        partition_maintenance = PartitionMaintenance(retention_leader)
+        partition_maintenance.start()
+        if settings.GEN_TASK_RETENTION_ENABLED:
+            retention = TaskRetention(retention_leader)
+            retention.start()
+
+    if handles_updates:
+        dp = create_dispatcher()
+
+    if not handles_updates:
+        logger.info("Обновления бота обрабатывают процессы с ролью ingress")
+    elif settings.BOT_MODE == "webhook":
+        telegram.set_bot(bot)
+        telegram.set_dispatcher(dp)
+        await telegram.register_webhook(bot, dp)
+    else:
+        logger.info("Запуск polling в фоновом режиме...")
+
+        async def run_polling():
+            try:
+                # Polling не работает, пока зарегистрирован webhook
+                await bot.delete_webhook()
+                # Сигналы обрабатывает uvicorn: он останавливает приложение через lifespan
+                await dp.start_polling(
+                    bot,
+                    allowed_updates=dp.resolve_used_update_types(),
+                    handle_signals=False,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка в polling: {e}", exc_info=True)
+
+        polling_task = asyncio.create_task(run_polling())
 
     yield
 
@@ -88,8 +312,34 @@ async def lifespan_context(app: FastAPI):
             await polling_task
         except asyncio.CancelledError:
             pass
+    await telegram.shutdown()
+    if reconciler:
+        await reconciler.stop()
+        await reconciler_leader.stop()
+    if payment_reconciler:
+        await payment_reconciler.stop()
+        await payment_leader.stop()
+    if retention:
+        await retention.stop()
+    if partition_maintenance:
+        await partition_maintenance.stop()
+        await retention_leader.stop()
+    if generation_submitter:
+        await generation_submitter.stop()
+        set_submitter(None)
+    if delivery_outbox:
+        await delivery_outbox.stop()
+        set_outbox(None)
+    await delivery_queue.stop()
+    await gen_client.close()
+    if preprocessor:
+        preprocessor.shutdown()
+    await yookassa_client.close()
     if bot:
         await bot.session.close()
+    if dp:
+        await dp.storage.close()
+    tracing.close()
 
 
 # Встраиваем lifespan в FastAPI
@@ -99,12 +349,22 @@ app.router.lifespan_context = lifespan_context
 async def main():
     """Главная функция для запуска через python."""
     # Запуск FastAPI в фоне через uvicorn
-    config = uvicorn.Config(app, host=settings.HOST, port=settings.PORT, log_level="info")
+    # log_config=None: логи uvicorn идут через общую очередь логирования
+    config = uvicorn.Config(app, host=settings.HOST, port=settings.PORT, log_level="info", log_config=None)
     server = uvicorn.Server(config)
     await server.serve()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram-бот генерации изображений")
+    parser.add_argument("--role", choices=ROLES, help="роль процесса (по умолчанию APP_ROLE)")
+    args = parser.parse_args()
+    if args.role:
+        settings.APP_ROLE = args.role
+
+    # Настройка логирования
+    setup_logging()
+
     # Запуск event loop
     try:
         asyncio.run(main())
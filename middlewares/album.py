@@ -0,0 +1,75 @@
+"""Сборка альбомов (media group) в одно событие."""
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from config.settings import settings
+
+# Срок жизни ключей альбома в Redis, если собравший его процесс упал (секунды)
+_ALBUM_TTL = 60
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Собирает сообщения одного альбома и вызывает хэндлер один раз.
+
+    Telegram присылает альбом отдельными сообщениями с общим media_group_id.
+    Первое сообщение ждет ALBUM_COLLECT_DELAY секунд, остальные только
+    добавляются в список; хэндлер получает их в аргументе album.
+
+    В webhook-режиме с несколькими воркерами части альбома попадают в разные
+    процессы, поэтому при REDIS_URL альбом собирается в Redis хранилища FSM:
+    хэндлер вызывает только процесс, получивший альбом первым. Без Redis
+    альбомы собираются в памяти процесса, и ingress должен быть одним воркером.
+    """
+
+    def __init__(self):
+        self._albums: dict[str, list[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id:
+            return await handler(event, data)
+        if settings.REDIS_URL:
+            return await self._collect_shared(handler, event, data)
+
+        album = self._albums.setdefault(event.media_group_id, [])
+        album.append(event)
+        if len(album) > 1:
+            return None
+
+        await asyncio.sleep(settings.ALBUM_COLLECT_DELAY)
+        messages = self._albums.pop(event.media_group_id)
+        data["album"] = sorted(messages, key=lambda m: m.message_id)
+        return await handler(event, data)
+
+    async def _collect_shared(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        """Собрать альбом в Redis, общем для всех воркеров."""
+        redis = data["fsm_storage"].redis
+        key = f"album:{event.media_group_id}"
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, event.model_dump_json(exclude_none=True))
+            pipe.expire(key, _ALBUM_TTL)
+            await pipe.execute()
+        if not await redis.set(f"{key}:owner", 1, nx=True, ex=_ALBUM_TTL):
+            return None
+
+        await asyncio.sleep(settings.ALBUM_COLLECT_DELAY)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key, f"{key}:owner")
+            raw, _ = await pipe.execute()
+        messages = [Message.model_validate_json(item).as_(data["bot"]) for item in raw]
+        data["album"] = sorted(messages, key=lambda m: m.message_id)
+        return await handler(event, data)
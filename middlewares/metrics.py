@@ -0,0 +1,34 @@
+"""Метрики длительности обработчиков aiogram."""
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.metrics import HANDLER_ERRORS, HANDLER_LATENCY
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Измеряет длительность каждого обработчика.
+
+    Регистрируется как inner middleware диспетчера: к этому моменту
+    обработчик уже выбран и доступен в data["handler"].
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        label = f"{callback.__module__}.{callback.__qualname__}"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=label)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=label)
@@ -0,0 +1,116 @@
+"""Ограничение частоты запросов пользователей (anti-flood)."""
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config.settings import settings
+from services import metrics
+from services.cache import TTLCache
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит пользователя
+GLOBAL_KEY = "*"
+
+THROTTLED = metrics.counter(
+    "throttle_updates_total", "Обновления, прошедшие лимит и отброшенные им", ("key", "result")
+)
+
+
+def command_key(event: TelegramObject) -> Optional[str]:
+    """
+    Ключ лимита для события.
+
+    Для команд — имя команды (/photo -> "photo"), для callback'ов —
+    префикс данных (confirm_1024x1024 -> "confirm").
+    """
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        return event.text[1:].split(maxsplit=1)[0].split("@")[0].lower() or None
+    if isinstance(event, CallbackQuery) and event.data:
+        return event.data.split("_", 1)[0]
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Отбрасывает лишние обновления до того, как они дойдут до роутеров.
+
+    У каждого пользователя есть общий token bucket и отдельные bucket'ы для
+    команд из THROTTLE_COMMAND_LIMITS. Отброшенные обновления не трогают БД;
+    пользователь получает предупреждение не чаще THROTTLE_NOTICE_INTERVAL.
+    """
+
+    def __init__(self):
+        self.rate = settings.THROTTLE_RATE
+        self.burst = settings.THROTTLE_BURST
+        self.command_limits = settings.THROTTLE_COMMAND_LIMITS
+        self._buckets: TTLCache[TokenBucket] = TTLCache(maxsize=100_000, ttl=600)
+        self._media_groups: TTLCache[bool] = TTLCache(maxsize=10_000, ttl=60)
+        self._notified: TTLCache[bool] = TTLCache(
+            maxsize=100_000, ttl=settings.THROTTLE_NOTICE_INTERVAL
+        )
+
+    def _bucket(self, user_id: int, key: str) -> TokenBucket:
+        bucket = self._buckets.peek((user_id, key))
+        if bucket is None:
+            if key == GLOBAL_KEY:
+                bucket = TokenBucket(self.rate, self.burst)
+            else:
+                rate, burst = self.command_limits[key]
+                bucket = TokenBucket(rate, burst)
+        self._buckets.set((user_id, key), bucket)
+        return bucket
+
+    def _allow(self, user_id: int, key: Optional[str]) -> bool:
+        # Сначала проверяем команду, чтобы не тратить общий токен зря
+        if key in self.command_limits and not self._bucket(user_id, key).try_acquire():
+            return False
+        return self._bucket(user_id, GLOBAL_KEY).try_acquire()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        key = command_key(event)
+        label = key if key in self.command_limits else GLOBAL_KEY
+
+        # Альбом приходит пачкой сообщений: лимит расходует только первое, а
+        # остальные части разделяют его решение — иначе после отброшенной
+        # первой части до обработчика дошел бы неполный альбом
+        media_group_id = event.media_group_id if isinstance(event, Message) else None
+        if media_group_id:
+            allowed = self._media_groups.peek(media_group_id)
+            if allowed is not None:
+                if allowed:
+                    return await handler(event, data)
+                THROTTLED.inc(key=label, result="dropped")
+                return None
+
+        allowed = self._allow(user.id, key)
+        if media_group_id:
+            self._media_groups.set(media_group_id, allowed)
+
+        if allowed:
+            THROTTLED.inc(key=label, result="passed")
+            return await handler(event, data)
+
+        THROTTLED.inc(key=label, result="dropped")
+        logger.debug(f"Throttled update from {user.id} ({label})")
+
+        if self._notified.peek(user.id) is None:
+            self._notified.set(user.id, True)
+            text = "⏳ Слишком много запросов, подождите немного."
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message):
+                await event.answer(text)
+        return None
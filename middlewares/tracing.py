@@ -0,0 +1,56 @@
+"""Трассировка обновлений Telegram и запросов к Bot API."""
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+from services import tracing
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Спаны обработки обновлений.
+
+    Как outer middleware на dp.update открывает корневой спан обновления,
+    как inner middleware на dp.message / dp.callback_query — спан выбранного
+    хэндлера внутри него.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            user = data.get("event_from_user")
+            with tracing.span(
+                "telegram.update",
+                update_id=event.update_id,
+                event_type=event.event_type,
+                user_id=user.id if user else None,
+            ):
+                return await handler(event, data)
+
+        callback = data["handler"].callback
+        with tracing.span(f"handler {callback.__module__}.{callback.__qualname__}"):
+            return await handler(event, data)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Спан на каждый запрос к Bot API."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with tracing.span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
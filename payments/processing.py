@@ -0,0 +1,47 @@
+"""Применение статусов платежей YooKassa (webhook и сверка)."""
+import logging
+from typing import Optional
+
+from database.base import async_session_maker
+from services.credits import PaymentCredit, cancel_payment, credit_payment
+from services.delivery import DeliveryJob, get_queue
+
+logger = logging.getLogger(__name__)
+
+
+async def apply_payment_status(payment_id: str, status: str) -> Optional[PaymentCredit]:
+    """
+    Применить статус платежа из YooKassa.
+
+    succeeded — начислить кредиты (ровно один раз, см. credit_payment) и
+    уведомить пользователя; canceled — отметить отмену ожидающего платежа.
+    Остальные статусы ничего не меняют.
+
+    Returns:
+        PaymentCredit, если кредиты начислены этим вызовом
+    """
+    async with async_session_maker() as session:
+        if status == "canceled":
+            if await cancel_payment(session, payment_id):
+                logger.info(f"Платеж {payment_id} отменен", extra={"payment_id": payment_id})
+            return None
+        if status != "succeeded":
+            return None
+        credited = await credit_payment(session, payment_id)
+
+    if credited is None:
+        return None
+
+    # Уведомление отправляется в фоне
+    queue = get_queue()
+    if queue:
+        queue.enqueue(
+            DeliveryJob(
+                chat_id=credited.user_id,
+                text=f"✅ Оплата прошла! Вам начислено {credited.credits} кредитов.\n\n"
+                f"💳 Текущий баланс: {credited.balance} кредитов",
+            )
+        )
+    else:
+        logger.warning("Очередь доставки не запущена, уведомление не отправлено")
+    return credited
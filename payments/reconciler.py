@@ -0,0 +1,158 @@
+"""Сверка платежей, по которым не пришел webhook YooKassa."""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, tuple_, update
+
+from config.settings import settings
+from database.base import async_session_maker
+from database.models import Payment
+from payments.processing import apply_payment_status
+from payments.yookassa_client import YooKassaError, get_client
+from services import metrics
+from services.leader import LeaderElection
+
+logger = logging.getLogger(__name__)
+
+RECONCILED = metrics.counter(
+    "payment_reconcile_total", "Платежи, проверенные сверкой, по результату", ("result",)
+)
+
+
+class PaymentReconciler:
+    """
+    Периодически проверяет в YooKassa платежи, зависшие в pending.
+
+    Платежи старше PAYMENT_RECONCILE_STALE_AFTER проверяются пачками, не
+    больше PAYMENT_RECONCILE_CONCURRENCY запросов одновременно; succeeded и
+    canceled применяются тем же путем, что и в yookassa_webhook. Платеж,
+    который старше PAYMENT_EXPIRE_AFTER и все еще не оплачен, помечается
+    expired и больше не проверяется (поздний webhook об оплате все равно
+    начислит кредиты). При нескольких диспетчерах сверку выполняет только лидер.
+    """
+
+    def __init__(self, leader: Optional[LeaderElection] = None):
+        self.leader = leader
+        self.interval = settings.PAYMENT_RECONCILE_INTERVAL
+        self.batch_size = settings.PAYMENT_RECONCILE_BATCH_SIZE
+        self._semaphore = asyncio.Semaphore(settings.PAYMENT_RECONCILE_CONCURRENCY)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "runs": 0,
+            "checked": 0,
+            "succeeded": 0,
+            "canceled": 0,
+            "expired": 0,
+            "failed": 0,
+            "still_pending": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """Запустить периодическую сверку."""
+        self._task = asyncio.create_task(self._loop(), name="payment-reconciler")
+
+    async def stop(self):
+        """Остановить сверку."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.leader is None or self.leader.is_leader:
+                    await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Ошибка сверки платежей: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Проверить все зависшие платежи (пачками)."""
+        self.stats["runs"] += 1
+        now = datetime.now(timezone.utc)
+        stale_before = now - timedelta(seconds=settings.PAYMENT_RECONCILE_STALE_AFTER)
+        expire_before = now - timedelta(seconds=settings.PAYMENT_EXPIRE_AFTER)
+
+        cursor = None
+        while True:
+            batch = await self._load_batch(stale_before, cursor)
+            if not batch:
+                break
+
+            await asyncio.gather(*(self._reconcile(payment, expire_before) for payment in batch))
+
+            if len(batch) < self.batch_size:
+                break
+            cursor = (batch[-1].created_at, batch[-1].id)
+
+    async def _load_batch(self, stale_before: datetime, cursor):
+        """Пачка ожидающих платежей (по частичному индексу ix_payments_pending)."""
+        query = select(Payment.id, Payment.payment_id, Payment.created_at).where(
+            Payment.status == "pending",
+            Payment.created_at < stale_before,
+        )
+        if cursor:
+            query = query.where(tuple_(Payment.created_at, Payment.id) > tuple_(*cursor))
+        query = query.order_by(Payment.created_at, Payment.id).limit(self.batch_size)
+
+        async with async_session_maker() as session:
+            result = await session.execute(query)
+            return result.all()
+
+    async def _reconcile(self, payment, expire_before: datetime):
+        async with self._semaphore:
+            self.stats["checked"] += 1
+            try:
+                await self._check(payment, expire_before)
+            except YooKassaError as e:
+                self._count("errors")
+                logger.warning(f"Не удалось проверить платеж {payment.payment_id}: {e}")
+            except Exception as e:
+                self._count("errors")
+                logger.error(f"Ошибка сверки платежа {payment.id}: {e}", exc_info=True)
+
+    async def _check(self, payment, expire_before: datetime):
+        # Платеж не создан в YooKassa (процесс упал до ответа): оплатить его нельзя
+        if payment.payment_id is None:
+            await self._close(payment.id, "failed")
+            self._count("failed")
+            return
+
+        response = await get_client().get_payment(payment.payment_id)
+        status = response.get("status")
+        if status in ("succeeded", "canceled"):
+            credited = await apply_payment_status(payment.payment_id, status)
+            self._count(status)
+            if credited:
+                logger.info(
+                    "Платеж зачислен сверкой",
+                    extra={"payment_id": payment.payment_id, "user_id": credited.user_id},
+                )
+        elif payment.created_at < expire_before:
+            await self._close(payment.id, "expired")
+            self._count("expired")
+        else:
+            self._count("still_pending")
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        RECONCILED.inc(result=result)
+
+    async def _close(self, payment_row_id: int, status: str):
+        """Закрыть платеж, который все еще ожидает оплаты."""
+        async with async_session_maker() as session:
+            await session.execute(
+                update(Payment)
+                .where(Payment.id == payment_row_id, Payment.status == "pending")
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
@@ -1,17 +1,17 @@
 """Клиент для работы с YooKassa."""
+import asyncio
 import logging
-import uuid
+import time
+from typing import Optional
 
-from yookassa import Configuration, Payment
+import aiohttp
 
 from config.settings import settings
+from services import tracing
+from services.metrics import YOOKASSA_LATENCY
 
 logger = logging.getLogger(__name__)
 
-# Конфигурация YooKassa
-Configuration.account_id = settings.YOOKASSA_SHOP_ID
-Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
-
 # Тарифы кредитов
 SUBSCRIPTION_PLANS = {
     200: 10,   # 200 ₽ — 10 кредитов
@@ -19,43 +19,140 @@ SUBSCRIPTION_PLANS = {
     1000: 50,  # 1000 ₽ — 50 кредитов
 }
 
+# Общий клиент приложения (устанавливается из main.py)
+_client: Optional["YooKassaClient"] = None
+
+
+def set_client(client_instance: "YooKassaClient"):
+    """Установить общий клиент."""
+    global _client
+    _client = client_instance
+
+
+def get_client() -> "YooKassaClient":
+    """Получить общий клиент."""
+    global _client
+    if _client is None:
+        _client = YooKassaClient()
+    return _client
 
-def create_payment(user_id: int, amount: int) -> tuple[str, str]:
-    """
-    Создать платеж в YooKassa.
 
-    Args:
-        user_id: ID пользователя Telegram
-        amount: Сумма платежа в рублях
+class YooKassaError(Exception):
+    """Ошибка API YooKassa."""
 
-    Returns:
-        Tuple (payment_id, payment_url)
+
+class YooKassaClient:
     """
-    if amount not in SUBSCRIPTION_PLANS:
-        raise ValueError(f"Неподдерживаемая сумма: {amount}. Доступны: {list(SUBSCRIPTION_PLANS.keys())}")
-
-    credits = SUBSCRIPTION_PLANS[amount]
-    return_url = f"https://t.me/{settings.BOT_USERNAME}?start=success"
-
-    payment = Payment.create(
-        {
-            "amount": {"value": f"{amount}.00", "currency": "RUB"},
-            "confirmation": {
-                "type": "redirect",
-                "return_url": return_url,
-            },
-            "description": f"Покупка {credits} кредитов для пользователя {user_id}",
-            "metadata": {"user_id": user_id, "credits": credits, "amount": amount},
-            "capture": True,
-        },
-        uuid.uuid4(),
-    )
+    Асинхронный клиент API YooKassa.
 
-    payment_id = payment.id
-    payment_url = payment.confirmation.confirmation_url
+    Работает через общую aiohttp-сессию, поэтому не блокирует event loop.
+    Повторные попытки используют тот же ключ идемпотентности, и YooKassa
+    возвращает уже созданный платеж вместо нового списания.
+    """
+
+    def __init__(self):
+        self.api_url = settings.YOOKASSA_API_URL.rstrip("/")
+        self._auth = aiohttp.BasicAuth(settings.YOOKASSA_SHOP_ID, settings.YOOKASSA_SECRET_KEY)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получить (или создать) HTTP-сессию."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                connector=aiohttp.TCPConnector(limit_per_host=settings.YOOKASSA_POOL_LIMIT),
+                timeout=aiohttp.ClientTimeout(total=settings.YOOKASSA_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self):
+        """Закрыть HTTP-сессию."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(
+        self, method: str, path: str, json: Optional[dict] = None, idempotence_key: Optional[str] = None
+    ) -> dict:
+        """
+        Выполнить запрос к API с повторными попытками.
+
+        Повторяются сетевые ошибки, 5xx и ответ 202 (YooKassa еще обрабатывает
+        запрос с этим ключом идемпотентности).
+        """
+        headers = {}
+        if idempotence_key:
+            headers["Idempotence-Key"] = idempotence_key
+
+        last_error = None
+        for attempt in range(settings.YOOKASSA_MAX_RETRIES):
+            if attempt:
+                await asyncio.sleep(settings.YOOKASSA_RETRY_DELAY * attempt)
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self._get_session().request(
+                    method, f"{self.api_url}{path}", json=json, headers=headers
+                ) as response:
+                    status = response.status
+                    if response.status == 200:
+                        return await response.json()
+                    error_text = await response.text()
+                    if response.status == 202 or response.status >= 500:
+                        last_error = YooKassaError(f"{response.status} - {error_text}")
+                        continue
+                    raise YooKassaError(f"{response.status} - {error_text}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                logger.warning(f"Ошибка запроса к YooKassa (попытка {attempt + 1}): {e}")
+            finally:
+                YOOKASSA_LATENCY.observe(time.perf_counter() - started, method=method, status=status)
+
+        raise YooKassaError(f"YooKassa недоступна: {last_error}")
+
+    @tracing.traced("yookassa.create_payment")
+    async def create_payment(self, user_id: int, amount: int, idempotence_key: str) -> tuple[str, str]:
+        """
+        Создать платеж в YooKassa.
+
+        Args:
+            user_id: ID пользователя Telegram
+            amount: Сумма платежа в рублях
+            idempotence_key: Ключ идемпотентности, привязанный к строке Payment
+
+        Returns:
+            Tuple (payment_id, payment_url)
+        """
+        if amount not in SUBSCRIPTION_PLANS:
+            raise ValueError(f"Неподдерживаемая сумма: {amount}. Доступны: {list(SUBSCRIPTION_PLANS.keys())}")
+
+        credits = SUBSCRIPTION_PLANS[amount]
+        return_url = f"https://t.me/{settings.BOT_USERNAME}?start=success"
+
+        payment = await self._request(
+            "POST",
+            "/payments",
+            json={
+                "amount": {"value": f"{amount}.00", "currency": "RUB"},
+                "confirmation": {
+                    "type": "redirect",
+                    "return_url": return_url,
+                },
+                "description": f"Покупка {credits} кредитов для пользователя {user_id}",
+                "metadata": {"user_id": user_id, "credits": credits, "amount": amount},
+                "capture": True,
+            },
+            idempotence_key=idempotence_key,
+        )
 
-    logger.info(f"Создан платеж {payment_id} для пользователя {user_id} на сумму {amount}₽")
+        payment_id = payment["id"]
+        payment_url = payment["confirmation"]["confirmation_url"]
 
-    return payment_id, payment_url
+        logger.info(f"Создан платеж {payment_id} для пользователя {user_id} на сумму {amount}₽")
 
+        return payment_id, payment_url
 
+    @tracing.traced("yookassa.get_payment")
+    async def get_payment(self, payment_id: str) -> dict:
+        """Получить платеж из YooKassa."""
+        return await self._request("GET", f"/payments/{payment_id}")
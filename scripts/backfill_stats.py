@@ -0,0 +1,55 @@
+"""
+Заполнение дневных счетчиков генераций (generation_daily_stats) по истории.
+
+Счетчики ведутся с момента применения миграции 12; скрипт пересчитывает их
+за прошедшие дни по generation_tasks. Дни пересчитываются по одному, каждый
+в своей транзакции, поэтому скрипт можно прервать и запустить снова.
+
+Нужны те же переменные окружения, что и для бота (DATABASE_URL и т. д.).
+
+Запуск:
+    python scripts/backfill_stats.py                      # вся история до вчера
+    python scripts/backfill_stats.py --since 2024-01-01 --until 2024-02-01
+"""
+import argparse
+import asyncio
+import sys
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from config.settings import settings  # noqa: E402
+from database.base import async_session_maker, init_db  # noqa: E402
+from services.usage_stats import backfill, first_task_day  # noqa: E402
+
+
+async def main(args):
+    await init_db()
+    today = datetime.now(timezone.utc).date()
+    # Сегодняшние счетчики обновляются параллельно, их не трогаем
+    until = min(args.until or today, today)
+
+    since = args.since
+    if since is None:
+        async with async_session_maker() as session:
+            since = await first_task_day(session)
+        if since is None:
+            print("Задач генерации нет")
+            return
+
+    day = since
+    while day < until:
+        async with async_session_maker() as session:
+            await backfill(session, day, day + timedelta(days=1), args.cost)
+        print(f"{day.isoformat()}: готово")
+        day += timedelta(days=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--since", type=date.fromisoformat, help="первый день (UTC), по умолчанию — самая старая задача")
+    parser.add_argument("--until", type=date.fromisoformat, help="день после последнего (UTC), по умолчанию — сегодня")
+    parser.add_argument("--cost", type=int, default=settings.GENERATION_COST, help="цена генерации в кредитах")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""
+Бенчмарк старта: время от запуска процесса до первого обработанного обновления.
+
+Поднимает заглушку Bot API (fakes.telegram) в этом процессе, кладет в очередь
+команду /start и запускает `python main.py` в polling-режиме. Замеряются:
+
+    first_call  — первый запрос к Bot API (импорты, настройки, init_db)
+    ready       — первый getUpdates (бот готов принимать обновления)
+    first_reply — ответ на /start (обработано первое обновление)
+
+Нужны те же переменные окружения, что и для бота (DATABASE_URL и т. д.).
+
+Запуск:
+    python scripts/bench_startup.py --runs 5
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import uvicorn
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from fakes import telegram as fake  # noqa: E402
+
+BENCH_USER_ID = 777_000_001
+
+
+async def run_once(api_url: str, app_port: int, timeout: float) -> dict:
+    """Один запуск бота; возвращает длительности этапов в секундах."""
+    fake.calls.clear()
+    fake.first_call.clear()
+    fake.push(fake.make_message_update(BENCH_USER_ID, "/start"))
+
+    env = dict(
+        os.environ,
+        BOT_MODE="polling",
+        TELEGRAM_API_SERVER=api_url,
+        PORT=str(app_port),
+    )
+    started = time.time()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "main.py",
+        cwd=ROOT,
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+    reply_at = None
+    try:
+        deadline = started + timeout
+        while time.time() < deadline and process.returncode is None:
+            replies = [
+                c
+                for c in fake.calls
+                if c["method"] == "sendMessage"
+                and int(c["params"].get("chat_id", 0)) == BENCH_USER_ID
+            ]
+            if replies:
+                reply_at = replies[0]["time"]
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+    if reply_at is None:
+        raise RuntimeError(f"Бот не ответил за {timeout} с (код выхода {process.returncode})")
+
+    first_call = min(fake.first_call.values())
+    return {
+        "first_call": first_call - started,
+        "ready": fake.first_call.get("getUpdates", reply_at) - started,
+        "first_reply": reply_at - started,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--api-port", type=int, default=8093)
+    parser.add_argument("--app-port", type=int, default=8094)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    server = uvicorn.Server(
+        uvicorn.Config(fake.app, host="127.0.0.1", port=args.api_port, log_level="warning")
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    results = []
+    try:
+        for i in range(args.runs):
+            result = await run_once(api_url, args.app_port, args.timeout)
+            results.append(result)
+            print(
+                f"run {i + 1}: "
+                + "  ".join(f"{stage}={value * 1000:.0f}ms" for stage, value in result.items())
+            )
+    finally:
+        server.should_exit = True
+        await server_task
+
+    if results:
+        print("median:", end="")
+        for stage in results[0]:
+            print(f"  {stage}={statistics.median(r[stage] for r in results) * 1000:.0f}ms", end="")
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+"""
+Нагрузочный тест сценария /photo на локальных заглушках.
+
+Поднимает в этом процессе заглушки Bot API (fakes.telegram), API генерации
+(fakes.gen_api) и YooKassa (fakes.yookassa), запускает `python main.py`
+отдельным процессом и прогоняет N пользователей по сценарию:
+
+    /start -> /photo -> фото -> prompt -> подтверждение -> callback -> доставка
+
+Выводит пропускную способность, p50/p95/p99 по этапам и пиковый RSS бота.
+Нужна тестовая база (DATABASE_URL) и остальные переменные окружения бота;
+пользователи создаются с новыми id при каждом запуске.
+
+Запуск:
+    python scripts/loadtest.py --users 200 --concurrency 50 --callback-delay 2
+    python scripts/loadtest.py --mode webhook
+    python scripts/loadtest.py --split   # отдельные процессы ingress и dispatcher
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+import uvicorn
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from fakes import gen_api as fake_gen  # noqa: E402
+from fakes import telegram as fake_tg  # noqa: E402
+from fakes import yookassa as fake_yookassa  # noqa: E402
+
+STAGES = ("start", "photo", "image", "prompt", "confirm", "delivery", "total")
+
+
+class StageError(Exception):
+    """Этап сценария не завершился."""
+
+
+async def serve(app, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    """Запустить ASGI-приложение в текущем event loop."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def step(user_id: int, update: dict, methods: set[str], timeout: float) -> tuple[float, dict]:
+    """Отправить обновление и дождаться ответа бота; возвращает (секунды, вызов)."""
+    future = fake_tg.expect(user_id, methods)
+    started = time.perf_counter()
+    fake_tg.push(update)
+    try:
+        call = await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise StageError(f"нет ответа ({', '.join(sorted(methods))})")
+    return time.perf_counter() - started, call
+
+
+async def user_flow(user_id: int, timeout: float, delivery_timeout: float) -> dict[str, float]:
+    """Сценарий одного пользователя; возвращает длительности этапов."""
+    timings = {}
+    flow_started = time.perf_counter()
+    send = {"sendMessage"}
+
+    timings["start"], _ = await step(user_id, fake_tg.make_message_update(user_id, "/start"), send, timeout)
+    timings["photo"], _ = await step(user_id, fake_tg.make_message_update(user_id, "/photo"), send, timeout)
+    timings["image"], _ = await step(user_id, fake_tg.make_photo_update(user_id), send, timeout)
+    timings["prompt"], call = await step(
+        user_id, fake_tg.make_message_update(user_id, "кот в космосе, акварель"), send, timeout
+    )
+    confirmation = call["result"]
+    if "reply_markup" not in confirmation:
+        raise StageError(f"нет кнопок подтверждения: {confirmation.get('text')}")
+
+    # Доставку считаем с момента подтверждения: в нее входит задержка провайдера
+    delivered = fake_tg.expect(user_id, {"sendPhoto", "sendMediaGroup"})
+    confirmed_at = time.time()
+    timings["confirm"], call = await step(
+        user_id,
+        fake_tg.make_callback_update(user_id, "confirm_1024x1024", confirmation),
+        {"editMessageText"},
+        timeout,
+    )
+    if "запущена" not in (call["params"].get("text") or ""):
+        delivered.cancel()
+        raise StageError(f"генерация не запущена: {call['params'].get('text')}")
+
+    try:
+        call = await asyncio.wait_for(delivered, timeout=delivery_timeout)
+    except asyncio.TimeoutError:
+        raise StageError("результат не доставлен")
+    timings["delivery"] = call["time"] - confirmed_at
+    timings["total"] = time.perf_counter() - flow_started
+    return timings
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Пиковый RSS процесса (VmHWM, только Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+async def wait_ready(app_urls: list[str], mode: str, timeout: float):
+    """Дождаться, пока бот начнет принимать обновления и запустятся все процессы."""
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            ready = "getUpdates" in fake_tg.first_call if mode == "polling" else bool(fake_tg.webhook)
+            if ready:
+                try:
+                    for app_url in app_urls:
+                        async with session.get(f"{app_url}/metrics") as response:
+                            response.raise_for_status()
+                    return
+                except aiohttp.ClientError:
+                    pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Бот не запустился за {timeout} с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--callback-delay", type=float, default=1.0, help="задержка callback провайдера, с")
+    parser.add_argument("--submit-error-rate", type=float, default=0.0, help="доля отклоненных запросов генерации")
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут ответа на шаг, с")
+    parser.add_argument("--delivery-timeout", type=float, default=120.0)
+    parser.add_argument("--tg-port", type=int, default=8193)
+    parser.add_argument("--gen-port", type=int, default=8194)
+    parser.add_argument("--yookassa-port", type=int, default=8195)
+    parser.add_argument("--app-port", type=int, default=8196)
+    parser.add_argument("--split", action="store_true", help="запустить роли ingress и dispatcher отдельно")
+    parser.add_argument("--app-log", help="файл для вывода бота (по умолчанию не сохраняется)")
+    args = parser.parse_args()
+
+    fake_gen.CALLBACK_DELAY = args.callback_delay
+    fake_gen.SUBMIT_ERROR_RATE = args.submit_error_rate
+    fake_gen.RESULT_URL = f"http://127.0.0.1:{args.tg_port}/file/result.jpg"
+    servers = [
+        await serve(fake_tg.app, args.tg_port),
+        await serve(fake_gen.app, args.gen_port),
+        await serve(fake_yookassa.app, args.yookassa_port),
+    ]
+
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    env = dict(
+        os.environ,
+        BOT_MODE=args.mode,
+        TELEGRAM_API_SERVER=f"http://127.0.0.1:{args.tg_port}",
+        TELEGRAM_WEBHOOK_URL=f"{app_url}/telegram/webhook",
+        WEBHOOK_SECRET=os.environ.get("WEBHOOK_SECRET") or "loadtest-secret",
+        GEN_API_URL=f"http://127.0.0.1:{args.gen_port}/gen",
+        GEN_API_STATUS_URL=f"http://127.0.0.1:{args.gen_port}/request/get/{{request_id}}",
+        CALLBACK_URL=f"{app_url}/gen/callback",
+        YOOKASSA_API_URL=f"http://127.0.0.1:{args.yookassa_port}/v3",
+        PORT=str(args.app_port),
+        HOST="127.0.0.1",
+    )
+    log = open(args.app_log, "w") if args.app_log else asyncio.subprocess.DEVNULL
+    # Роль -> порт; dispatcher слушает свой порт только ради /metrics
+    roles = {"ingress": args.app_port, "dispatcher": args.app_port + 1} if args.split else {"all": args.app_port}
+    processes = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, "main.py", cwd=ROOT, env=dict(env, APP_ROLE=role, PORT=str(port)),
+            stdout=log, stderr=log,
+        )
+        for role, port in roles.items()
+    ]
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    peak_rss = None
+    try:
+        # Диспетчер отвечает на /metrics только после старта (lifespan)
+        await wait_ready(
+            [f"http://127.0.0.1:{port}" for port in roles.values()], args.mode, timeout=60
+        )
+
+        # Новые id при каждом запуске: у пользователей из прошлых прогонов мог кончиться баланс
+        base_id = random.randint(10**9, 2 * 10**9)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def run_user(user_id: int):
+            async with semaphore:
+                try:
+                    result = await user_flow(user_id, args.timeout, args.delivery_timeout)
+                except StageError as e:
+                    errors[str(e)] += 1
+                    return
+                for stage, value in result.items():
+                    timings[stage].append(value)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_user(base_id + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        rss = [peak_rss_mb(process.pid) for process in processes]
+        peak_rss = sum(rss) if None not in rss else None
+    finally:
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+        for process in processes:
+            await process.wait()
+        for server, _ in servers:
+            server.should_exit = True
+        await asyncio.gather(*(task for _, task in servers))
+
+    completed = len(timings["total"])
+    print(f"mode={args.mode} roles={','.join(roles)} users={args.users} "
+          f"concurrency={args.concurrency} callback_delay={args.callback_delay}s")
+    print(f"completed={completed} failed={args.users - completed} elapsed={elapsed:.1f}s "
+          f"throughput={completed / elapsed:.2f} flows/s")
+    print(f"peak_rss={peak_rss:.1f}MB" if peak_rss is not None else "peak_rss=n/a")
+    print(f"{'stage':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage in STAGES:
+        values = timings.get(stage)
+        if not values:
+            continue
+        row = [percentile(values, p) * 1000 for p in (50, 95, 99)] + [max(values) * 1000]
+        print(f"{stage:<10}" + "".join(f"{v:>8.0f}ms" for v in row))
+    for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"error: {error} x{count}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+"""Атомарные операции с балансом кредитов."""
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+
+from database.models import Payment, User
+from services import usage_stats, user_cache
+from services.revenue import record_payment
+
+
+class PaymentCredit(NamedTuple):
+    """Результат зачисления платежа."""
+
+    user_id: int
+    credits: int
+    balance: int
+
+
+async def get_balance(session: AsyncSession, user_id: int) -> Optional[int]:
+    """Баланс из БД (None, если пользователя нет); обновляет кэш."""
+    balance = await session.scalar(select(User.credits).where(User.id == user_id))
+    if balance is not None:
+        user_cache.set_balance(user_id, balance)
+    return balance
+
+
+async def debit_credits(
+    session: AsyncSession, user_id: int, amount: int, commit: bool = True
+) -> Optional[int]:
+    """
+    Списать кредиты одним условным UPDATE.
+
+    С commit=False списание фиксируется вместе с остальной транзакцией
+    (например, с постановкой задач генерации в очередь), и новый баланс
+    в кэш записывает вызывающий после commit.
+
+    Returns:
+        Новый баланс или None, если пользователя нет или кредитов не хватает
+    """
+    result = await session.execute(
+        update(User)
+        .where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .returning(User.credits)
+        .execution_options(synchronize_session=False)
+    )
+    balance = result.scalar_one_or_none()
+    if balance is None:
+        # Кэш показывал достаточный баланс: он устарел
+        user_cache.invalidate(user_id)
+    elif commit:
+        await session.commit()
+        user_cache.set_balance(user_id, balance)
+    return balance
+
+
+async def refund_credits(
+    session: AsyncSession, user_id: int, amount: int, commit: bool = True
+) -> Optional[int]:
+    """
+    Вернуть кредиты за генерацию. Возвращает новый баланс.
+
+    При commit=False транзакция не фиксируется (возврат фиксируется вместе
+    с переводом задачи в failed), и кэш баланса обновляет вызывающий после
+    commit.
+    """
+    result = await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(credits=User.credits + amount)
+        .returning(User.credits)
+        .execution_options(synchronize_session=False)
+    )
+    balance = result.scalar_one_or_none()
+    if balance is not None:
+        await usage_stats.record_refund(session, user_id, amount)
+    if not commit:
+        return balance
+    await session.commit()
+
+    if balance is not None:
+        user_cache.set_balance(user_id, balance)
+    return balance
+
+
+async def _grant_credits(session: AsyncSession, user_id: int, amount: int) -> int:
+    """Начислить кредиты, создав пользователя при необходимости (без commit)."""
+    result = await session.execute(
+        insert(User)
+        .values(id=user_id, credits=amount)
+        .on_conflict_do_update(
+            index_elements=[User.id],
+            set_={"credits": User.credits + amount, "updated_at": func.now()},
+        )
+        .returning(User.credits)
+    )
+    return result.scalar_one()
+
+
+async def credit_payment(session: AsyncSession, payment_id: str) -> Optional[PaymentCredit]:
+    """
+    Отметить платеж успешным и начислить кредиты в одной транзакции.
+
+    Статус меняется условным UPDATE, поэтому повторные уведомления
+    не начисляют кредиты дважды; в той же транзакции обновляется дневная
+    сводка выручки.
+
+    Returns:
+        PaymentCredit или None, если платеж неизвестен или уже обработан
+    """
+    result = await session.execute(
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.status != "succeeded")
+        .values(status="succeeded")
+        .returning(Payment.user_id, Payment.credits, Payment.amount)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is None:
+        await session.rollback()
+        return None
+
+    balance = await _grant_credits(session, row.user_id, row.credits)
+    await record_payment(session, row.amount, row.credits)
+    await session.commit()
+
+    user_cache.set_balance(row.user_id, balance)
+    return PaymentCredit(user_id=row.user_id, credits=row.credits, balance=balance)
+
+
+async def cancel_payment(session: AsyncSession, payment_id: str) -> bool:
+    """
+    Отметить платеж отмененным, если он еще ожидает оплаты.
+
+    Returns:
+        True, если статус изменен этим вызовом
+    """
+    result = await session.execute(
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.status == "pending")
+        .values(status="canceled")
+        .returning(Payment.id)
+        .execution_options(synchronize_session=False)
+    )
+    changed = result.scalar_one_or_none() is not None
+    await session.commit()
+    return changed
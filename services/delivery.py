@@ -0,0 +1,283 @@
+"""Фоновая доставка сообщений в Telegram с ограничением частоты."""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InputMediaPhoto
+from sqlalchemy import update
+from sqlalchemy.sql import func
+
+from config.settings import settings
+from database.base import async_session_maker
+from database.models import GenerationTask
+from services.cache import TTLCache
+from services.image_generation import result_cache
+from services.image_generation.tasks import hot_window, release_deliveries, task_age
+from services import metrics, tracing
+from services.metrics import GENERATION_DELIVERED
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Общая очередь приложения (устанавливается из main.py)
+_queue: Optional["DeliveryQueue"] = None
+
+
+def set_queue(queue_instance: "DeliveryQueue"):
+    """Установить очередь доставки."""
+    global _queue
+    _queue = queue_instance
+
+
+def get_queue() -> Optional["DeliveryQueue"]:
+    """Получить очередь доставки."""
+    return _queue
+
+
+metrics.gauge(
+    "delivery_queue_size",
+    "Сообщения в очереди доставки",
+    function=lambda: _queue.size if _queue else 0,
+)
+
+
+@dataclass
+class MediaItem:
+    """Фото результата в альбоме."""
+
+    photo: str
+    request_id: Optional[str] = None
+    cache_key: Optional[str] = None
+
+
+@dataclass
+class DeliveryJob:
+    """Исходящее сообщение."""
+
+    chat_id: int
+    text: Optional[str] = None
+    photo: Optional[str] = None
+    # Для результатов генерации: статус доставки пишется в GenerationTask
+    request_id: Optional[str] = None
+    # Ключ кэша результатов: после отправки в него пишется file_id фото
+    cache_key: Optional[str] = None
+    # Результаты альбома: отправляются одной media group, text — подпись первого фото
+    media: list[MediaItem] = field(default_factory=list)
+    # Трасса, которую продолжает доставка (trace_id задачи генерации)
+    trace_id: Optional[str] = None
+    attempts: int = 0
+
+
+class DeliveryQueue:
+    """
+    In-process очередь исходящих сообщений.
+
+    Воркеры соблюдают глобальный лимит Bot API и лимит на чат, повторяют
+    отправку после RetryAfter и временных ошибок сети.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.workers_count = settings.DELIVERY_WORKERS
+        self.max_retries = settings.DELIVERY_MAX_RETRIES
+        self._queue: asyncio.Queue[DeliveryJob] = asyncio.Queue(maxsize=settings.DELIVERY_QUEUE_SIZE)
+        self._global_bucket = TokenBucket(settings.DELIVERY_GLOBAL_RATE, settings.DELIVERY_GLOBAL_RATE)
+        self._chat_buckets: TTLCache[TokenBucket] = TTLCache(maxsize=100_000, ttl=60)
+        self._workers: list[asyncio.Task] = []
+        # Отложенные повторы: handle -> сообщение
+        self._delayed: dict[asyncio.TimerHandle, DeliveryJob] = {}
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0}
+
+    @property
+    def size(self) -> int:
+        """Количество сообщений в очереди."""
+        return self._queue.qsize()
+
+    @property
+    def free_slots(self) -> int:
+        """Сколько сообщений еще поместится в очередь."""
+        return self._queue.maxsize - self._queue.qsize()
+
+    def start(self):
+        """Запустить воркеры."""
+        for i in range(self.workers_count):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"delivery-{i}"))
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Дождаться отправки очереди (не дольше timeout) и остановить воркеры.
+
+        Неотправленные результаты генераций возвращаются в очередь доставки
+        в БД, и их сразу забирает другой диспетчер.
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь доставки не опустела: осталось {self.size} сообщений")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+        pending = list(self._delayed.values())
+        for handle in self._delayed:
+            handle.cancel()
+        self._delayed.clear()
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+            self._queue.task_done()
+        await self._release(pending)
+
+    async def _release(self, jobs: list[DeliveryJob]):
+        request_ids = [
+            request_id
+            for job in jobs
+            for request_id in ([item.request_id for item in job.media] if job.media else [job.request_id])
+            if request_id
+        ]
+        if not request_ids:
+            return
+        try:
+            async with async_session_maker() as session:
+                await release_deliveries(session, request_ids)
+            logger.info(f"Неотправленные результаты возвращены в очередь доставки: {len(request_ids)}")
+        except Exception as e:
+            logger.error(f"Не удалось вернуть результаты в очередь доставки: {e}", exc_info=True)
+
+    def enqueue(self, job: DeliveryJob) -> bool:
+        """Поставить сообщение в очередь (не блокирует)."""
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.error(f"Очередь доставки переполнена, сообщение для {job.chat_id} отброшено")
+            return False
+
+    def _enqueue_later(self, job: DeliveryJob, delay: float):
+        """Вернуть сообщение в очередь через delay секунд."""
+        loop = asyncio.get_running_loop()
+
+        def put():
+            self._delayed.pop(handle, None)
+            self.enqueue(job)
+
+        handle = loop.call_later(delay, put)
+        self._delayed[handle] = job
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.peek(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(settings.DELIVERY_CHAT_RATE, settings.DELIVERY_CHAT_BURST)
+        # Обновляем TTL при каждом обращении
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                # Чат исчерпал лимит: откладываем, не занимая воркер
+                bucket = self._chat_bucket(job.chat_id)
+                delay = bucket.wait_time()
+                if delay > 0:
+                    self._enqueue_later(job, delay)
+                    continue
+                bucket.try_acquire()
+                with tracing.span("delivery.send", trace_id=job.trace_id, chat_id=job.chat_id):
+                    await self._global_bucket.acquire()
+                    await self._deliver(job)
+            except Exception as e:
+                logger.error(f"Ошибка в воркере доставки: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, job: DeliveryJob):
+        """Отправить сообщение, при временной ошибке запланировать повтор."""
+        job.attempts += 1
+        try:
+            if job.media:
+                messages = await self.bot.send_media_group(
+                    chat_id=job.chat_id,
+                    media=[
+                        InputMediaPhoto(media=item.photo, caption=job.text if i == 0 else None)
+                        for i, item in enumerate(job.media)
+                    ],
+                )
+                file_id = [message.photo[-1].file_id for message in messages]
+                for item, item_file_id in zip(job.media, file_id):
+                    result_cache.remember(item.cache_key, item_file_id)
+            elif job.photo:
+                message = await self.bot.send_photo(chat_id=job.chat_id, photo=job.photo, caption=job.text)
+                # Повторная отправка по file_id идет через CDN Telegram
+                file_id = message.photo[-1].file_id
+                result_cache.remember(job.cache_key, file_id)
+            else:
+                await self.bot.send_message(chat_id=job.chat_id, text=job.text)
+                file_id = None
+        except TelegramRetryAfter as e:
+            await self._retry(job, e.retry_after, e)
+            return
+        except (TelegramNetworkError, TelegramServerError) as e:
+            await self._retry(job, min(2 ** job.attempts, 60), e)
+            return
+        except Exception as e:
+            logger.error(f"Не удалось доставить сообщение в {job.chat_id}: {e}")
+            await self._finish(job, "failed")
+            return
+
+        logger.info(f"Сообщение доставлено в {job.chat_id}")
+        await self._finish(job, "sent", file_id)
+
+    async def _retry(self, job: DeliveryJob, delay: float, error: Exception):
+        if job.attempts >= self.max_retries:
+            logger.error(f"Доставка в {job.chat_id} не удалась после {job.attempts} попыток: {error}")
+            await self._finish(job, "failed")
+            return
+        self.stats["retried"] += 1
+        logger.warning(f"Повтор доставки в {job.chat_id} через {delay} с: {error}")
+        self._enqueue_later(job, delay)
+
+    async def _finish(
+        self, job: DeliveryJob, status: str, file_id: Optional[str | list[str]] = None
+    ):
+        """Учесть результат и записать статус доставки задач."""
+        self.stats[status] += 1
+
+        if job.media:
+            file_ids = file_id or [None] * len(job.media)
+            targets = [(item.request_id, fid) for item, fid in zip(job.media, file_ids)]
+        else:
+            targets = [(job.request_id, file_id)]
+        targets = [(request_id, fid) for request_id, fid in targets if request_id]
+        if not targets:
+            return
+
+        try:
+            async with async_session_maker() as session:
+                for request_id, fid in targets:
+                    values = {"delivery_status": status}
+                    if status == "sent":
+                        values["delivered_at"] = func.now()
+                    if fid:
+                        values["result_file_id"] = fid
+                    result = await session.execute(
+                        update(GenerationTask)
+                        .where(GenerationTask.request_id == request_id, hot_window())
+                        .values(**values)
+                        .returning(task_age())
+                    )
+                    # Дубликаты request_id не должны ронять запись статуса
+                    age = result.scalars().first()
+                    if status == "sent" and age is not None:
+                        GENERATION_DELIVERED.observe(float(age))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить статус доставки в {job.chat_id}: {e}", exc_info=True)
@@ -1,48 +1,108 @@
 """Клиент для API генерации изображений."""
 import logging
+import time
 from io import BytesIO
-from typing import Optional
+from typing import AsyncIterable, Optional, Union
 
 import aiohttp
 from aiohttp import FormData
 
+from config.logging_config import log_payload
 from config.settings import settings
+from services import tracing
+from services.metrics import GEN_API_LATENCY, GEN_API_RESPONSES
 
 logger = logging.getLogger(__name__)
 
+# Общий клиент приложения (устанавливается из main.py)
+_client: Optional["ImageGenerationClient"] = None
+
+
+def set_client(client_instance: "ImageGenerationClient"):
+    """Установить общий клиент."""
+    global _client
+    _client = client_instance
+
+
+def get_client() -> "ImageGenerationClient":
+    """Получить общий клиент."""
+    global _client
+    if _client is None:
+        _client = ImageGenerationClient()
+    return _client
+
 
 class ImageGenerationClient:
-    """Клиент для работы с API генерации изображений."""
+    """
+    Клиент для работы с API генерации изображений.
+
+    Держит одну aiohttp-сессию с пулом keep-alive соединений, чтобы запросы
+    не платили за новый TCP/TLS handshake. Сессия создается лениво и
+    закрывается через close().
+    """
 
     def __init__(self):
         self.api_url = settings.GEN_API_URL
         self.api_key = settings.GEN_API_KEY
         self.callback_url = settings.CALLBACK_URL
+        self._session: Optional[aiohttp.ClientSession] = None
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получить (или создать) HTTP-сессию с пулом соединений."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.GEN_API_POOL_LIMIT,
+                limit_per_host=settings.GEN_API_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=settings.GEN_API_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=settings.GEN_API_DNS_CACHE_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.GEN_API_TIMEOUT,
+                    connect=settings.GEN_API_CONNECT_TIMEOUT,
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        """Закрыть HTTP-сессию."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @tracing.traced("gen_api.submit")
     async def generate_image(
         self,
-        image_bytes: bytes,
+        image: Union[bytes, AsyncIterable[bytes]],
         prompt: str,
         model: str = "gpt-image-1",
         size: str = "1024x1024",
         quality: str = "low",
+        filename: str = "input.jpg",
+        content_type: str = "image/jpeg",
     ) -> Optional[dict]:
         """
         Отправить запрос на генерацию изображения.
 
         Args:
-            image_bytes: Байты изображения
+            image: Байты изображения или асинхронный поток чанков,
+                который передается в multipart без буферизации
             prompt: Описание для генерации
             model: Модель генерации
             size: Размер изображения
             quality: Качество изображения
+            filename: Имя файла в multipart
+            content_type: MIME-тип изображения
 
         Returns:
             Ответ API или None в случае ошибки
         """
         # Создаем FormData для multipart/form-data
         data = FormData()
-        data.add_field("image[]", BytesIO(image_bytes), filename="input.png", content_type="image/png")
+        if isinstance(image, bytes):
+            image = BytesIO(image)
+        data.add_field("image[]", image, filename=filename, content_type=content_type)
         data.add_field("prompt", prompt)
         data.add_field("model", model)
         data.add_field("quality", quality)
@@ -58,24 +118,66 @@ class ImageGenerationClient:
             "Accept": "application/json",
         }
 
+        started = time.perf_counter()
+        status = "error"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.api_url,
-                    headers=headers,
-                    data=data,
-                    timeout=aiohttp.ClientTimeout(total=30),
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logger.info(f"Генерация отправлена: {result}")
-                        return result
-                    else:
-                        error_text = await response.text()
-                        logger.error(
-                            f"Ошибка API генерации: {response.status} - {error_text}"
-                        )
-                        return None
+            session = self._get_session()
+            async with session.post(self.api_url, headers=headers, data=data) as response:
+                status = response.status
+                if response.status == 200:
+                    result = await response.json()
+                    logger.info(
+                        "Генерация отправлена",
+                        extra={
+                            "request_id": result.get("request_id"),
+                            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                        },
+                    )
+                    log_payload(logger, "Ответ API генерации", result)
+                    return result
+                else:
+                    error_text = await response.text()
+                    logger.error(
+                        f"Ошибка API генерации: {response.status} - {error_text}"
+                    )
+                    return None
         except Exception as e:
             logger.error(f"Исключение при генерации изображения: {e}", exc_info=True)
             return None
+        finally:
+            GEN_API_LATENCY.observe(time.perf_counter() - started, operation="submit")
+            GEN_API_RESPONSES.inc(operation="submit", status=status)
+
+    @tracing.traced("gen_api.status")
+    async def get_status(self, request_id: str) -> Optional[dict]:
+        """
+        Запросить статус генерации.
+
+        Returns:
+            Ответ API (в том же формате, что и callback) или None в случае ошибки
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Accept": "application/json",
+        }
+
+        started = time.perf_counter()
+        status = "error"
+        try:
+            session = self._get_session()
+            url = settings.GEN_API_STATUS_URL.format(request_id=request_id)
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                if response.status == 200:
+                    return await response.json()
+                error_text = await response.text()
+                logger.error(
+                    f"Ошибка API статуса генерации {request_id}: {response.status} - {error_text}"
+                )
+                return None
+        except Exception as e:
+            logger.error(f"Исключение при запросе статуса {request_id}: {e}", exc_info=True)
+            return None
+        finally:
+            GEN_API_LATENCY.observe(time.perf_counter() - started, operation="status")
+            GEN_API_RESPONSES.inc(operation="status", status=status)
@@ -0,0 +1,183 @@
+"""
+Доставка результатов генерации из БД.
+
+Результат сохраняется в задаче с delivery_status = queued (callback может
+прийти в любой процесс), а процессы, которые владеют доставкой, забирают
+такие задачи и ставят их в очередь DeliveryQueue.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from config.settings import settings
+from database import notify as pg
+from database.base import async_session_maker
+from services import metrics
+from services.delivery import DeliveryJob, DeliveryQueue, MediaItem
+from services.image_generation.tasks import (
+    claim_batch_delivery, claim_deliveries, ready_batches, requeue_stale_deliveries
+)
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY: будит диспетчеры в других процессах
+CHANNEL = "generation_delivery"
+
+OUTBOX = metrics.counter(
+    "delivery_outbox_total",
+    "Разбор результатов: claimed — одиночные, batches — альбомы, "
+    "requeued — возвращенные после аренды, errors — ошибки",
+    ("result",),
+)
+
+_outbox: Optional["DeliveryOutbox"] = None
+
+
+def set_outbox(outbox: Optional["DeliveryOutbox"]):
+    """Установить outbox процесса (None — доставкой владеют другие процессы)."""
+    global _outbox
+    _outbox = outbox
+
+
+def get_outbox() -> Optional["DeliveryOutbox"]:
+    """Получить outbox процесса."""
+    return _outbox
+
+
+async def notify():
+    """Сообщить, что появились результаты для доставки."""
+    if _outbox is not None:
+        _outbox.wake()
+        return
+    await pg.notify(CHANNEL)
+
+
+def _single_job(row) -> DeliveryJob:
+    return DeliveryJob(
+        chat_id=row.chat_id,
+        photo=row.result_url,
+        text="✅ Ваше изображение готово!",
+        request_id=row.request_id,
+        cache_key=row.input_key,
+        trace_id=row.trace_id,
+    )
+
+
+def _batch_job(rows) -> DeliveryJob:
+    # В media group должно быть не меньше двух элементов
+    if len(rows) == 1:
+        return _single_job(rows[0])
+    return DeliveryJob(
+        chat_id=rows[0].chat_id,
+        text=f"✅ Ваши изображения готовы ({len(rows)})!",
+        media=[
+            MediaItem(photo=row.result_url, request_id=row.request_id, cache_key=row.input_key)
+            for row in rows
+        ],
+        trace_id=rows[0].trace_id,
+    )
+
+
+class DeliveryOutbox:
+    """
+    Забирает результаты, ожидающие доставки, и ставит их в очередь.
+
+    Просыпается по wake() из этого процесса, по NOTIFY из других и раз в
+    OUTBOX_POLL_INTERVAL на случай пропущенных уведомлений. Задачи
+    забираются с SKIP LOCKED, поэтому диспетчеров может быть несколько.
+    Раз в OUTBOX_SWEEP_INTERVAL результаты, забранные больше
+    OUTBOX_DELIVERY_LEASE секунд назад и так и не доставленные, возвращаются
+    в очередь.
+    """
+
+    def __init__(self, queue: DeliveryQueue):
+        self.queue = queue
+        self.interval = settings.OUTBOX_POLL_INTERVAL
+        self.batch_size = settings.OUTBOX_BATCH_SIZE
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._listen_conn = None
+        self._last_sweep = float("-inf")
+
+    def start(self):
+        """Запустить разбор результатов."""
+        self._task = asyncio.create_task(self._loop(), name="delivery-outbox")
+
+    async def stop(self):
+        """Остановить разбор результатов."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await pg.unlisten(self._listen_conn, CHANNEL, self._on_notify)
+        self._listen_conn = None
+
+    def wake(self):
+        """Разобрать результаты, не дожидаясь опроса."""
+        self._wakeup.set()
+
+    def _on_notify(self, *args):
+        self.wake()
+
+    async def _loop(self):
+        self._listen_conn = await pg.listen(CHANNEL, self._on_notify)
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._sweep()
+                claimed = await self.run_once()
+            except Exception as e:
+                OUTBOX.inc(result="errors")
+                logger.error(f"Ошибка разбора результатов для доставки: {e}", exc_info=True)
+                claimed = 0
+            # Пачка забрана целиком — возможно, есть еще
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sweep(self):
+        """Вернуть в очередь результаты с просроченной арендой доставки."""
+        now = time.monotonic()
+        if now - self._last_sweep < settings.OUTBOX_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        async with async_session_maker() as session:
+            requeued = await requeue_stale_deliveries(session, settings.OUTBOX_DELIVERY_LEASE)
+        if requeued:
+            OUTBOX.inc(requeued, result="requeued")
+            logger.warning(f"Возвращено в очередь доставки результатов с просроченной арендой: {requeued}")
+
+    async def run_once(self) -> int:
+        """Забрать одну пачку результатов; возвращает количество заданий доставки."""
+        # Забираем не больше, чем поместится в очередь: забранная задача
+        # остается в sending, и отброшенный результат не был бы доставлен
+        limit = min(self.batch_size, self.queue.free_slots)
+        if limit <= 0:
+            return 0
+
+        async with async_session_maker() as session:
+            rows = await claim_deliveries(session, limit)
+            batch_ids = await ready_batches(session, limit - len(rows)) if len(rows) < limit else []
+            batches = []
+            for batch_id in batch_ids:
+                batch_rows = await claim_batch_delivery(session, batch_id)
+                if batch_rows:
+                    batches.append(batch_rows)
+
+        for row in rows:
+            self.queue.enqueue(_single_job(row))
+        for batch_rows in batches:
+            self.queue.enqueue(_batch_job(batch_rows))
+
+        if rows:
+            OUTBOX.inc(len(rows), result="claimed")
+        if batches:
+            OUTBOX.inc(len(batches), result="batches")
+        return len(rows) + len(batches)
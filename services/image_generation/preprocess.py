@@ -0,0 +1,146 @@
+"""Подготовка входного изображения перед загрузкой в API генерации."""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import AsyncIterable, Optional, Union
+
+from aiogram import Bot
+
+from config.settings import settings
+from services import metrics
+from services.telegram_files import stream_telegram_file
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_BYTES_IN = metrics.counter("preprocess_bytes_in_total", "Байт изображений до подготовки")
+PREPROCESS_BYTES_OUT = metrics.counter("preprocess_bytes_out_total", "Байт изображений после подготовки")
+PREPROCESS_ERRORS = metrics.counter("preprocess_errors_total", "Ошибки подготовки изображений")
+PREPROCESS_SECONDS = metrics.histogram(
+    "preprocess_seconds", "Время подготовки изображения, включая ожидание пула процессов"
+)
+
+# Общий препроцессор приложения (устанавливается из main.py)
+_preprocessor: Optional["ImagePreprocessor"] = None
+
+
+def set_preprocessor(preprocessor_instance: Optional["ImagePreprocessor"]):
+    """Установить препроцессор."""
+    global _preprocessor
+    _preprocessor = preprocessor_instance
+
+
+def get_preprocessor() -> Optional["ImagePreprocessor"]:
+    """Получить препроцессор (None, если обработка выключена)."""
+    return _preprocessor
+
+
+@dataclass
+class PreparedImage:
+    """Изображение, готовое к загрузке."""
+
+    data: Union[bytes, AsyncIterable[bytes]]
+    filename: str = "input.jpg"
+    content_type: str = "image/jpeg"
+
+
+def _process_image(data: bytes, size: str, jpeg_quality: int) -> tuple[bytes, str, str]:
+    """
+    Уменьшить изображение до size и перекодировать без метаданных.
+
+    Выполняется в отдельном процессе, поэтому Pillow импортируется здесь.
+    """
+    from PIL import Image, ImageOps
+
+    width, height = (int(x) for x in size.split("x"))
+
+    with Image.open(BytesIO(data)) as source:
+        # Учитываем поворот из EXIF до того, как метаданные будут отброшены
+        image = ImageOps.exif_transpose(source)
+        # Только уменьшение, пропорции сохраняются
+        image.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        out = BytesIO()
+        # EXIF и прочие метаданные не передаются в save, поэтому не сохраняются
+        if has_alpha:
+            image.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "input.png", "image/png"
+
+        image.convert("RGB").save(out, format="JPEG", quality=jpeg_quality, optimize=True)
+        return out.getvalue(), "input.jpg", "image/jpeg"
+
+
+class ImagePreprocessor:
+    """
+    Декодирует, уменьшает и перекодирует изображения в пуле процессов.
+
+    CPU-работа не выполняется в event loop. Размер до/после и время
+    обработки отдаются в /metrics (preprocess_*).
+    """
+
+    def __init__(self):
+        self.jpeg_quality = settings.PREPROCESS_JPEG_QUALITY
+        # fork процесса с event loop, потоками и соединениями с БД копирует
+        # их состояние (в том числе захваченные блокировки) в воркер. Воркеры
+        # forkserver порождаются отдельным процессом, который один раз
+        # импортирует __main__; импорт main.py не запускает потоков
+        # (логирование настраивается в lifespan). spawn — там, где forkserver нет
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(
+            max_workers=settings.PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context(method),
+        )
+
+    async def warm_up(self):
+        """Запустить процессы пула заранее: первое фото не ждет их старта."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, int) for _ in range(settings.PREPROCESS_WORKERS))
+        )
+
+    def shutdown(self):
+        """Остановить пул процессов."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def process(self, data: bytes, size: str) -> PreparedImage:
+        """Обработать изображение; при ошибке вернуть исходные байты."""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            processed, filename, content_type = await loop.run_in_executor(
+                self._executor, _process_image, data, size, self.jpeg_quality
+            )
+        except Exception as e:
+            PREPROCESS_ERRORS.inc()
+            logger.error(f"Ошибка подготовки изображения: {e}", exc_info=True)
+            return PreparedImage(data=data)
+
+        elapsed = time.perf_counter() - started
+        PREPROCESS_BYTES_IN.inc(len(data))
+        PREPROCESS_BYTES_OUT.inc(len(processed))
+        PREPROCESS_SECONDS.observe(elapsed)
+        logger.info(
+            f"Изображение подготовлено: {len(data)} -> {len(processed)} байт за {elapsed * 1000:.0f} мс"
+        )
+        return PreparedImage(data=processed, filename=filename, content_type=content_type)
+
+
+async def prepare_upload(bot: Bot, file_id: str, size: str) -> PreparedImage:
+    """
+    Подготовить фото Telegram к загрузке.
+
+    Если препроцессор выключен, файл передается потоком без буферизации
+    (фото Telegram всегда JPEG).
+    """
+    preprocessor = get_preprocessor()
+    if preprocessor is None:
+        return PreparedImage(data=stream_telegram_file(bot, file_id))
+
+    data = b"".join([chunk async for chunk in stream_telegram_file(bot, file_id)])
+    return await preprocessor.process(data, size)
@@ -0,0 +1,168 @@
+"""Сверка задач генерации, для которых не пришел callback."""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, tuple_
+
+from config.settings import settings
+from database.base import async_session_maker
+from database.models import SUBMIT_STATUSES, TERMINAL_STATUSES, GenerationTask
+from services import metrics, user_cache
+from services.credits import refund_credits
+from services.delivery import DeliveryJob, get_queue
+from services.image_generation.client import get_client
+from services.image_generation import outbox
+from services.image_generation.results import apply_generation_result
+from services.image_generation.tasks import transition_task
+from services.leader import LeaderElection
+
+logger = logging.getLogger(__name__)
+
+RECONCILED = metrics.counter(
+    "generation_reconcile_total", "Задачи генерации, проверенные сверкой, по результату", ("result",)
+)
+
+
+class GenerationReconciler:
+    """
+    Периодически опрашивает API по зависшим задачам.
+
+    Задачи старше RECONCILE_STALE_AFTER проверяются пачками; готовые
+    результаты применяются тем же путем, что и в gen_callback. Задачи
+    старше RECONCILE_DEADLINE переводятся в failed с возвратом кредитов.
+
+    При нескольких диспетчерах сверку выполняет только лидер.
+    """
+
+    def __init__(self, leader: Optional[LeaderElection] = None):
+        self.leader = leader
+        self.interval = settings.RECONCILE_INTERVAL
+        self.batch_size = settings.RECONCILE_BATCH_SIZE
+        self._semaphore = asyncio.Semaphore(settings.RECONCILE_CONCURRENCY)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "runs": 0,
+            "checked": 0,
+            "recovered": 0,
+            "failed": 0,
+            "expired": 0,
+            "still_pending": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """Запустить периодическую сверку."""
+        self._task = asyncio.create_task(self._loop(), name="generation-reconciler")
+
+    async def stop(self):
+        """Остановить сверку."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.leader is None or self.leader.is_leader:
+                    await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Ошибка сверки задач генерации: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Проверить все зависшие задачи (пачками)."""
+        self.stats["runs"] += 1
+        now = datetime.now(timezone.utc)
+        stale_before = now - timedelta(seconds=settings.RECONCILE_STALE_AFTER)
+        deadline = now - timedelta(seconds=settings.RECONCILE_DEADLINE)
+
+        cursor = None
+        while True:
+            batch = await self._load_batch(stale_before, cursor)
+            if not batch:
+                break
+
+            await asyncio.gather(*(self._reconcile(task, deadline) for task in batch))
+
+            if len(batch) < self.batch_size:
+                break
+            cursor = (batch[-1].created_at, batch[-1].id)
+
+    async def _load_batch(self, stale_before: datetime, cursor):
+        """Пачка незавершенных задач (по частичному индексу ix_generation_tasks_active)."""
+        query = select(
+            GenerationTask.id,
+            GenerationTask.request_id,
+            GenerationTask.user_id,
+            GenerationTask.created_at,
+        ).where(
+            GenerationTask.status.notin_(TERMINAL_STATUSES),
+            # Задачи, еще не отправленные провайдеру, ведет очередь запуска
+            GenerationTask.status.notin_(SUBMIT_STATUSES),
+            GenerationTask.created_at < stale_before,
+        )
+        if cursor:
+            query = query.where(tuple_(GenerationTask.created_at, GenerationTask.id) > tuple_(*cursor))
+        query = query.order_by(GenerationTask.created_at, GenerationTask.id).limit(self.batch_size)
+
+        async with async_session_maker() as session:
+            result = await session.execute(query)
+            return result.all()
+
+    async def _reconcile(self, task, deadline: datetime):
+        async with self._semaphore:
+            try:
+                self.stats["checked"] += 1
+                response = await get_client().get_status(task.request_id)
+                status = response.get("status") if response else None
+
+                if status in TERMINAL_STATUSES:
+                    await apply_generation_result(task.request_id, status, response)
+                    self._count("recovered" if status == "success" else "failed")
+                    logger.info(f"Задача {task.request_id} восстановлена сверкой: {status}")
+                elif task.created_at < deadline:
+                    await self._expire(task)
+                else:
+                    self._count("still_pending")
+            except Exception as e:
+                self._count("errors")
+                logger.error(f"Ошибка сверки задачи {task.request_id}: {e}", exc_info=True)
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        RECONCILED.inc(result=result)
+
+    async def _expire(self, task):
+        """Завершить просроченную задачу и вернуть кредиты (одной транзакцией)."""
+        async with async_session_maker() as session:
+            row = await transition_task(session, task.request_id, "failed", commit=False)
+            if row is None:
+                await session.rollback()
+                return
+            balance = await refund_credits(session, row.user_id, settings.GENERATION_COST, commit=False)
+            await session.commit()
+        if balance is not None:
+            user_cache.set_balance(row.user_id, balance)
+
+        self._count("expired")
+        logger.warning(f"Задача {task.request_id} просрочена, кредиты возвращены")
+
+        if row.batch_id:
+            # Готовые результаты альбома больше не ждут эту задачу
+            await outbox.notify()
+
+        queue = get_queue()
+        if queue:
+            queue.enqueue(
+                DeliveryJob(
+                    chat_id=row.chat_id,
+                    text="⌛ Генерация не завершилась вовремя. Кредиты возвращены.",
+                )
+            )
@@ -0,0 +1,85 @@
+"""Кэш результатов генерации по содержимому запроса."""
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from database.models import GenerationTask
+from services import metrics
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Ключ запроса -> file_id Telegram (предпочтительно) или result_url
+_cache: Optional[TTLCache[str]] = None
+
+LOOKUPS = metrics.counter(
+    "result_cache_lookups_total",
+    "Поиск готового результата: memory — in-process кэш, db — БД, miss — не найден",
+    ("result",),
+)
+
+
+def _get_cache() -> TTLCache[str]:
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(maxsize=settings.RESULT_CACHE_SIZE, ttl=settings.RESULT_CACHE_TTL)
+    return _cache
+
+
+def make_key(file_unique_id: str, prompt: str, model: str, size: str) -> str:
+    """
+    Ключ запроса генерации.
+
+    file_unique_id одинаков для одного и того же файла, даже если
+    пользователь отправил его повторно.
+    """
+    raw = "\x1f".join((file_unique_id, prompt, model, size))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def remember(key: Optional[str], photo: str) -> None:
+    """Запомнить результат (file_id или URL) для ключа."""
+    if settings.RESULT_CACHE_ENABLED and key:
+        _get_cache().set(key, photo)
+
+
+async def lookup(session: AsyncSession, key: str) -> Optional[str]:
+    """
+    Найти готовый результат для ключа.
+
+    Сначала проверяется in-process кэш, затем последняя успешная задача
+    с тем же ключом в БД (переживает перезапуск и общая для воркеров).
+    """
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+
+    photo = _get_cache().get(key)
+    if photo is not None:
+        LOOKUPS.inc(result="memory")
+        return photo
+
+    since = datetime.now(timezone.utc) - timedelta(seconds=settings.RESULT_CACHE_TTL)
+    result = await session.execute(
+        # file_id переиспользуется без повторной загрузки в Telegram
+        select(func.coalesce(GenerationTask.result_file_id, GenerationTask.result_url))
+        .where(
+            GenerationTask.input_key == key,
+            GenerationTask.status == "success",
+            GenerationTask.created_at >= since,
+        )
+        .order_by(GenerationTask.id.desc())
+        .limit(1)
+    )
+    photo = result.scalar_one_or_none()
+    if photo is None:
+        LOOKUPS.inc(result="miss")
+        return None
+    LOOKUPS.inc(result="db")
+    _get_cache().set(key, photo)
+    return photo
+
@@ -0,0 +1,136 @@
+"""Применение результатов генерации (callback и сверка)."""
+import logging
+from typing import Optional
+
+from sqlalchemy import exists, select
+
+from config.settings import settings
+from database.base import async_session_maker
+from database.models import TERMINAL_STATUSES, GenerationTask
+from services.credits import refund_credits
+from services.delivery import DeliveryJob, get_queue
+from services.image_generation import outbox, result_cache
+from services.image_generation.tasks import get_task_by_request_id, hot_window, transition_task
+from services import tracing, user_cache
+from services.metrics import GENERATION_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+def extract_image_url(payload: dict) -> Optional[str]:
+    """Извлечь URL изображения из ответа API генерации."""
+    if payload.get("result"):
+        result_data = payload["result"]
+        if isinstance(result_data, list) and len(result_data) > 0:
+            return result_data[0]
+        elif isinstance(result_data, str):
+            return result_data
+    elif payload.get("full_response"):
+        full_response = payload["full_response"]
+        if isinstance(full_response, list) and len(full_response) > 0:
+            return full_response[0].get("url")
+    return None
+
+
+async def apply_generation_result(request_id: str, status: str, payload: dict) -> dict:
+    """
+    Применить результат генерации к задаче и передать ее на доставку.
+
+    Используется и webhook'ом, и сверкой зависших задач: переход статуса
+    условный, поэтому результат доставляется ровно один раз. Отправку
+    выполняет процесс, владеющий доставкой (см. services.image_generation.outbox).
+    Если задача завершилась неудачей, кредиты возвращаются в той же
+    транзакции, что и перевод в failed, — тоже ровно один раз.
+
+    "retry": True в ответе — результат пришел раньше, чем отправка задачи
+    записана (request_id неизвестен, пока задачи еще отправляются, или задача
+    не завершена): callback нужно повторить.
+    """
+    image_url = None
+    if status == "success":
+        image_url = extract_image_url(payload)
+        if not image_url:
+            logger.error(
+                "Не удалось извлечь image_url из payload",
+                extra={"request_id": request_id, "payload": payload},
+            )
+
+    new_status = "failed" if status == "success" and not image_url else status
+
+    balance = None
+    async with async_session_maker() as session:
+        # Один условный UPDATE: доставку и возврат выполняет только первый callback
+        task = await transition_task(
+            session,
+            request_id,
+            new_status,
+            result_url=image_url,
+            delivery_status="queued" if image_url else None,
+            commit=False,
+        )
+
+        if task is None:
+            existing = await get_task_by_request_id(session, request_id)
+            if existing is None:
+                # Callback мог прийти раньше, чем воркер записал request_id
+                # (finish_submission): провайдер должен повторить его позже
+                # Один запрос — один снимок: finish_submission, зафиксированная
+                # между запросами, видна либо как submitting, либо как request_id
+                submitting = await session.scalar(
+                    select(
+                        exists().where(GenerationTask.status == "submitting", hot_window())
+                        | exists().where(GenerationTask.request_id == request_id, hot_window())
+                    )
+                )
+                if submitting:
+                    logger.warning(f"Unknown request_id={request_id}, есть задачи в отправке: просим повторить")
+                    return {"ok": False, "error": "Unknown request_id", "retry": True}
+                logger.error(f"Unknown request_id={request_id}")
+                return {"ok": False, "error": "Unknown request_id"}
+
+            if existing.status not in TERMINAL_STATUSES:
+                # request_id записан, но перевод задачи не увидел его строку
+                # (транзакция finish_submission еще не была зафиксирована)
+                logger.warning(f"Request {request_id} еще не готов к результату: просим повторить")
+                return {"ok": False, "error": "Task is not ready", "retry": True}
+
+            logger.info(f"Request {request_id} уже обработан, игнорируем")
+            return {"ok": True}
+
+        if new_status == "failed":
+            balance = await refund_credits(session, task.user_id, settings.GENERATION_COST, commit=False)
+        await session.commit()
+
+    if balance is not None:
+        user_cache.set_balance(task.user_id, balance)
+    GENERATION_COMPLETED.observe(float(task.age), status=new_status)
+    tracing.link(task.trace_id)
+
+    # Отправка идет в фоне: провайдер не ждет ответа Telegram. Результаты
+    # альбома уходят вместе, когда завершится последняя задача
+    if image_url or (task.batch_id and new_status in TERMINAL_STATUSES):
+        await outbox.notify()
+
+    if new_status == "failed":
+        queue = get_queue()
+        if queue:
+            queue.enqueue(
+                DeliveryJob(
+                    chat_id=task.chat_id,
+                    text="❌ Генерация не удалась. Кредиты возвращены.",
+                )
+            )
+
+    if status == "success":
+        if not image_url:
+            return {"ok": False, "error": "Image URL not found"}
+
+        result_cache.remember(task.input_key, image_url)
+        return {"ok": True, "request_id": request_id}
+
+    elif status == "failed":
+        logger.warning(f"Генерация завершилась со статусом: {status}")
+        return {"ok": False, "status": status}
+    else:
+        logger.warning(f"Генерация не завершилась статус: {status}")
+        return {"ok": False, "status": status}
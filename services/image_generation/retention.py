@@ -0,0 +1,196 @@
+"""Обслуживание партиций generation_tasks: создание заранее, архивирование и удаление старых."""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import bindparam, text
+
+from config.settings import settings
+from database import partitions
+from database.base import get_engine
+from database.models import TERMINAL_STATUSES
+from services import metrics
+from services.leader import LeaderElection
+
+logger = logging.getLogger(__name__)
+
+# Строк на одну запись в архив
+ARCHIVE_CHUNK_SIZE = 1000
+
+RUNS = metrics.counter(
+    "generation_partition_runs_total", "Запуски обслуживания партиций generation_tasks", ("job", "result")
+)
+PARTITIONS = metrics.counter(
+    "generation_partitions_total",
+    "Партиции generation_tasks: created — созданы, archived — выгружены и удалены, "
+    "skipped — не удалены из-за незавершенных задач",
+    ("result",),
+)
+ARCHIVED_ROWS = metrics.counter("generation_archived_rows_total", "Строки generation_tasks, выгруженные в архив")
+DEFAULT_ROWS = metrics.gauge(
+    "generation_default_partition_rows", "Строки в партиции по умолчанию при последней проверке (в норме 0)"
+)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _write_chunk(archive, rows: list[dict]):
+    archive.write(
+        "".join(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows).encode()
+    )
+
+
+def _finish_archive(archive, tmp_path: Path, path: Path):
+    archive.close()
+    with open(tmp_path, "rb") as file:
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class _Periodic:
+    """Задача, которая раз в interval выполняет run_once (только на лидере)."""
+
+    name = "periodic"
+
+    def __init__(self, interval: float, leader: Optional[LeaderElection] = None):
+        self.leader = leader
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запустить периодическое выполнение."""
+        self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self):
+        """Остановить периодическое выполнение."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.leader is None or self.leader.is_leader:
+                    await self.run_once()
+                    RUNS.inc(job=self.name, result="ok")
+            except Exception as e:
+                RUNS.inc(job=self.name, result="error")
+                logger.error(f"Ошибка обслуживания партиций generation_tasks ({self.name}): {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        raise NotImplementedError
+
+
+class PartitionMaintenance(_Periodic):
+    """
+    Раз в GEN_TASK_PARTITIONS_INTERVAL создает партиции на
+    GEN_TASK_PARTITIONS_AHEAD месяцев вперед и проверяет, что партиция по
+    умолчанию пуста. Работает независимо от GEN_TASK_RETENTION_ENABLED.
+    """
+
+    name = "generation-partitions"
+
+    def __init__(self, leader: Optional[LeaderElection] = None):
+        super().__init__(settings.GEN_TASK_PARTITIONS_INTERVAL, leader)
+
+    async def run_once(self):
+        """Создать недостающие партиции."""
+        async with get_engine().begin() as conn:
+            created = await partitions.maintain(conn, settings.GEN_TASK_PARTITIONS_AHEAD)
+            default_rows = await partitions.default_rows_count(conn)
+
+        for partition in created:
+            PARTITIONS.inc(result="created")
+            logger.info(f"Создана партиция {partition.name}")
+        DEFAULT_ROWS.set(default_rows)
+        if default_rows:
+            logger.error(
+                f"В {partitions.DEFAULT_PARTITION} есть строки вне помесячных партиций",
+                extra={"partition": partitions.DEFAULT_PARTITION, "rows": default_rows},
+            )
+
+
+class TaskRetention(_Periodic):
+    """
+    Раз в GEN_TASK_RETENTION_INTERVAL выгружает партиции, целиком старше
+    GEN_TASK_RETENTION_DAYS, в GEN_TASK_ARCHIVE_DIR/<партиция>.jsonl.gz.
+    Партиция удаляется только после того, как архив записан на диск. При
+    нескольких диспетчерах архивирование выполняет только лидер.
+    """
+
+    name = "generation-retention"
+
+    def __init__(self, leader: Optional[LeaderElection] = None):
+        super().__init__(settings.GEN_TASK_RETENTION_INTERVAL, leader)
+        self.archive_dir = Path(settings.GEN_TASK_ARCHIVE_DIR)
+
+    async def run_once(self):
+        """Заархивировать и удалить устаревшие партиции."""
+        async with get_engine().connect() as conn:
+            existing = await partitions.list_partitions(conn)
+
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=settings.GEN_TASK_RETENTION_DAYS)
+        for partition in existing:
+            if partition.end <= cutoff:
+                await self._retire(partition)
+
+    async def _retire(self, partition: partitions.Partition):
+        async with get_engine().connect() as conn:
+            # Незавершенные задачи и недоставленные результаты еще нужны
+            busy = await conn.scalar(
+                text(
+                    f"SELECT EXISTS (SELECT 1 FROM {partition.name} "
+                    "WHERE status NOT IN :terminal OR delivery_status IN ('queued', 'sending'))"
+                ).bindparams(bindparam("terminal", list(TERMINAL_STATUSES), expanding=True))
+            )
+        if busy:
+            PARTITIONS.inc(result="skipped")
+            logger.warning(f"Партиция {partition.name} не удалена: в ней есть незавершенные задачи")
+            return
+
+        rows = await self._archive(partition)
+        async with get_engine().begin() as conn:
+            await partitions.drop_partition(conn, partition)
+
+        PARTITIONS.inc(result="archived")
+        ARCHIVED_ROWS.inc(rows)
+        logger.info(
+            "Партиция generation_tasks заархивирована и удалена",
+            extra={"partition": partition.name, "rows": rows},
+        )
+
+    async def _archive(self, partition: partitions.Partition) -> int:
+        """Выгрузить партицию в <archive_dir>/<партиция>.jsonl.gz; возвращает число строк."""
+        await asyncio.to_thread(self.archive_dir.mkdir, parents=True, exist_ok=True)
+        path = self.archive_dir / f"{partition.name}.jsonl.gz"
+        tmp_path = path.with_name(path.name + ".tmp")
+
+        # Сжатие и запись идут в потоке, чтобы не блокировать event loop
+        archive = await asyncio.to_thread(gzip.open, tmp_path, "wb")
+        rows = 0
+        try:
+            async with get_engine().connect() as conn:
+                result = await conn.stream(text(f"SELECT * FROM {partition.name} ORDER BY id"))
+                async for chunk in result.mappings().partitions(ARCHIVE_CHUNK_SIZE):
+                    await asyncio.to_thread(_write_chunk, archive, [dict(row) for row in chunk])
+                    rows += len(chunk)
+            await asyncio.to_thread(_finish_archive, archive, tmp_path, path)
+        except BaseException:
+            archive.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return rows
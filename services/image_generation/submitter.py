@@ -0,0 +1,250 @@
+"""Очередь запуска генераций: воркеры отправляют задачи из БД провайдеру."""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+
+from config.settings import settings
+from database import notify as pg
+from database.base import async_session_maker
+from services import metrics, tracing, user_cache
+from services.credits import refund_credits
+from services.delivery import DeliveryJob, get_queue
+from services.image_generation import outbox
+from services.image_generation.client import get_client
+from services.image_generation.preprocess import prepare_upload
+from services.image_generation.tasks import DuplicateRequestId, claim_submissions, finish_submission
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY: будит воркеры в других процессах
+CHANNEL = "generation_submit"
+
+SUBMISSIONS = metrics.counter(
+    "generation_submissions_total", "Попытки отправки задач провайдеру", ("result",)
+)
+QUEUE_WAIT = metrics.histogram(
+    "generation_queue_wait_seconds", "Время от подтверждения до отправки задачи провайдеру"
+)
+
+_submitter: Optional["GenerationSubmitter"] = None
+
+
+def set_submitter(submitter: Optional["GenerationSubmitter"]):
+    """Установить воркеры процесса (None — задачи отправляют другие процессы)."""
+    global _submitter
+    _submitter = submitter
+
+
+async def notify():
+    """Сообщить, что в очереди появились задачи."""
+    if _submitter is not None:
+        _submitter.wake()
+        return
+    await pg.notify(CHANNEL)
+
+
+async def submit_generation(bot: Bot, file_id: str, prompt: str, model: str, size: str) -> Optional[dict]:
+    """
+    Отправить фото Telegram на генерацию.
+
+    Файл уменьшается под размер или передается потоком без буферизации.
+
+    Returns:
+        Ответ API или None в случае ошибки
+    """
+    try:
+        upload = await prepare_upload(bot, file_id, size)
+    except Exception as e:
+        logger.error(f"Не удалось получить файл {file_id}: {e}", exc_info=True)
+        return None
+
+    return await get_client().generate_image(
+        image=upload.data,
+        prompt=prompt,
+        model=model,
+        size=size,
+        filename=upload.filename,
+        content_type=upload.content_type,
+    )
+
+
+class GenerationSubmitter:
+    """
+    Забирает задачи в статусе queued (SKIP LOCKED, пачками) и отправляет их
+    провайдеру, не больше GEN_SUBMIT_CONCURRENCY одновременно.
+
+    Неудачная отправка повторяется с экспоненциальной задержкой; после
+    GEN_SUBMIT_MAX_ATTEMPTS попыток задача завершается с возвратом кредитов.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.concurrency = settings.GEN_SUBMIT_CONCURRENCY
+        self.batch_size = settings.GEN_SUBMIT_BATCH_SIZE
+        self.interval = settings.GEN_SUBMIT_POLL_INTERVAL
+        self.max_attempts = settings.GEN_SUBMIT_MAX_ATTEMPTS
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        self._listen_conn = None
+
+    def start(self):
+        """Запустить воркеры."""
+        self._task = asyncio.create_task(self._loop(), name="generation-submitter")
+
+    async def stop(self, timeout: float = 10.0):
+        """Перестать забирать задачи и дождаться текущих отправок (не дольше timeout)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await pg.unlisten(self._listen_conn, CHANNEL, self._on_notify)
+        self._listen_conn = None
+        if self._running:
+            # Прерванные задачи остаются в submitting и вернутся в очередь после аренды
+            await asyncio.wait(list(self._running), timeout=timeout)
+            for task in self._running:
+                task.cancel()
+
+    def wake(self):
+        """Забрать задачи, не дожидаясь опроса."""
+        self._wakeup.set()
+
+    def _on_notify(self, *args):
+        self.wake()
+
+    async def _loop(self):
+        self._listen_conn = await pg.listen(CHANNEL, self._on_notify)
+        while True:
+            self._wakeup.clear()
+            limit = min(self.batch_size, self.concurrency - len(self._running))
+            claimed = 0
+            if limit > 0:
+                try:
+                    claimed = await self._claim(limit)
+                except Exception as e:
+                    logger.error(f"Ошибка чтения очереди запуска генераций: {e}", exc_info=True)
+            # Забрали полную пачку и есть свободные воркеры — возможно, в очереди есть еще
+            if claimed == limit == self.batch_size and len(self._running) < self.concurrency:
+                continue
+            # Разбудят новая задача или освободившийся воркер
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, limit: int) -> int:
+        async with async_session_maker() as session:
+            rows = await claim_submissions(session, limit, settings.GEN_SUBMIT_LEASE)
+        for row in rows:
+            task = asyncio.create_task(self._submit(row))
+            self._running.add(task)
+            task.add_done_callback(self._done)
+        return len(rows)
+
+    def _done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self.wake()
+
+    async def _submit(self, row):
+        with tracing.span("generation.submit", trace_id=row.trace_id, task_id=row.id, attempt=row.attempts):
+            try:
+                response = await submit_generation(
+                    self.bot, row.input_file_id, row.prompt, row.model, row.size
+                )
+                request_id = response.get("request_id") if response else None
+                if request_id:
+                    await self._submitted(row, str(request_id))
+                elif row.attempts < self.max_attempts:
+                    await self._retry(row)
+                else:
+                    await self._fail(row)
+            except Exception as e:
+                # Задача остается в submitting и вернется в очередь после аренды
+                SUBMISSIONS.inc(result="error")
+                logger.error(f"Ошибка отправки задачи {row.id}: {e}", exc_info=True)
+
+    def _lease_lost(self, row, request_id: Optional[str] = None):
+        """Аренда истекла, и задачу уже забрал другой воркер: результат этой попытки отброшен."""
+        SUBMISSIONS.inc(result="lease_lost")
+        logger.warning(
+            "Аренда задачи истекла до записи результата отправки",
+            extra={"task_id": row.id, "attempt": row.attempts, "request_id": request_id},
+        )
+
+    async def _submitted(self, row, request_id: str):
+        try:
+            async with async_session_maker() as session:
+                result = await finish_submission(
+                    session, row.id, row.attempts, "pending", request_id=request_id
+                )
+        except DuplicateRequestId:
+            # Callback по такому request_id нельзя однозначно отнести к задаче:
+            # отправляем заново и получаем новый request_id
+            SUBMISSIONS.inc(result="duplicate")
+            logger.error(
+                "Провайдер вернул request_id, уже записанный у другой задачи",
+                extra={"task_id": row.id, "request_id": request_id},
+            )
+            if row.attempts < self.max_attempts:
+                await self._retry(row)
+            else:
+                await self._fail(row)
+            return
+        if result is None:
+            # Задачу отправит воркер с новой арендой; request_id этой попытки
+            # останется без задачи, и его callback будет отклонен
+            self._lease_lost(row, request_id)
+            return
+        SUBMISSIONS.inc(result="submitted")
+        QUEUE_WAIT.observe(float(result.age))
+        logger.info(
+            "Задача отправлена провайдеру",
+            extra={"task_id": row.id, "request_id": request_id, "user_id": row.user_id},
+        )
+
+    async def _retry(self, row):
+        delay = min(
+            settings.GEN_SUBMIT_RETRY_DELAY * 2 ** (row.attempts - 1),
+            settings.GEN_SUBMIT_RETRY_MAX_DELAY,
+        )
+        async with async_session_maker() as session:
+            result = await finish_submission(session, row.id, row.attempts, "queued", retry_in=delay)
+        if result is None:
+            self._lease_lost(row)
+            return
+        SUBMISSIONS.inc(result="retry")
+        logger.warning(f"Задача {row.id} не отправлена (попытка {row.attempts}), повтор через {delay} с")
+
+    async def _fail(self, row):
+        # Перевод в failed и возврат кредитов — одна транзакция
+        async with async_session_maker() as session:
+            result = await finish_submission(session, row.id, row.attempts, "failed", commit=False)
+            if result is None:
+                await session.rollback()
+                self._lease_lost(row)
+                return
+            balance = await refund_credits(session, row.user_id, settings.GENERATION_COST, commit=False)
+            await session.commit()
+        if balance is not None:
+            user_cache.set_balance(row.user_id, balance)
+        SUBMISSIONS.inc(result="failed")
+        logger.error(f"Задача {row.id} не отправлена после {row.attempts} попыток, кредиты возвращены")
+
+        if row.batch_id:
+            # Готовые результаты альбома больше не ждут эту задачу
+            await outbox.notify()
+
+        queue = get_queue()
+        if queue:
+            queue.enqueue(
+                DeliveryJob(
+                    chat_id=row.chat_id,
+                    text="❌ Не удалось запустить генерацию. Кредиты возвращены. Попробуйте позже.",
+                )
+            )
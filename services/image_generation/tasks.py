@@ -1,61 +1,447 @@
 """Утилиты для работы с задачами генерации."""
+import logging
+from datetime import timedelta
 from typing import Optional
 
-from sqlalchemy import select
+from sqlalchemy import Row, exists, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import func
 
-from database.models import GenerationTask
+from config.settings import settings
+from database.models import SUBMIT_STATUSES, TERMINAL_STATUSES, GenerationTask
+from services import tracing, usage_stats
 
+logger = logging.getLogger(__name__)
 
-async def create_generation_task(
+# Пространство ключей pg_advisory_xact_lock(int, int) для проверки request_id
+REQUEST_ID_LOCK_ID = 7_100_006
+
+
+async def create_generation_tasks(
     session: AsyncSession,
     user_id: int,
     chat_id: int,
-    request_id: str,
+    inputs: list[tuple[str, Optional[str]]],
     prompt: str,
     model: str = "gpt-image-1",
     size: str = "1024x1024",
-) -> GenerationTask:
-    """Создать задачу генерации."""
-    task = GenerationTask(
-        user_id=user_id,
-        chat_id=chat_id,
-        request_id=request_id,
-        prompt=prompt,
-        model=model,
-        size=size,
-        status="pending",
-    )
-    session.add(task)
+    batch_id: Optional[str] = None,
+    credits: int = 0,
+) -> list[GenerationTask]:
+    """
+    Поставить задачи генерации в очередь запуска одним commit.
+
+    Провайдеру задачи отправляют воркеры GenerationSubmitter. В той же
+    транзакции обновляются дневные счетчики (usage_stats).
+
+    Args:
+        inputs: Пары (file_id входного фото, input_key)
+        credits: Списанные за задачи кредиты
+    """
+    tasks = [
+        GenerationTask(
+            user_id=user_id,
+            chat_id=chat_id,
+            prompt=prompt,
+            model=model,
+            size=size,
+            input_file_id=file_id,
+            input_key=input_key,
+            batch_id=batch_id,
+            trace_id=tracing.current_trace_id(),
+            status="queued",
+            next_attempt_at=func.now(),
+        )
+        for file_id, input_key in inputs
+    ]
+    session.add_all(tasks)
+    await usage_stats.record_created(session, user_id, len(tasks), credits)
     await session.commit()
-    await session.refresh(task)
-    return task
+    return tasks
+
+
+def hot_window():
+    """
+    SQL-условие: задача создана не раньше GEN_TASK_HOT_DAYS дней назад.
+
+    Callback'и и доставка относятся к недавним задачам; с этим условием
+    запрос читает только последние помесячные партиции generation_tasks.
+    """
+    return GenerationTask.created_at >= func.now() - timedelta(days=settings.GEN_TASK_HOT_DAYS)
 
 
 async def get_task_by_request_id(
     session: AsyncSession, request_id: str
 ) -> Optional[GenerationTask]:
-    """Получить задачу по request_id."""
-    result = await session.execute(
-        select(GenerationTask).where(GenerationTask.request_id == request_id)
+    """
+    Получить задачу по request_id (сначала в горячих партициях, затем во всех).
+
+    Уникальность request_id БД не гарантирует (ключ партиции — created_at):
+    при дубликатах возвращается самая ранняя задача.
+    """
+    query = (
+        select(GenerationTask)
+        .where(GenerationTask.request_id == request_id)
+        .order_by(GenerationTask.id)
+        .limit(2)
     )
-    return result.scalar_one_or_none()
+    tasks = (await session.execute(query.where(hot_window()))).scalars().all()
+    if not tasks:
+        tasks = (await session.execute(query)).scalars().all()
+    if len(tasks) > 1:
+        logger.warning(
+            "Несколько задач с одним request_id",
+            extra={"request_id": request_id, "task_ids": [task.id for task in tasks]},
+        )
+    return tasks[0] if tasks else None
 
 
-async def update_task_status(
+async def transition_task(
     session: AsyncSession,
     request_id: str,
     status: str,
     result_url: Optional[str] = None,
-) -> Optional[GenerationTask]:
-    """Обновить статус задачи."""
-    task = await get_task_by_request_id(session, request_id)
-    if task:
-        task.status = status
-        if result_url:
-            task.result_url = result_url
+    delivery_status: Optional[str] = None,
+    commit: bool = True,
+) -> Optional[Row]:
+    """
+    Перевести незавершенную задачу в новый статус одним запросом.
+
+    UPDATE срабатывает только для задачи, которая еще не в терминальном
+    статусе, поэтому из повторных или параллельных callback'ов доставку
+    выполняет только первый. Ищется только в горячих партициях: задачи
+    старше RECONCILE_DEADLINE уже завершены сверкой. При дубликатах
+    request_id переводится одна задача — самая ранняя из незавершенных.
+
+    Args:
+        commit: False — не фиксировать транзакцию (вызывающий делает
+            commit вместе с возвратом кредитов)
+
+    Returns:
+        Строка (chat_id, user_id, input_key, batch_id, trace_id, age) или None, если задача
+        неизвестна или уже завершена; age — секунды с создания задачи
+    """
+    values = {"status": status}
+    if result_url:
+        values["result_url"] = result_url
+    if delivery_status:
+        values["delivery_status"] = delivery_status
+
+    unfinished = (
+        GenerationTask.request_id == request_id,
+        GenerationTask.status.notin_(TERMINAL_STATUSES),
+        hot_window(),
+    )
+    first = (
+        select(GenerationTask.id)
+        .where(*unfinished)
+        .order_by(GenerationTask.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(GenerationTask)
+        # Условия по request_id и hot_window повторяются для отсечения партиций
+        .where(GenerationTask.id == first, *unfinished)
+        .values(**values)
+        .returning(
+            GenerationTask.chat_id,
+            GenerationTask.user_id,
+            GenerationTask.input_key,
+            GenerationTask.batch_id,
+            GenerationTask.trace_id,
+            task_age().label("age"),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is not None:
+        await usage_stats.record_finished(session, row.user_id, status)
+    if commit:
         await session.commit()
-        await session.refresh(task)
-    return task
+    return row
+
+
+def task_age():
+    """SQL-выражение: секунды с момента создания задачи."""
+    return func.extract("epoch", func.now() - GenerationTask.created_at)
+
+
+async def claim_batch_delivery(session: AsyncSession, batch_id: str) -> list[Row]:
+    """
+    Забрать результаты альбома на доставку, если все его задачи завершены.
+
+    Условный UPDATE переводит delivery_status из queued в sending, поэтому
+    альбом забирает только один из параллельных callback'ов.
+
+    Returns:
+        Строки (request_id, result_url, chat_id, input_key, trace_id) по порядку задач
+        или пустой список
+    """
+    unfinished = (
+        select(GenerationTask.id)
+        .where(
+            GenerationTask.batch_id == batch_id,
+            GenerationTask.status.notin_(TERMINAL_STATUSES),
+        )
+    )
+    result = await session.execute(
+        update(GenerationTask)
+        .where(
+            GenerationTask.batch_id == batch_id,
+            GenerationTask.status == "success",
+            GenerationTask.delivery_status == "queued",
+            ~exists(unfinished),
+        )
+        .values(delivery_status="sending", delivery_claimed_at=func.now())
+        .returning(
+            GenerationTask.id,
+            GenerationTask.request_id,
+            GenerationTask.result_url,
+            GenerationTask.chat_id,
+            GenerationTask.input_key,
+            GenerationTask.trace_id,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = sorted(result.all(), key=lambda row: row.id)
+    await session.commit()
+    return rows
+
+
+async def claim_deliveries(session: AsyncSession, limit: int) -> list[Row]:
+    """
+    Забрать на доставку готовые результаты одиночных задач.
+
+    Строки блокируются с SKIP LOCKED, поэтому несколько диспетчеров
+    разбирают результаты без пересечений.
+
+    Returns:
+        Строки (request_id, result_url, chat_id, input_key, trace_id) по порядку задач
+    """
+    claimable = (
+        select(GenerationTask.id)
+        .where(
+            GenerationTask.delivery_status == "queued",
+            GenerationTask.batch_id.is_(None),
+        )
+        .order_by(GenerationTask.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(GenerationTask)
+        .where(GenerationTask.id.in_(claimable.scalar_subquery()))
+        .values(delivery_status="sending", delivery_claimed_at=func.now())
+        .returning(
+            GenerationTask.id,
+            GenerationTask.request_id,
+            GenerationTask.result_url,
+            GenerationTask.chat_id,
+            GenerationTask.input_key,
+            GenerationTask.trace_id,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = sorted(result.all(), key=lambda row: row.id)
+    await session.commit()
+    return rows
+
+
+async def requeue_stale_deliveries(session: AsyncSession, lease: float) -> int:
+    """
+    Вернуть в очередь доставки результаты, забранные больше lease секунд назад.
 
+    Забранный результат живет только в памяти процесса (DeliveryQueue): если
+    процесс упал или остановился, не доставив его, задача осталась бы в
+    sending навсегда. Доставка получается «хотя бы один раз»: слишком
+    медленная отправка может повториться.
 
+    Returns:
+        Количество возвращенных задач
+    """
+    result = await session.execute(
+        update(GenerationTask)
+        .where(
+            GenerationTask.delivery_status == "sending",
+            # Задачи, забранные до появления аренды, тоже считаются просроченными
+            func.coalesce(GenerationTask.delivery_claimed_at, GenerationTask.updated_at)
+            < func.now() - timedelta(seconds=lease),
+        )
+        .values(delivery_status="queued", delivery_claimed_at=None)
+        .returning(GenerationTask.id)
+        .execution_options(synchronize_session=False)
+    )
+    count = len(result.all())
+    await session.commit()
+    return count
+
+
+async def release_deliveries(session: AsyncSession, request_ids: list[str]):
+    """Вернуть в очередь доставки результаты, которые процесс не успел отправить."""
+    await session.execute(
+        update(GenerationTask)
+        .where(
+            GenerationTask.request_id.in_(request_ids),
+            GenerationTask.delivery_status == "sending",
+            hot_window(),
+        )
+        .values(delivery_status="queued", delivery_claimed_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+async def ready_batches(session: AsyncSession, limit: int) -> list[str]:
+    """batch_id альбомов, все задачи которых завершены, а результаты ждут доставки."""
+    other = aliased(GenerationTask)
+    unfinished = select(other.id).where(
+        other.batch_id == GenerationTask.batch_id,
+        other.status.notin_(TERMINAL_STATUSES),
+    )
+    result = await session.execute(
+        select(GenerationTask.batch_id)
+        .where(
+            GenerationTask.delivery_status == "queued",
+            GenerationTask.batch_id.is_not(None),
+            ~exists(unfinished),
+        )
+        .distinct()
+        .limit(limit)
+    )
+    return list(result.scalars())
+
+
+async def claim_submissions(session: AsyncSession, limit: int, lease: float) -> list[Row]:
+    """
+    Забрать задачи из очереди запуска.
+
+    Задачи переводятся в submitting на время аренды lease секунд; если
+    процесс упадет, не записав результат, задачу по истечении аренды заберет
+    другой воркер.
+
+    Returns:
+        Строки (id, user_id, chat_id, input_file_id, prompt, model, size,
+        attempts, batch_id, trace_id)
+    """
+    claimable = (
+        select(GenerationTask.id)
+        .where(
+            GenerationTask.status.in_(SUBMIT_STATUSES),
+            GenerationTask.next_attempt_at <= func.now(),
+        )
+        .order_by(GenerationTask.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(GenerationTask)
+        .where(GenerationTask.id.in_(claimable.scalar_subquery()))
+        .values(
+            status="submitting",
+            attempts=GenerationTask.attempts + 1,
+            next_attempt_at=func.now() + timedelta(seconds=lease),
+        )
+        .returning(
+            GenerationTask.id,
+            GenerationTask.user_id,
+            GenerationTask.chat_id,
+            GenerationTask.input_file_id,
+            GenerationTask.prompt,
+            GenerationTask.model,
+            GenerationTask.size,
+            GenerationTask.attempts,
+            GenerationTask.batch_id,
+            GenerationTask.trace_id,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    await session.commit()
+    return rows
+
+
+class DuplicateRequestId(Exception):
+    """request_id от провайдера уже записан у другой задачи."""
+
+
+async def _check_request_id(session: AsyncSession, task_id: int, request_id: str):
+    """
+    Проверить, что request_id не записан у другой задачи.
+
+    Уникальный индекс по request_id на секционированной таблице невозможен
+    (в него должен входить created_at), поэтому проверка идет под advisory
+    lock транзакции на request_id. Задачи старше горячего окна завершены и
+    callback'и по ним не принимаются, поэтому проверяется только оно.
+    """
+    await session.execute(
+        select(func.pg_advisory_xact_lock(REQUEST_ID_LOCK_ID, func.hashtext(request_id)))
+    )
+    other = await session.scalar(
+        select(GenerationTask.id)
+        .where(GenerationTask.request_id == request_id, GenerationTask.id != task_id, hot_window())
+        .limit(1)
+    )
+    if other is not None:
+        raise DuplicateRequestId(f"request_id {request_id} уже записан у задачи {other}")
+
+
+async def finish_submission(
+    session: AsyncSession,
+    task_id: int,
+    attempt: int,
+    status: str,
+    request_id: Optional[str] = None,
+    retry_in: Optional[float] = None,
+    commit: bool = True,
+) -> Optional[Row]:
+    """
+    Записать результат отправки задачи провайдеру.
+
+    status: pending (отправлена, ждем callback), queued (повтор через
+    retry_in секунд) или failed. UPDATE срабатывает, только пока задача в
+    submitting с тем же номером попытки attempt (из claim_submissions):
+    после истечения аренды задачу забирает другой воркер с новым номером, и
+    поздний результат прежней аренды ее не перезапишет.
+
+    Args:
+        commit: False — не фиксировать транзакцию (вызывающий делает
+            commit вместе со своими изменениями, например возвратом кредитов)
+
+    Returns:
+        Строка (user_id, chat_id, batch_id, age) или None, если аренда
+        потеряна
+
+    Raises:
+        DuplicateRequestId: request_id уже записан у другой задачи
+    """
+    values = {"status": status, "next_attempt_at": None}
+    if request_id:
+        await _check_request_id(session, task_id, request_id)
+        values["request_id"] = request_id
+    if retry_in is not None:
+        values["next_attempt_at"] = func.now() + timedelta(seconds=retry_in)
+
+    result = await session.execute(
+        update(GenerationTask)
+        .where(
+            GenerationTask.id == task_id,
+            GenerationTask.status == "submitting",
+            GenerationTask.attempts == attempt,
+        )
+        .values(**values)
+        .returning(
+            GenerationTask.user_id,
+            GenerationTask.chat_id,
+            GenerationTask.batch_id,
+            task_age().label("age"),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is not None:
+        await usage_stats.record_finished(session, row.user_id, status)
+    if commit:
+        await session.commit()
+    return row
@@ -0,0 +1,100 @@
+"""Выбор лидера через advisory lock Postgres для фоновых задач в одном экземпляре."""
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config.settings import settings
+from database.base import get_dedicated_engine
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключи advisory lock фоновых задач (MIGRATION_LOCK_ID = 7_100_001)
+RECONCILER_LOCK_ID = 7_100_002
+PAYMENT_RECONCILER_LOCK_ID = 7_100_003
+RETENTION_LOCK_ID = 7_100_004
+
+LEADER = metrics.gauge(
+    "leader", "1, если процесс выполняет фоновую задачу в единственном экземпляре", ("name",)
+)
+
+
+class LeaderElection:
+    """
+    Лидерство держится, пока открыто соединение с захваченным
+    pg_try_advisory_lock. Остальные процессы периодически пробуют захватить
+    блокировку и становятся лидером, когда соединение прежнего лидера
+    закрывается (остановка, падение, обрыв сети).
+    """
+
+    def __init__(self, name: str, lock_id: int):
+        self.name = name
+        self.lock_id = lock_id
+        self.interval = settings.LEADER_CHECK_INTERVAL
+        self.is_leader = False
+        self._conn: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+        LEADER.set(0, name=name)
+
+    def start(self):
+        """Запустить попытки захвата лидерства."""
+        self._task = asyncio.create_task(self._loop(), name=f"leader-{self.name}")
+
+    async def stop(self):
+        """Остановить и отпустить блокировку."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._release()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._check()
+            except Exception as e:
+                logger.warning(f"Лидерство {self.name}: ошибка соединения с БД: {e}")
+                await self._release()
+            await asyncio.sleep(self.interval)
+
+    async def _check(self):
+        if self._conn is None:
+            self._conn = await get_dedicated_engine().connect()
+        if self.is_leader:
+            # Блокировка живет, пока живо соединение: проверяем, что оно не оборвалось
+            await self._conn.execute(text("SELECT 1"))
+            acquired = True
+        else:
+            acquired = await self._conn.scalar(
+                text("SELECT pg_try_advisory_lock(:id)"), {"id": self.lock_id}
+            )
+        # Session-level блокировка переживает commit; соединение не висит в транзакции
+        await self._conn.commit()
+        if acquired:
+            self._set_leader(True)
+
+    def _set_leader(self, value: bool):
+        if value != self.is_leader:
+            logger.info(f"Лидерство {self.name}: {'получено' if value else 'потеряно'}")
+        self.is_leader = value
+        LEADER.set(1 if value else 0, name=self.name)
+
+    async def _release(self):
+        self._set_leader(False)
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            # Соединение вне пула закрывается физически, и блокировка
+            # снимается вместе с ним; unlock_all — на случай обрыва закрытия
+            await conn.execute(text("SELECT pg_advisory_unlock_all()"))
+            await conn.commit()
+            await conn.close()
+        except Exception:
+            await conn.invalidate()
@@ -0,0 +1,63 @@
+"""Дневная сводка выручки по тарифам."""
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import PaymentDailyStats
+
+
+class PlanRevenue(NamedTuple):
+    """Строка сводки: тариф за день."""
+
+    day: date
+    plan: int
+    payments: int
+    revenue: Decimal
+    credits: int
+
+
+async def record_payment(session: AsyncSession, amount: Decimal, credits: int):
+    """
+    Учесть успешный платеж в сводке за текущий день (без commit).
+
+    Вызывается в транзакции зачисления, поэтому сводка меняется ровно
+    один раз на платеж и откатывается вместе с ним.
+    """
+    stats = PaymentDailyStats.__table__.c
+    await session.execute(
+        insert(PaymentDailyStats)
+        .values(
+            day=datetime.now(timezone.utc).date(),
+            plan=int(amount),
+            payments=1,
+            revenue=amount,
+            credits=credits,
+        )
+        .on_conflict_do_update(
+            index_elements=[stats.day, stats.plan],
+            set_={
+                "payments": stats.payments + 1,
+                "revenue": stats.revenue + amount,
+                "credits": stats.credits + credits,
+            },
+        )
+    )
+
+
+async def daily_revenue(session: AsyncSession, since: date, until: Optional[date] = None) -> list[PlanRevenue]:
+    """Сводка по дням и тарифам за период [since, until] (по умолчанию — до сегодня)."""
+    query = select(
+        PaymentDailyStats.day,
+        PaymentDailyStats.plan,
+        PaymentDailyStats.payments,
+        PaymentDailyStats.revenue,
+        PaymentDailyStats.credits,
+    ).where(PaymentDailyStats.day >= since)
+    if until is not None:
+        query = query.where(PaymentDailyStats.day <= until)
+    result = await session.execute(query.order_by(PaymentDailyStats.day, PaymentDailyStats.plan))
+    return [PlanRevenue(*row) for row in result.all()]
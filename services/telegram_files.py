@@ -0,0 +1,22 @@
+"""Утилиты для работы с файлами Telegram."""
+from typing import AsyncIterator
+
+from aiogram import Bot
+
+# Размер чанка при чтении файла из Bot API
+CHUNK_SIZE = 64 * 1024
+
+
+async def stream_telegram_file(
+    bot: Bot, file_id: str, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Потоково прочитать файл Telegram по file_id.
+
+    Файл не загружается в память целиком: чанки отдаются по мере
+    получения из Bot API.
+    """
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url=url, chunk_size=chunk_size):
+        yield chunk
@@ -0,0 +1,257 @@
+"""Легковесная трассировка: спаны в памяти и (опционально) в JSONL-файле."""
+import atexit
+import functools
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+
+from config.settings import settings
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+SPANS_DROPPED = metrics.counter(
+    "trace_spans_dropped_total", "Спаны, не записанные в TRACE_FILE из-за переполнения очереди"
+)
+
+
+@dataclass
+class Span:
+    """Завершенный или текущий участок работы."""
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: float = 0.0
+    duration: Optional[float] = None
+    attrs: dict = field(default_factory=dict)
+    # trace_id других трасс, с которыми связан спан (например, callback -> confirm_generation)
+    links: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+# Последние завершенные спаны для /debug/traces (создается при первом спане)
+_buffer: Optional[deque[Span]] = None
+# Очередь и поток записи в TRACE_FILE (создаются при первом спане)
+_queue: Optional[queue.Queue] = None
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_STOP = object()
+
+
+def _new_id(nbytes: int) -> str:
+    return secrets.token_hex(nbytes)
+
+
+def _write_spans(spans: queue.Queue, path: str):
+    """
+    Поток записи: сериализует спаны и пишет их в файл.
+
+    flush выполняется, когда очередь опустела, а не после каждого спана.
+    """
+    try:
+        file = open(path, "a", encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"Не удалось открыть {path} для спанов: {e}")
+        file = None
+    while True:
+        item = spans.get()
+        if item is _STOP:
+            break
+        if file is None:
+            continue
+        try:
+            file.write(json.dumps(asdict(item), ensure_ascii=False, default=str) + "\n")
+            if spans.empty():
+                file.flush()
+        except OSError as e:
+            logger.warning(f"Не удалось записать спан в {path}: {e}")
+    if file is not None:
+        file.close()
+
+
+def _start_writer() -> queue.Queue:
+    global _queue, _writer
+    with _writer_lock:
+        if _queue is None:
+            spans = queue.Queue(maxsize=settings.TRACE_QUEUE_SIZE)
+            _writer = threading.Thread(
+                target=_write_spans, args=(spans, settings.TRACE_FILE), name="trace-writer", daemon=True
+            )
+            _writer.start()
+            _queue = spans
+            atexit.register(close)
+    return _queue
+
+
+def _export(item: Span):
+    """Сохранить завершенный спан в буфер и передать потоку записи в файл."""
+    global _buffer
+    if _buffer is None:
+        _buffer = deque(maxlen=settings.TRACE_BUFFER_SIZE)
+    _buffer.append(item)
+    if not settings.TRACE_FILE:
+        return
+    try:
+        (_queue or _start_writer()).put_nowait(item)
+    except queue.Full:
+        SPANS_DROPPED.inc()
+
+
+def current_span() -> Optional[Span]:
+    """Текущий спан."""
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    """trace_id текущей трассы или None."""
+    item = _current_span.get()
+    return item.trace_id if item else None
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Открыть спан на время блока.
+
+    Без trace_id спан продолжает текущую трассу (или начинает новую);
+    с trace_id — продолжает указанную, например при доставке результата.
+    """
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if trace_id is None and parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        parent_id = None
+
+    item = Span(
+        name=name,
+        trace_id=trace_id or _new_id(16),
+        span_id=_new_id(8),
+        parent_id=parent_id,
+        start=time.time(),
+        attrs=attrs,
+    )
+    started = time.perf_counter()
+    token = _current_span.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        item.duration = time.perf_counter() - started
+        _export(item)
+
+
+def traced(name: str):
+    """Декоратор: выполнить корутину внутри спана name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name: str, start: float, duration: float, error: Optional[str] = None, **attrs):
+    """Записать уже завершенный дочерний спан текущего (например, SQL-запрос)."""
+    if not settings.TRACING_ENABLED:
+        return
+    parent = _current_span.get()
+    if parent is None:
+        return
+    _export(
+        Span(
+            name=name,
+            trace_id=parent.trace_id,
+            span_id=_new_id(8),
+            parent_id=parent.span_id,
+            start=start,
+            duration=duration,
+            attrs=attrs,
+            error=error,
+        )
+    )
+
+
+def instrument_engine(sync_engine):
+    """Записывать SQL-запросы движка как дочерние спаны."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._trace_start = (time.time(), time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started, perf_started = context._trace_start
+        record("db.query", started, time.perf_counter() - perf_started, statement=statement[:200])
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        context = exception_context.execution_context
+        if context is None or not hasattr(context, "_trace_start"):
+            return
+        started, perf_started = context._trace_start
+        record(
+            "db.query",
+            started,
+            time.perf_counter() - perf_started,
+            error=str(exception_context.original_exception),
+            statement=(exception_context.statement or "")[:200],
+        )
+
+
+def link(trace_id: Optional[str]):
+    """Связать текущий спан с другой трассой."""
+    item = _current_span.get()
+    if item is not None and trace_id and trace_id != item.trace_id:
+        item.links.append(trace_id)
+
+
+def get_spans(trace_id: Optional[str] = None, limit: int = 200) -> list[dict]:
+    """
+    Спаны из буфера, новые первыми.
+
+    С trace_id — спаны этой трассы и трасс, которые на нее ссылаются.
+    """
+    buffer = _buffer or ()
+    if trace_id:
+        linked = {item.trace_id for item in buffer if trace_id in item.links}
+        linked.add(trace_id)
+        items = [item for item in buffer if item.trace_id in linked]
+    else:
+        items = list(buffer)
+    return [asdict(item) for item in reversed(items[-limit:])]
+
+
+def close():
+    """Дописать оставшиеся спаны, остановить поток записи и закрыть файл."""
+    global _queue, _writer
+    with _writer_lock:
+        spans, writer = _queue, _writer
+        _queue = _writer = None
+    if spans is not None:
+        # Блокирующий put: стоп-маркер не должен потеряться при полной очереди
+        spans.put(_STOP)
+        writer.join()
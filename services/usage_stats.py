@@ -0,0 +1,208 @@
+"""Дневные счетчики генераций для /stats и /admin/stats."""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import GenerationDailyStats, GenerationTask, UserDailyActivity
+from services.revenue import daily_revenue
+
+# Строк счетчиков на день: транзакции разных пользователей обновляют разные строки
+STATS_SHARDS = 8
+
+
+class DailyUsage(NamedTuple):
+    """Счетчики генераций за день."""
+
+    day: date
+    created: int
+    succeeded: int
+    failed: int
+    credits_spent: int
+    credits_refunded: int
+    active_users: int
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        """Доля успешных среди завершенных задач."""
+        finished = self.succeeded + self.failed
+        return self.succeeded / finished if finished else None
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+async def _bump(session: AsyncSession, user_id: int, **deltas: int):
+    """Прибавить значения к строке счетчиков сегодняшнего дня (без commit)."""
+    stats = GenerationDailyStats.__table__.c
+    await session.execute(
+        insert(GenerationDailyStats)
+        .values(day=_today(), shard=user_id % STATS_SHARDS, **deltas)
+        .on_conflict_do_update(
+            index_elements=[stats.day, stats.shard],
+            set_={name: stats[name] + value for name, value in deltas.items()},
+        )
+    )
+
+
+async def record_created(session: AsyncSession, user_id: int, count: int, credits: int):
+    """Учесть задачи, поставленные в очередь, и активность пользователя (без commit)."""
+    result = await session.execute(
+        insert(UserDailyActivity)
+        .values(day=_today(), user_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(UserDailyActivity.user_id)
+    )
+    first_today = result.scalar_one_or_none() is not None
+    await _bump(
+        session,
+        user_id,
+        created=count,
+        credits_spent=credits,
+        active_users=1 if first_today else 0,
+    )
+
+
+async def record_finished(session: AsyncSession, user_id: int, status: str):
+    """Учесть завершение задачи со статусом success или failed (без commit)."""
+    if status == "success":
+        await _bump(session, user_id, succeeded=1)
+    elif status == "failed":
+        await _bump(session, user_id, failed=1)
+
+
+async def record_refund(session: AsyncSession, user_id: int, credits: int):
+    """Учесть возврат кредитов за незавершенную генерацию (без commit)."""
+    await _bump(session, user_id, credits_refunded=credits)
+
+
+async def daily_usage(session: AsyncSession, since: date, until: Optional[date] = None) -> list[DailyUsage]:
+    """
+    Счетчики по дням за период [since, until] (по умолчанию — до сегодня).
+
+    Читает не больше STATS_SHARDS строк на день, независимо от размера
+    generation_tasks.
+    """
+    query = select(
+        GenerationDailyStats.day,
+        func.sum(GenerationDailyStats.created),
+        func.sum(GenerationDailyStats.succeeded),
+        func.sum(GenerationDailyStats.failed),
+        func.sum(GenerationDailyStats.credits_spent),
+        func.sum(GenerationDailyStats.credits_refunded),
+        func.sum(GenerationDailyStats.active_users),
+    ).where(GenerationDailyStats.day >= since)
+    if until is not None:
+        query = query.where(GenerationDailyStats.day <= until)
+    result = await session.execute(
+        query.group_by(GenerationDailyStats.day).order_by(GenerationDailyStats.day)
+    )
+    return [DailyUsage(row[0], *map(int, row[1:])) for row in result.all()]
+
+
+async def stats_report(session: AsyncSession, days: int = 7) -> list[dict]:
+    """
+    Сводка за последние days дней (новые первыми): генерации, кредиты,
+    активные пользователи и выручка. Только агрегатные таблицы.
+    """
+    until = _today()
+    since = until - timedelta(days=days - 1)
+    usage = {row.day: row for row in await daily_usage(session, since, until)}
+    revenue: dict[date, dict] = {}
+    for row in await daily_revenue(session, since, until):
+        totals = revenue.setdefault(row.day, {"payments": 0, "revenue": 0})
+        totals["payments"] += row.payments
+        totals["revenue"] += row.revenue
+
+    report = []
+    for offset in range(days):
+        day = until - timedelta(days=offset)
+        row = usage.get(day) or DailyUsage(day, 0, 0, 0, 0, 0, 0)
+        totals = revenue.get(day, {"payments": 0, "revenue": 0})
+        report.append({
+            **row._asdict(),
+            "day": day.isoformat(),
+            "success_rate": row.success_rate,
+            "payments": totals["payments"],
+            "revenue": float(totals["revenue"]),
+        })
+    return report
+
+
+_BACKFILL_EVENTS = text(
+    """
+    INSERT INTO generation_daily_stats
+        (day, shard, created, succeeded, failed, credits_spent, credits_refunded, active_users)
+    SELECT day, shard, sum(created), sum(succeeded), sum(failed), sum(created) * :cost, 0, 0
+    FROM (
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day, user_id % :shards AS shard,
+               1 AS created, 0 AS succeeded, 0 AS failed
+        FROM generation_tasks
+        WHERE created_at >= :since AND created_at < :until
+        UNION ALL
+        SELECT (updated_at AT TIME ZONE 'UTC')::date, user_id % :shards,
+               0, (status = 'success')::int, (status = 'failed')::int
+        FROM generation_tasks
+        WHERE status IN ('success', 'failed') AND updated_at >= :since AND updated_at < :until
+    ) AS events
+    GROUP BY day, shard
+    """
+)
+
+_BACKFILL_ACTIVITY = text(
+    """
+    INSERT INTO user_daily_activity (day, user_id)
+    SELECT DISTINCT (created_at AT TIME ZONE 'UTC')::date, user_id
+    FROM generation_tasks
+    WHERE created_at >= :since AND created_at < :until
+    ON CONFLICT DO NOTHING
+    """
+)
+
+_BACKFILL_ACTIVE_USERS = text(
+    """
+    UPDATE generation_daily_stats AS stats
+    SET active_users = activity.users
+    FROM (
+        SELECT day, user_id % :shards AS shard, count(*) AS users
+        FROM user_daily_activity
+        WHERE day >= :since_day AND day < :until_day
+        GROUP BY day, shard
+    ) AS activity
+    WHERE stats.day = activity.day AND stats.shard = activity.shard
+    """
+)
+
+
+async def backfill(session: AsyncSession, since: date, until: date, cost: int):
+    """
+    Пересчитать счетчики за дни [since, until) по generation_tasks (с commit).
+
+    Завершение задачи относится ко дню updated_at, списание — к дню
+    создания по текущей цене cost; возвраты кредитов в истории не хранятся
+    и остаются нулевыми. Текущий день пересчитывать не стоит: его счетчики
+    обновляются параллельно.
+    """
+    params = {
+        "since": datetime.combine(since, time.min, tzinfo=timezone.utc),
+        "until": datetime.combine(until, time.min, tzinfo=timezone.utc),
+        "since_day": since,
+        "until_day": until,
+        "shards": STATS_SHARDS,
+        "cost": cost,
+    }
+    for model in (GenerationDailyStats, UserDailyActivity):
+        await session.execute(delete(model).where(model.day >= since, model.day < until))
+    await session.execute(_BACKFILL_EVENTS, params)
+    await session.execute(_BACKFILL_ACTIVITY, params)
+    await session.execute(_BACKFILL_ACTIVE_USERS, params)
+    await session.commit()
+
+
+async def first_task_day(session: AsyncSession) -> Optional[date]:
+    """День самой старой задачи генерации."""
+    first = await session.scalar(select(func.min(GenerationTask.created_at)))
+    return first.astimezone(timezone.utc).date() if first else None
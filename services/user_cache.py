@@ -0,0 +1,89 @@
+"""Кэш профилей и балансов пользователей."""
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from sqlalchemy import select
+
+from config.settings import settings
+from database.base import async_session_maker
+from database.models import User
+from services import metrics
+from services.cache import TTLCache
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Снимок пользователя в кэше."""
+
+    id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    credits: int
+
+
+# Кэш по Telegram id. Списания и начисления обновляют его сразу (write-through),
+# TTL ограничивает устаревание при изменениях из других процессов. Баланс из
+# кэша только показывается пользователю: проверки перед списанием читают БД
+# (services.credits.get_balance), а само списание — условный UPDATE.
+_cache: Optional[TTLCache[CachedUser]] = None
+
+LOOKUPS = metrics.counter("user_cache_lookups_total", "Поиск пользователя в кэше", ("result",))
+metrics.gauge(
+    "user_cache_size",
+    "Пользователи в кэше",
+    function=lambda: len(_cache) if _cache is not None else 0,
+)
+
+
+def _get_cache() -> TTLCache[CachedUser]:
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+    return _cache
+
+
+def remember_user(user: User) -> CachedUser:
+    """Сохранить пользователя в кэш."""
+    cached = CachedUser(
+        id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        credits=user.credits,
+    )
+    _get_cache().set(user.id, cached)
+    return cached
+
+
+def get_cached_user(user_id: int) -> Optional[CachedUser]:
+    """Получить пользователя только из кэша."""
+    cached = _get_cache().get(user_id)
+    LOOKUPS.inc(result="miss" if cached is None else "hit")
+    return cached
+
+
+async def get_user(user_id: int) -> Optional[CachedUser]:
+    """Получить пользователя из кэша или из БД."""
+    cached = get_cached_user(user_id)
+    if cached is not None:
+        return cached
+
+    async with async_session_maker() as session:
+        result = await session.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+
+    if user is None:
+        return None
+    return remember_user(user)
+
+
+def set_balance(user_id: int, credits: int) -> None:
+    """Обновить баланс пользователя в кэше, если он там есть."""
+    cache = _get_cache()
+    cached = cache.peek(user_id)
+    if cached is not None:
+        cache.set(user_id, replace(cached, credits=credits))
+
+
+def invalidate(user_id: int) -> None:
+    """Удалить пользователя из кэша."""
+    _get_cache().pop(user_id)
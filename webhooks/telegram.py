@@ -0,0 +1,110 @@
+"""Webhook для приема обновлений Telegram."""
+import asyncio
+import logging
+import secrets
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+from fastapi import APIRouter, HTTPException, Request
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/telegram", tags=["telegram"])
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Глобальные переменные для бота и диспетчера (устанавливаются из main.py)
+_bot: Bot = None
+_dp: Dispatcher = None
+
+# Обновления, которые обрабатываются в фоне
+_background_tasks: set[asyncio.Task] = set()
+
+
+def set_bot(bot_instance):
+    """Установить bot instance."""
+    global _bot
+    _bot = bot_instance
+
+
+def set_dispatcher(dispatcher: Dispatcher):
+    """Установить dispatcher instance."""
+    global _dp
+    _dp = dispatcher
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """
+    Зарегистрировать webhook в Telegram.
+
+    Регистрация выполняется при каждом старте: getWebhookInfo не отдает
+    секрет, поэтому проверить, что Telegram знает текущий WEBHOOK_SECRET,
+    нельзя. setWebhook с теми же параметрами безопасно повторять из
+    нескольких воркеров.
+    """
+    if not settings.TELEGRAM_WEBHOOK_URL:
+        raise RuntimeError("TELEGRAM_WEBHOOK_URL не задан для BOT_MODE=webhook")
+    if not settings.WEBHOOK_SECRET:
+        # Без секрета обновления от имени Telegram может прислать кто угодно
+        raise RuntimeError("WEBHOOK_SECRET не задан для BOT_MODE=webhook")
+
+    allowed_updates = dp.resolve_used_update_types()
+    info = await bot.get_webhook_info()
+    if info.url != settings.TELEGRAM_WEBHOOK_URL or set(info.allowed_updates or ()) != set(allowed_updates):
+        logger.info(
+            "Параметры Telegram webhook изменились",
+            extra={"url": info.url, "allowed_updates": info.allowed_updates},
+        )
+
+    while True:
+        try:
+            await bot.set_webhook(
+                url=settings.TELEGRAM_WEBHOOK_URL,
+                secret_token=settings.WEBHOOK_SECRET,
+                allowed_updates=allowed_updates,
+            )
+            break
+        except TelegramRetryAfter as e:
+            # Воркеры регистрируют webhook одновременно
+            await asyncio.sleep(e.retry_after)
+    logger.info(f"Telegram webhook зарегистрирован: {settings.TELEGRAM_WEBHOOK_URL}")
+
+
+async def shutdown(timeout: float = 10.0) -> None:
+    """Дождаться обработки принятых обновлений перед остановкой."""
+    if not _background_tasks:
+        return
+    logger.info(f"Ожидание обработки {len(_background_tasks)} обновлений...")
+    await asyncio.wait(list(_background_tasks), timeout=timeout)
+
+
+async def _process_update(update: Update) -> None:
+    """Передать обновление в диспетчер."""
+    try:
+        await _dp.feed_update(_bot, update)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+
+
+@router.post("/webhook")
+async def telegram_webhook(request: Request):
+    """Обработчик обновлений от Telegram."""
+    token = request.headers.get(SECRET_HEADER, "")
+    if not settings.WEBHOOK_SECRET or not secrets.compare_digest(token, settings.WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid secret token")
+
+    if _bot is None or _dp is None:
+        raise HTTPException(status_code=503, detail="Bot is not ready")
+
+    data = await request.json()
+    update = Update.model_validate(data, context={"bot": _bot})
+
+    # Отвечаем Telegram сразу, обработка идет в фоне
+    task = asyncio.create_task(_process_update(update))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    return {"ok": True}